@@ -1,5 +1,16 @@
+import os
+import json
+import hashlib
 import numpy as np
-from keras.models import model_from_json
+from collections import OrderedDict
+from mnist_data import set_basic_model_param
+from weight_io import load_weight_arrays
+
+
+# Keras (and with it Theano) is imported by load_model and ModelEvaluator
+# when they are first called, so the noise and accuracy functions here can
+# be used without loading a backend.
+PREDICTION_DIR = 'models/predictions'
 
 
 def load_model(path_to_model):
@@ -8,6 +19,7 @@ def load_model(path_to_model):
                 not including .json or .h5 at the end
     OUTPUT: (1) Trained and compiled Keras model
     '''
+    from keras.models import model_from_json
     json_file_name = '{}.json'.format(path_to_model)
     weights_file_name = '{}.h5'.format(path_to_model)
     model = model_from_json(open(json_file_name).read())
@@ -16,6 +28,194 @@ def load_model(path_to_model):
     return model
 
 
+class ModelEvaluator(object):
+    '''
+    Evaluates many saved models that share the compile_model architecture.
+
+    The graph is built once and only a prediction function is compiled (no
+    loss or optimizer), then each model is evaluated by swapping its weights
+    in. Models that differ only in batch size or dropout can share one
+    evaluator, since dropout is inactive at inference. The most recently
+    used weight sets are kept in memory, so returning to a model does not
+    read its .h5 file again. Use it in place of a model
+    from load_model:
+
+        evaluator = ModelEvaluator()
+        evaluator.load_weights('models/KerasBaseModel_v.0.1_y_0.1_32_1')
+        y_pred = evaluator.predict_classes(X_test)
+    '''
+    def __init__(self, model_param=None, max_cached_weights=16):
+        from keras import backend as K
+        from keras_model import build_model
+        if model_param is None:
+            model_param = set_basic_model_param(0)
+        self.model = build_model(model_param)
+        self._predict = K.function([self.model.get_input(train=False)],
+                                   [self.model.get_output(train=False)])
+        self.max_cached_weights = max_cached_weights
+        self._weights_cache = OrderedDict()
+
+    def load_weights(self, path_to_model):
+        '''
+        INPUT:  (1) String: The path to the saved model, not including .json
+                    or .h5 at the end
+        OUTPUT: None, but the model's weights are swapped in
+        '''
+        weights_file_name = '{}.h5'.format(path_to_model)
+        cache_key = (weights_file_name, os.path.getmtime(weights_file_name))
+        weights = self._weights_cache.pop(cache_key, None)
+        if weights is None:
+            weights = load_weight_arrays(weights_file_name)
+        self._weights_cache[cache_key] = weights
+        while len(self._weights_cache) > self.max_cached_weights:
+            self._weights_cache.popitem(last=False)
+        self.model.set_weights(weights)
+
+    def predict_proba(self, X, batch_size=128, verbose=0):
+        '''
+        INPUT:  (1) 4D numpy array: images to predict
+                (2) integer: images per forward pass
+        OUTPUT: (1) 2D numpy array: class probabilities, of shape
+                    (#imgs, #classes)
+        '''
+        return np.vstack([self._predict([X[start:start + batch_size]])[0]
+                          for start in range(0, X.shape[0], batch_size)])
+
+    def predict_classes(self, X, batch_size=128, verbose=0):
+        '''
+        INPUT:  (1) 4D numpy array: images to predict
+                (2) integer: images per forward pass
+        OUTPUT: (1) 1D numpy array: the predicted class of each image
+        '''
+        return np.argmax(self.predict_proba(X, batch_size=batch_size), axis=1)
+
+
+def file_sha1(file_name, chunk_size=2**20):
+    '''
+    INPUT:  (1) String: path to a file
+            (2) integer: bytes to read at a time
+    OUTPUT: (1) String: hex SHA-1 digest of the file's contents
+    '''
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class PredictionStore(object):
+    '''
+    Stores each model's predicted probabilities on a test set, so metrics
+    can be recalculated without running the models again.
+
+    The probabilities for a model are saved once as a float16 .npy file in
+    prediction_dir/test_set_name, alongside a small .json file recording
+    the SHA-1 of the weights they came from and of the test images. They
+    are recalculated if either changes. A ModelEvaluator is only built the
+    first time a model actually needs to be run.
+
+        store = PredictionStore(X_test)
+        probas = store.get_probas('models/KerasBaseModel_v.0.1_y_0.1_32_1')
+
+    Storing float16 halves the disk use; it can only change a prediction
+    where the top two probabilities agree to about three decimal places.
+    Freshly calculated probabilities are rounded to float16 too, so a
+    model's metrics are the same whether or not it was cached.
+    '''
+    def __init__(self, X_test, test_set_name='mnist_test',
+                 prediction_dir=PREDICTION_DIR, model_param=None):
+        self.X_test = X_test
+        self.X_test_sha1 = hashlib.sha1(
+            np.ascontiguousarray(X_test)).hexdigest()
+        self.prediction_dir = os.path.join(prediction_dir, test_set_name)
+        self.model_param = model_param
+        self._evaluator = None
+
+    def _get_evaluator(self):
+        if self._evaluator is None:
+            self._evaluator = ModelEvaluator(self.model_param)
+        return self._evaluator
+
+    def get_probas(self, path_to_model):
+        '''
+        INPUT:  (1) String: The path to the saved model, not including .json
+                    or .h5 at the end
+        OUTPUT: (1) 2D numpy array: float32 predicted class probabilities
+                    on X_test, of shape (#imgs, #classes)
+        '''
+        model_name = os.path.basename(path_to_model)
+        probas_file_name = os.path.join(self.prediction_dir,
+                                        '{}.npy'.format(model_name))
+        meta_file_name = os.path.join(self.prediction_dir,
+                                      '{}.json'.format(model_name))
+        weights_sha1 = file_sha1('{}.h5'.format(path_to_model))
+        if os.path.isfile(meta_file_name) and os.path.isfile(probas_file_name):
+            meta = json.load(open(meta_file_name))
+            if (meta['weights_sha1'] == weights_sha1 and
+                    meta.get('X_test_sha1') == self.X_test_sha1):
+                return np.load(probas_file_name).astype('float32')
+
+        evaluator = self._get_evaluator()
+        evaluator.load_weights(path_to_model)
+        probas = evaluator.predict_proba(self.X_test).astype('float16')
+        if not os.path.isdir(self.prediction_dir):
+            os.makedirs(self.prediction_dir)
+        tmp_file_name = '{}.{}.tmp.npy'.format(probas_file_name[:-4],
+                                               os.getpid())
+        np.save(tmp_file_name, probas)
+        os.rename(tmp_file_name, probas_file_name)
+        tmp_file_name = '{}.{}.tmp'.format(meta_file_name, os.getpid())
+        with open(tmp_file_name, 'w') as f:
+            json.dump({'weights_sha1': weights_sha1,
+                       'X_test_sha1': self.X_test_sha1,
+                       'n_imgs': self.X_test.shape[0]}, f)
+        os.rename(tmp_file_name, meta_file_name)
+        return probas.astype('float32')
+
+
+def calc_classwise_top_n_accs(probas, y_test, n=1):
+    '''
+    INPUT:  (1) 2D numpy array: predicted class probabilities, of shape
+                (#imgs, #classes)
+            (2) 1D numpy array: the corresponding true labels
+            (3) integer: the largest n to calculate the top-n accuracy for
+    OUTPUT: (1) 2D numpy array: classwise accuracies, of shape (#classes, n);
+                column k holds the top-(k+1) accuracy of each class. Classes
+                that do not appear in y_test are nan.
+            (2) 2D numpy array: the top-1 confusion matrix, of shape
+                (#classes, #classes); rows are true classes and columns are
+                predicted classes
+
+    Only the top n predictions for each image are found (with argpartition,
+    rather than sorting all the classes), and all the counting is done with
+    bincount, so the whole calculation is a handful of array operations.
+    '''
+    n_imgs, n_classes = probas.shape
+    y_test = np.asarray(y_test).ravel().astype(int)
+    rows = np.arange(n_imgs)[:, np.newaxis]
+    if n < n_classes:
+        top_n_guesses = np.argpartition(-probas, n - 1, axis=1)[:, :n]
+    else:
+        top_n_guesses = np.tile(np.arange(n_classes), (n_imgs, 1))
+    order = np.argsort(-probas[rows, top_n_guesses], axis=1)
+    top_n_guesses = top_n_guesses[rows, order]
+
+    hits = top_n_guesses == y_test[:, np.newaxis]
+    hit_rank = np.argmax(hits, axis=1)
+    was_hit = hits.any(axis=1)
+    hits_by_rank = np.bincount(y_test[was_hit] * n + hit_rank[was_hit],
+                               minlength=n_classes * n)
+    hits_in_top_k = np.cumsum(hits_by_rank.reshape((n_classes, n)), axis=1)
+    class_counts = np.bincount(y_test, minlength=n_classes).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        classwise_top_n_accs = hits_in_top_k / class_counts[:, np.newaxis]
+
+    confusion = np.bincount(y_test * n_classes + top_n_guesses[:, 0],
+                            minlength=n_classes ** 2)
+    confusion = confusion.reshape((n_classes, n_classes))
+    return classwise_top_n_accs, confusion
+
+
 def predict_classwise_top_n_acc(model, X_test, y_test, n=1):
     ''' 
     INPUT:  (1) Trained and compiled Keras model
@@ -27,25 +227,107 @@ def predict_classwise_top_n_acc(model, X_test, y_test, n=1):
                 accuracies as values
 
     This function is able to calculate the top-n accuracy on a classwise basis.
+    See calc_classwise_top_n_accs for the top-1 to top-n accuracies and the
+    confusion matrix.
     '''
-    unique_classes = np.unique(y_test)
-    y_test = y_test.reshape((y_test.shape[0], 1))
     probas = model.predict_proba(X_test, batch_size=32)
-    top_n_guesses = np.fliplr(np.argsort(probas, axis=1))[:, :n]
-    classwise_acc_dict = {}
-    for unique_class in unique_classes:
-        unique_class_locs = np.where(y_test == unique_class)[0]
-        top_n_guesses_for_this_class = top_n_guesses[unique_class_locs]
-        in_top_n = [1 if y_test[row_idx] in row
-                    else 0
-                    for row_idx, row 
-                    in zip(unique_class_locs, top_n_guesses_for_this_class)]
-        classwise_acc_dict[unique_class] = (np.sum(in_top_n) / 
-                                            float(len(unique_class_locs)))
-    return classwise_acc_dict
+    classwise_top_n_accs, confusion = calc_classwise_top_n_accs(probas,
+                                                                y_test, n=n)
+    return {unique_class: classwise_top_n_accs[unique_class, n - 1]
+            for unique_class in np.unique(y_test)}
     
 
-def add_gaussian_noise(X_train, mean, stddev):
+def _image_noise_key(seed, ind, epoch=None):
+    # The leading 0 keeps these keys apart from the shuffling keys used in
+    # noisy_batch_generator.
+    if epoch is None:
+        return [seed, 0, ind]
+    return [seed, 0, ind, epoch]
+
+
+def image_noise(inds, image_shape, seed, epoch=None):
+    '''
+    INPUT:  (1) 1D numpy array: the indices of the images
+            (2) tuple: the shape of one image, (#chan, #rows, #cols)
+            (3) integer: the seed of the noisy dataset
+            (4) integer, optional: the epoch, if the noise is resampled
+                every epoch
+    OUTPUT: (1) 4D numpy array: standard normal noise for each image, of
+                shape (#inds, #chan, #rows, #cols); see noisy_images
+    '''
+    noise = np.empty((len(inds),) + tuple(image_shape))
+    for row, ind in enumerate(inds):
+        rng = np.random.RandomState(_image_noise_key(seed, ind, epoch))
+        noise[row] = rng.standard_normal(image_shape)
+    return noise
+
+
+def noisy_images(X, inds, mean, stddev, seed, epoch=None):
+    '''
+    INPUT:  (1) 4D numpy array: image data, of shape (#imgs, #chan, #rows,
+                #cols), with pixel values scaled to 0-1
+            (2) 1D numpy array: the indices of the images to make noisy
+            (3) float: the mean of the Gaussian to sample noise from
+            (4) float: the standard deviation of the Gaussian to sample
+                noise from, on the 0-255 pixel scale
+            (5) integer: the seed of the noisy dataset
+            (6) integer, optional: the epoch, if the noise should be
+                resampled every epoch
+    OUTPUT: (1) 4D numpy array: float32 noisy copies of the chosen images,
+                clipped to 0-1
+
+    Each image's noise comes from its own RandomState keyed on (seed, image
+    index), so an image always gets the same noise no matter which batch it
+    is drawn in: a noisy dataset is fully described by its seed and never
+    needs to be materialized. The noise is added to the copy in place.
+    '''
+    X_noisy = np.array(X[inds], dtype='float32')
+    if stddev == 0 and mean == 0:
+        return X_noisy
+    X_noisy += mean + (stddev / 255.) * image_noise(inds, X_noisy.shape[1:],
+                                                    seed, epoch)
+    np.clip(X_noisy, 0., 1., out=X_noisy)
+    return X_noisy
+
+
+def noisy_batch_generator(X, y, batch_size, mean, stddev, seed, shuffle=True,
+                          initial_epoch=0, resample_each_epoch=False):
+    '''
+    INPUT:  (1) 4D numpy array: clean image data, scaled to 0-1
+            (2) numpy array: the labels (categorical for training)
+            (3) integer: images per batch
+            (4) float: the mean of the Gaussian to sample noise from
+            (5) float: the standard deviation of the Gaussian, on the 0-255
+                pixel scale
+            (6) integer: the seed of the noisy dataset
+            (7) boolean: shuffle the images every epoch
+            (8) integer: the epoch to start from, when resuming training
+            (9) boolean: draw fresh noise every epoch rather than keeping
+                one fixed noisy dataset
+    OUTPUT: (1) generator: yields (X_batch, y_batch) forever, one epoch
+                after another, for Keras' fit_generator
+
+    Noise is added to each batch as it is drawn (see noisy_images), so
+    memory use is proportional to the batch size rather than the dataset.
+    The batches for a given seed are the same on every run.
+    '''
+    n_imgs = X.shape[0]
+    epoch = initial_epoch
+    while True:
+        if shuffle:
+            order = np.random.RandomState([seed, 1, epoch]).permutation(n_imgs)
+        else:
+            order = np.arange(n_imgs)
+        noise_epoch = epoch if resample_each_epoch else None
+        for start in range(0, n_imgs, batch_size):
+            batch_inds = order[start:start + batch_size]
+            X_batch = noisy_images(X, batch_inds, mean, stddev, seed,
+                                   epoch=noise_epoch)
+            yield X_batch, y[batch_inds]
+        epoch += 1
+
+
+def add_gaussian_noise(X_train, mean, stddev, seed=None, chunk_size=1024):
     ''' 
     INPUT:  (1) 4D numpy array: all raw training image data, of shape 
                 (#imgs, #chan, #rows, #cols)
@@ -53,34 +335,118 @@ def add_gaussian_noise(X_train, mean, stddev):
             (3) float: the standard deviation of the Gaussian to sample
                 noise from. Note that the range of pixel values is
                 0-255; choose the standard deviation appropriately. 
-    OUTPUT: (1) 4D numpy array: noisy training data, of shape
+            (4) integer, optional: the seed of the noisy dataset. If given,
+                the result matches noisy_images and noisy_batch_generator
+                with the same seed; otherwise the global RNG is used.
+            (5) integer: images to add noise to at a time
+    OUTPUT: (1) 4D numpy array: float32 noisy training data, of shape
                 (#imgs, #chan, #rows, #cols)
+
+    Prefer noisy_batch_generator for training; this materializes the whole
+    noisy dataset. It allocates only the float32 output plus one chunk of
+    noise at a time.
     '''
     n_imgs = X_train.shape[0]
-    n_chan = X_train.shape[1]
-    n_rows = X_train.shape[2]
-    n_cols = X_train.shape[3]
-    if stddev == 0:
-        noise = np.zeros((n_imgs, n_chan, n_rows, n_cols))
+    if seed is not None:
+        noisy_X = np.empty(X_train.shape, dtype='float32')
+        for start in range(0, n_imgs, chunk_size):
+            inds = np.arange(start, min(start + chunk_size, n_imgs))
+            noisy_X[inds] = noisy_images(X_train, inds, mean, stddev, seed)
+        return noisy_X
+
+    noisy_X = np.array(X_train, dtype='float32')
+    if stddev == 0 and mean == 0:
+        return noisy_X
+    for start in range(0, n_imgs, chunk_size):
+        chunk = noisy_X[start:start + chunk_size]
+        chunk += np.random.normal(mean, stddev/255., chunk.shape)
+        np.clip(chunk, 0., 1., out=chunk)
+    return noisy_X
+
+
+def _sample_without_replacement(rng, n, k):
+    '''
+    INPUT:  (1) RandomState (or the np.random module)
+            (2) integer: the size of the population, 0 to n-1
+            (3) integer: the number of distinct indices to draw
+    OUTPUT: (1) 1D numpy array: k distinct indices, in random order
+
+    Draws uniform indices in rounds and keeps the first occurrence of each,
+    which is a uniform sample without replacement. Expected work is O(k)
+    rather than the O(n) of permuting all n indices; when k is more than
+    half of n the n - k indices to leave out are drawn instead.
+    '''
+    if k > n // 2:
+        excluded = _sample_without_replacement(rng, n, n - k)
+        keep = np.ones(n, dtype=bool)
+        keep[excluded] = False
+        picked = np.flatnonzero(keep)
+        rng.shuffle(picked)
+        return picked
+    picked = np.empty(0, dtype=int)
+    while picked.size < k:
+        candidates = np.concatenate([picked,
+                                     rng.randint(0, n, 2 * (k - picked.size))])
+        unique_vals, first_inds = np.unique(candidates, return_index=True)
+        picked = candidates[np.sort(first_inds)]
+    return picked[:k]
+
+
+def sample_label_noise(y_train, percent_to_randomize, seed=None, n_classes=10,
+                       force_change=False):
+    '''
+    INPUT:  (1) 1D numpy array: y training data
+            (2) float: the fraction of data to randomize the labels for
+            (3) integer, optional: seed for this noise sample. If None the
+                global RNG is used.
+            (4) integer: the number of classes
+            (5) boolean: if True, every randomized label is guaranteed to
+                differ from the original; otherwise (as before) a label can
+                be randomized to its own value
+    OUTPUT: (1) 1D numpy array: the indices of the labels to change
+            (2) 1D numpy array: the new labels at those indices
+
+    Nothing is modified; apply the noise with apply_label_noise.
+    '''
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    n_labels = y_train.shape[0]
+    n_to_randomize = int(round(n_labels * percent_to_randomize))
+    random_ind = _sample_without_replacement(rng, n_labels, n_to_randomize)
+    if force_change:
+        offsets = rng.randint(low=1, high=n_classes, size=n_to_randomize)
+        random_labels = (y_train[random_ind] + offsets) % n_classes
     else:
-        noise = np.random.normal(mean, stddev/255., 
-                                 (n_imgs, n_chan, n_rows, n_cols))
-    noisy_X = X_train + noise
-    clipped_noisy_X = np.clip(noisy_X, 0., 1.)
-    return clipped_noisy_X
+        random_labels = rng.randint(low=0, high=n_classes, size=n_to_randomize)
+    return random_ind, random_labels.astype(y_train.dtype)
+
+
+def apply_label_noise(y_train, random_ind, random_labels):
+    '''
+    INPUT:  (1) 1D numpy array: y training data
+            (2) 1D numpy array: the indices of the labels to change
+            (3) 1D numpy array: the new labels at those indices
+    OUTPUT: (1) 1D numpy array: a noisy copy of the y training data
+    '''
+    noisy_y_train = np.array(y_train)
+    noisy_y_train[random_ind] = random_labels
+    return noisy_y_train
 
 
-def add_label_noise(y_train, percent_to_randomize):
+def add_label_noise(y_train, percent_to_randomize, seed=None,
+                    force_change=False):
     ''' 
     INPUT:  (1) 1D numpy array: y training data
             (2) float: the fraction of data to randomize the labels for
+            (3) integer, optional: seed for this noise sample (see
+                sample_label_noise)
+            (4) boolean: guarantee randomized labels differ from the original
     OUTPUT: (1) 1D numpy array: noisy y training data
+
+    y_train is not modified, so models trained one after another on
+    different noise levels each start from the clean labels.
     '''
-    n_labels = y_train.shape[0]
-    n_to_randomize = n_labels * percent_to_randomize
-    n_random_labels = np.random.randint(low=0, high=10, size=n_to_randomize)
-    ordered_ind = np.arange(n_labels)
-    permuted_ind = np.random.permutation(ordered_ind)
-    random_ind = permuted_ind[:n_to_randomize]
-    y_train[random_ind] = n_random_labels
-    return y_train
+    random_ind, random_labels = sample_label_noise(y_train,
+                                                   percent_to_randomize,
+                                                   seed=seed,
+                                                   force_change=force_change)
+    return apply_label_noise(y_train, random_ind, random_labels)
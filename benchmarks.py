@@ -0,0 +1,591 @@
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+from keras_model import *
+from additional_functions import *
+from numpy_inference import NumpyModel
+from data_parallel import fit_and_save_model_data_parallel
+
+
+class BenchmarkRegressionError(Exception):
+    pass
+
+
+def _classwise_top_n_acc_loop(probas, y_test, n=1):
+    '''
+    INPUT:  (1) 2D numpy array: predicted class probabilities
+            (2) 1D numpy array: the corresponding true labels
+            (3) integer: n for the top-n accuracy
+    OUTPUT: (1) Dictionary: the classes as keys, with corresponding
+                accuracies as values
+
+    The original full-sort, per-sample loop from predict_classwise_top_n_acc,
+    kept as the reference for benchmark_classwise_top_n_acc.
+    '''
+    unique_classes = np.unique(y_test)
+    y_test = y_test.reshape((y_test.shape[0], 1))
+    top_n_guesses = np.fliplr(np.argsort(probas, axis=1))[:, :n]
+    classwise_acc_dict = {}
+    for unique_class in unique_classes:
+        unique_class_locs = np.where(y_test == unique_class)[0]
+        top_n_guesses_for_this_class = top_n_guesses[unique_class_locs]
+        in_top_n = [1 if y_test[row_idx] in row
+                    else 0
+                    for row_idx, row
+                    in zip(unique_class_locs, top_n_guesses_for_this_class)]
+        classwise_acc_dict[unique_class] = (np.sum(in_top_n) /
+                                            float(len(unique_class_locs)))
+    return classwise_acc_dict
+
+
+def _best_time(func, n_repeats):
+    '''
+    INPUT:  (1) function: called with no arguments
+            (2) integer: the number of times to call it
+    OUTPUT: (1) float: the fastest wall clock time of any call, in seconds
+    '''
+    times = []
+    for _ in range(n_repeats):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+### Individual Benchmarks###
+def benchmark_classwise_top_n_acc(n_imgs=10000, n_classes=10, n=3,
+                                  n_repeats=5, seed=1234):
+    '''
+    INPUT:  (1) integer: number of test images; MNIST has 10000
+            (2) integer: number of classes
+            (3) integer: n for the top-n accuracy
+            (4) integer: the best of this many runs is reported
+            (5) integer: seed for the random probabilities, images and
+                labels
+    OUTPUT: (1) Dictionary: best wall times in seconds for the loop and
+                vectorized versions, the speedup, and the time for the
+                whole predict_classwise_top_n_acc call
+
+    Random probabilities stand in for model output, since the calculation
+    does not depend on where they came from. Both versions are checked to
+    agree before they are timed. The full predict path is timed with an
+    untrained compile_model network run by NumpyModel on random images, to
+    show how much of predict_classwise_top_n_acc the calculation is.
+    '''
+    rng = np.random.RandomState(seed)
+    probas = rng.dirichlet(np.ones(n_classes), size=n_imgs).astype('float32')
+    y_test = rng.randint(0, n_classes, size=n_imgs)
+
+    loop_accs = _classwise_top_n_acc_loop(probas, y_test, n=n)
+    vectorized_accs, confusion = calc_classwise_top_n_accs(probas, y_test, n=n)
+    for unique_class, acc in loop_accs.items():
+        assert np.isclose(acc, vectorized_accs[unique_class, n - 1])
+
+    loop_time = _best_time(
+        lambda: _classwise_top_n_acc_loop(probas, y_test, n=n), n_repeats)
+    vectorized_time = _best_time(
+        lambda: calc_classwise_top_n_accs(probas, y_test, n=n), n_repeats)
+
+    model_param = set_basic_model_param(0)
+    X_test = rng.rand(n_imgs, model_param['n_chan'], model_param['n_rows'],
+                      model_param['n_cols']).astype('float32')
+    with NumpyModel(build_model(model_param).get_weights(),
+                    pool_size=model_param['pool_size']) as model:
+        predict_time = _best_time(
+            lambda: predict_classwise_top_n_acc(model, X_test, y_test, n=n),
+            n_repeats)
+    results = {'loop_time': loop_time,
+               'vectorized_time': vectorized_time,
+               'speedup': loop_time / vectorized_time,
+               'predict_time': predict_time}
+    print 'Classwise top-{} accuracy on {} images:'.format(n, n_imgs)
+    print '    loop:       {:.4f} s'.format(loop_time)
+    print '    vectorized: {:.4f} s'.format(vectorized_time)
+    print '    speedup:    {:.1f}x'.format(results['speedup'])
+    print '    with predict_proba: {:.4f} s ({:.1%} in the accuracy ' \
+          'calculation)'.format(predict_time, vectorized_time / predict_time)
+    return results
+
+
+def benchmark_data_functions(n_repeats=3):
+    '''
+    INPUT:  (1) integer: the best of this many runs is reported
+    OUTPUT: (1) Dictionary: best wall times in seconds, keyed by benchmark
+                name
+
+    Times loading MNIST (from scratch and from the memory-mapped cache),
+    adding Gaussian and label noise to the full training set, and the
+    classwise top-n accuracy calculation on the full test set.
+    '''
+    model_param = set_basic_model_param(0)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(model_param)
+    probas = np.random.RandomState(0).dirichlet(np.ones(10),
+                                                size=X_test.shape[0])
+    timings = {
+        'load_and_format_mnist_data_uncached': _best_time(
+            lambda: load_and_format_mnist_data(model_param, cache_dir=None),
+            n_repeats),
+        'load_and_format_mnist_data_cached': _best_time(
+            lambda: load_and_format_mnist_data(model_param), n_repeats),
+        'add_gaussian_noise': _best_time(
+            lambda: add_gaussian_noise(X_train, 0, 64, seed=0), n_repeats),
+        'add_label_noise': _best_time(
+            lambda: add_label_noise(y_train, 0.4, seed=0), n_repeats),
+        'calc_classwise_top_n_accs': _best_time(
+            lambda: calc_classwise_top_n_accs(probas, y_test, n=3),
+            n_repeats),
+    }
+    return timings
+
+
+def benchmark_load_model(n_repeats=3):
+    '''
+    INPUT:  (1) integer: the best of this many runs is reported
+    OUTPUT: (1) Dictionary: best wall times in seconds for load_model and for
+                swapping the same weights into a ModelEvaluator
+
+    An untrained compile_model network is saved to a temporary directory
+    so the benchmark does not depend on any trained models.
+    '''
+    model_param = set_basic_model_param(0)
+    model = build_model(model_param)
+    tmp_dir = tempfile.mkdtemp()
+    path_to_model = os.path.join(tmp_dir, 'benchmark_model')
+    try:
+        open('{}.json'.format(path_to_model), 'w').write(model.to_json())
+        model.save_weights('{}.h5'.format(path_to_model))
+        evaluator = ModelEvaluator(model_param, max_cached_weights=0)
+        timings = {
+            'load_model': _best_time(lambda: load_model(path_to_model),
+                                     n_repeats),
+            'evaluator_load_weights': _best_time(
+                lambda: evaluator.load_weights(path_to_model), n_repeats),
+        }
+    finally:
+        shutil.rmtree(tmp_dir)
+    return timings
+
+
+# Importing these modules must stay cheap: a fresh interpreter should import
+# each within the budget (in seconds) without loading any of the heavy
+# modules, so headless evaluation and inference jobs start quickly.
+IMPORT_TIME_BUDGETS = {'mnist_data': 0.5,
+                       'evaluation_functions': 0.5,
+                       'plotting_functions': 0.5,
+                       'numpy_inference': 0.5,
+                       'mnist_fun': 0.5}
+HEAVY_MODULES = ['keras', 'theano', 'matplotlib', 'pandas']
+
+_IMPORT_TIMER = """
+import sys, time, json
+start = time.time()
+import {}
+duration = time.time() - start
+print(json.dumps({{'duration': duration,
+                  'loaded': sorted(name for name in sys.modules
+                                   if name.split('.')[0] in {})}}))
+"""
+
+
+def _import_time(module_name):
+    '''
+    INPUT:  (1) string: a module in this repo
+    OUTPUT: (1) float: seconds a fresh interpreter takes to import it
+            (2) list of strings: the HEAVY_MODULES (and submodules) the
+                import loaded
+    '''
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         _IMPORT_TIMER.format(module_name, HEAVY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['duration'], result['loaded']
+
+
+def benchmark_import_times(budgets=IMPORT_TIME_BUDGETS):
+    '''
+    INPUT:  (1) Dictionary: module names mapped to their import time budget,
+                in seconds
+    OUTPUT: (1) Dictionary: import times in seconds, keyed by
+                'import_<module>'
+
+    Raises BenchmarkRegressionError if any module is over budget or loads
+    Keras, Theano, matplotlib or pandas at import.
+    '''
+    timings = {}
+    failures = []
+    for module_name, budget in sorted(budgets.items()):
+        duration, loaded = _import_time(module_name)
+        timings['import_{}'.format(module_name)] = duration
+        print 'import {}: {:.3f} s'.format(module_name, duration)
+        if duration > budget:
+            failures.append('{} took {:.3f} s, over its {} s budget'.format(
+                module_name, duration, budget))
+        if loaded:
+            failures.append('{} imported {}'.format(module_name,
+                                                    ', '.join(loaded)))
+    if failures:
+        raise BenchmarkRegressionError('Import time budget exceeded:\n    '
+                                       '{}'.format('\n    '.join(failures)))
+    return timings
+
+
+def benchmark_numpy_inference(n_imgs=1000, atol=1e-4):
+    '''
+    INPUT:  (1) integer: the number of test images to predict
+            (2) float: the largest allowed difference between the NumPy and
+                Keras probabilities
+    OUTPUT: (1) Dictionary: wall times in seconds for loading and predicting
+                with the Keras ModelEvaluator and with NumpyModel
+
+    An untrained compile_model network is saved to a temporary directory
+    and run through both; an AssertionError is raised if their predicted
+    probabilities differ by more than atol.
+    '''
+    model_param = set_basic_model_param(0)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(model_param)
+    X_test = np.array(X_test[:n_imgs])
+    model = build_model(model_param)
+    tmp_dir = tempfile.mkdtemp()
+    path_to_model = os.path.join(tmp_dir, 'benchmark_model')
+    try:
+        model.save_weights('{}.h5'.format(path_to_model))
+        start = time.time()
+        evaluator = ModelEvaluator(model_param)
+        evaluator.load_weights(path_to_model)
+        keras_load_time = time.time() - start
+        start = time.time()
+        numpy_model = NumpyModel.from_saved_model(path_to_model)
+        numpy_load_time = time.time() - start
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    with numpy_model:
+        keras_probas = evaluator.predict_proba(X_test)
+        numpy_probas = numpy_model.predict_proba(X_test)
+        max_diff = np.abs(keras_probas - numpy_probas).max()
+        assert max_diff < atol, 'NumPy and Keras differ by {}'.format(
+            max_diff)
+        return {'keras_evaluator_load': keras_load_time,
+                'numpy_model_load': numpy_load_time,
+                'keras_evaluator_predict': _best_time(
+                    lambda: evaluator.predict_proba(X_test), 3),
+                'numpy_model_predict': _best_time(
+                    lambda: numpy_model.predict_proba(X_test), 3)}
+
+
+def benchmark_robustness_evaluation(n_imgs=200, n_levels=97, atol=0.01):
+    '''
+    INPUT:  (1) integer: the number of test images to corrupt
+            (2) integer: the number of noise levels, from 0 to 192
+            (3) float: the largest allowed difference in accuracy between
+                the two methods, at any level
+    OUTPUT: (1) Dictionary: wall times in seconds for add_gaussian_noise
+                plus a prediction pass per level, and for
+                calc_robustness_curves
+
+    An untrained compile_model network is run through NumpyModel both ways;
+    an AssertionError is raised if the accuracy curves differ by more than
+    atol (the two differ only by float32 rounding of the noise).
+    '''
+    from evaluation_functions import calc_robustness_curves
+    model_param = set_basic_model_param(0)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(
+        model_param, categorical_y=False)
+    X_test, y_test = np.array(X_test[:n_imgs]), np.array(y_test[:n_imgs])
+    noise_stddevs = np.linspace(0, 192, n_levels)
+    model = build_model(model_param)
+    tmp_dir = tempfile.mkdtemp()
+    path_to_model = os.path.join(tmp_dir, 'benchmark_model')
+    try:
+        model.save_weights('{}.h5'.format(path_to_model))
+        numpy_model = NumpyModel.from_saved_model(path_to_model)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    def per_level():
+        return np.array([np.mean(numpy_model.predict_classes(
+                             add_gaussian_noise(X_test, 0, stddev, seed=0)) ==
+                             y_test)
+                         for stddev in noise_stddevs])
+
+    def batched():
+        n_correct, n_imgs = calc_robustness_curves(
+            numpy_model, X_test, y_test, noise_stddevs=noise_stddevs)
+        return n_correct.sum(axis=1) / float(n_imgs.sum())
+
+    with numpy_model:
+        max_diff = np.abs(per_level() - batched()).max()
+        assert max_diff <= atol, 'Robustness curves differ by {}'.format(
+            max_diff)
+        return {'robustness_per_level': _best_time(per_level, 3),
+                'robustness_batched': _best_time(batched, 3)}
+
+
+def benchmark_training_throughput(batchsizes=2**np.arange(3, 11),
+                                  n_imgs=4096):
+    '''
+    INPUT:  (1) 1D numpy array: batch sizes to time; the default matches
+                load_meshgrid_param
+            (2) integer: the number of training images per timed epoch
+    OUTPUT: (1) Dictionary: training images/sec for one epoch of
+                compile_model at each batch size, keyed by 'train_bs_<size>'
+
+    The model is compiled before the clock starts, and validation is
+    skipped, so only the training step itself is timed.
+    '''
+    model_param = set_basic_model_param(0)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(
+        model_param, categorical_y=True)
+    X_train, y_train = X_train[:n_imgs], y_train[:n_imgs]
+    throughputs = {}
+    for batchsize in batchsizes:
+        model = compile_model(set_basic_model_param(0, batchsize=batchsize))
+        start = time.time()
+        model.fit(X_train, y_train, batch_size=batchsize, nb_epoch=1,
+                  verbose=0)
+        throughputs['train_bs_{}'.format(batchsize)] = (
+            n_imgs / (time.time() - start))
+        print 'Batch size {}: {:.0f} images/sec'.format(
+            batchsize, throughputs['train_bs_{}'.format(batchsize)])
+    return throughputs
+
+
+def benchmark_swarm_training(swarm_size=4, batchsize=128, n_imgs=4096):
+    '''
+    INPUT:  (1) integer: the number of models, K, trained together
+            (2) integer: the batch size
+            (3) integer: the number of training images per timed epoch
+    OUTPUT: (1) Dictionary: training images/sec summed over the K models,
+                for one epoch of K compile_model networks trained one after
+                another ('train_sequential_<K>') and of one
+                compile_model_swarm of K copies ('train_swarm_<K>')
+
+    As in benchmark_training_throughput, the models are compiled before the
+    clock starts and validation is skipped.
+    '''
+    model_param = set_basic_model_param(0, batchsize=batchsize)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(
+        model_param, categorical_y=True)
+    X_train, y_train = X_train[:n_imgs], y_train[:n_imgs]
+    models = [compile_model(model_param) for _ in range(swarm_size)]
+    start = time.time()
+    for model in models:
+        model.fit(X_train, y_train, batch_size=batchsize, nb_epoch=1,
+                  verbose=0)
+    sequential_time = time.time() - start
+
+    swarm, swarm_layers = compile_model_swarm([model_param] * swarm_size)
+    train_data = {'input': X_train}
+    train_data.update(('output_{}'.format(copy_ind), y_train)
+                      for copy_ind in range(swarm_size))
+    start = time.time()
+    swarm.fit(train_data, batch_size=batchsize, nb_epoch=1, verbose=0)
+    swarm_time = time.time() - start
+
+    throughputs = {
+        'train_sequential_{}'.format(swarm_size):
+            swarm_size * n_imgs / sequential_time,
+        'train_swarm_{}'.format(swarm_size): swarm_size * n_imgs / swarm_time}
+    print '{} models at batch size {}: {:.0f} images/sec one at a time, ' \
+          '{:.0f} images/sec as a swarm'.format(
+              swarm_size, batchsize,
+              throughputs['train_sequential_{}'.format(swarm_size)],
+              throughputs['train_swarm_{}'.format(swarm_size)])
+    return throughputs
+
+
+def benchmark_data_parallel_training(batchsizes=[512, 1024], n_workers=None,
+                                     n_imgs=8192, n_test_imgs=1024,
+                                     n_epoch=2):
+    '''
+    INPUT:  (1) list of integers: batch sizes to time
+            (2) integer: worker processes for the data-parallel run;
+                defaults to one per CPU
+            (3) integer: the number of training images per epoch
+            (4) integer: the number of validation images per epoch
+            (5) integer: epochs per run; the fastest epoch is reported
+    OUTPUT: (1) Dictionary: seconds per epoch of fit_and_save_model and of
+                fit_and_save_model_data_parallel at each batch size, keyed
+                by 'train_epoch_bs_<size>' and 'train_epoch_dp_bs_<size>'
+
+    Epoch times come from each run's EpochHistory, so compiling the model
+    and starting the workers are not counted. The models are saved to a
+    temporary directory.
+    '''
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    model_param = set_basic_model_param(0)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(
+        model_param, categorical_y=True)
+    X_train, y_train = X_train[:n_imgs], y_train[:n_imgs]
+    X_test, y_test = X_test[:n_test_imgs], y_test[:n_test_imgs]
+    tmp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(tmp_dir, 'models'))
+    cwd = os.getcwd()
+    timings = {}
+    try:
+        os.chdir(tmp_dir)
+        for batchsize in batchsizes:
+            model_param = set_basic_model_param(
+                'benchmark_{}'.format(batchsize), batchsize=batchsize,
+                n_epoch=n_epoch)
+            np.random.seed(0)
+            results = fit_and_save_model(compile_model(model_param),
+                                         model_param, X_train, y_train,
+                                         X_test, y_test, overwrite=True)
+            history = pickle.load(open(results['history_file_name'], 'rb'))
+            serial_time = min(history['epoch_time'])
+            np.random.seed(0)
+            results = fit_and_save_model_data_parallel(
+                build_model(model_param), model_param, X_train, y_train,
+                X_test, y_test, n_workers=n_workers, overwrite=True)
+            history = pickle.load(open(results['history_file_name'], 'rb'))
+            parallel_time = min(history['epoch_time'])
+            timings['train_epoch_bs_{}'.format(batchsize)] = serial_time
+            timings['train_epoch_dp_bs_{}'.format(batchsize)] = parallel_time
+            print 'Batch size {}: {:.2f} s/epoch, {:.2f} s/epoch on {} ' \
+                  'workers'.format(batchsize, serial_time, parallel_time,
+                                   n_workers)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+    return timings
+
+
+### Benchmark Harness###
+def environment_metadata():
+    '''
+    INPUT:  None
+    OUTPUT: (1) Dictionary: the machine and library versions the benchmarks
+                ran with, so results from different runs can be compared
+    '''
+    metadata = {'hostname': socket.gethostname(),
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'cpu_count': multiprocessing.cpu_count(),
+                'python': sys.version.split()[0],
+                'numpy': np.__version__,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'thread_env': {env_var: os.environ.get(env_var)
+                               for env_var in ['OMP_NUM_THREADS',
+                                               'MKL_NUM_THREADS',
+                                               'OPENBLAS_NUM_THREADS']}}
+    for module_name in ['keras', 'theano']:
+        try:
+            metadata[module_name] = __import__(module_name).__version__
+        except (ImportError, AttributeError):
+            metadata[module_name] = None
+    return metadata
+
+
+def run_benchmarks(include_training=True):
+    '''
+    INPUT:  (1) boolean: also time training at every meshgrid batch size,
+                a swarm against the same models trained one at a time, and
+                single-process against data-parallel training at large
+                batch sizes, which takes much longer than the rest
+    OUTPUT: (1) Dictionary: 'environment' metadata and 'results', where each
+                result has a value and a unit; 'seconds' are better lower
+                and 'images_per_sec' are better higher
+    '''
+    results = {}
+    for name, seconds in benchmark_import_times().items():
+        results[name] = {'value': seconds, 'unit': 'seconds'}
+    for name, seconds in benchmark_data_functions().items():
+        results[name] = {'value': seconds, 'unit': 'seconds'}
+    for name, seconds in benchmark_load_model().items():
+        results[name] = {'value': seconds, 'unit': 'seconds'}
+    for name, seconds in benchmark_numpy_inference().items():
+        results[name] = {'value': seconds, 'unit': 'seconds'}
+    for name, seconds in benchmark_robustness_evaluation().items():
+        results[name] = {'value': seconds, 'unit': 'seconds'}
+    if include_training:
+        for name, throughput in benchmark_training_throughput().items():
+            results[name] = {'value': throughput, 'unit': 'images_per_sec'}
+        for name, throughput in benchmark_swarm_training().items():
+            results[name] = {'value': throughput, 'unit': 'images_per_sec'}
+        for name, seconds in benchmark_data_parallel_training().items():
+            results[name] = {'value': seconds, 'unit': 'seconds'}
+    return {'environment': environment_metadata(), 'results': results}
+
+
+def compare_to_baseline(benchmark_output, baseline_output, tolerance=0.2):
+    '''
+    INPUT:  (1) Dictionary: output of run_benchmarks
+            (2) Dictionary: an earlier output of run_benchmarks
+            (3) float: the fraction a result may be worse than the baseline
+                before it counts as a regression
+    OUTPUT: (1) list of strings: a description of every regression; empty if
+                there are none
+
+    Benchmarks missing from either run are ignored.
+    '''
+    regressions = []
+    baseline_results = baseline_output['results']
+    for name, result in sorted(benchmark_output['results'].items()):
+        if name not in baseline_results:
+            continue
+        baseline_value = baseline_results[name]['value']
+        if result['unit'] == 'seconds':
+            is_regression = result['value'] > baseline_value * (1 + tolerance)
+        else:
+            is_regression = result['value'] < baseline_value * (1 - tolerance)
+        if is_regression:
+            regressions.append('{}: {:.4g} {} vs baseline {:.4g}'.format(
+                name, result['value'], result['unit'], baseline_value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the training and evaluation hot paths.')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='where to write the results as JSON')
+    parser.add_argument('--baseline',
+                        help='JSON results to compare against; any regression '
+                             'beyond the tolerance exits with an error')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--skip-training', action='store_true',
+                        help='skip the (slow) training throughput, swarm '
+                             'and data-parallel benchmarks')
+    parser.add_argument('--top-n-only', action='store_true',
+                        help='only compare the loop and vectorized classwise '
+                             'top-n accuracy, and time its predict path')
+    parser.add_argument('--imports-only', action='store_true',
+                        help='only check the import time budgets')
+    args = parser.parse_args(argv)
+
+    if args.top_n_only:
+        benchmark_classwise_top_n_acc()
+        return
+    if args.imports_only:
+        benchmark_import_times()
+        return
+    benchmark_output = run_benchmarks(include_training=not args.skip_training)
+    json.dump(benchmark_output, open(args.output, 'w'), indent=2,
+              sort_keys=True)
+    print 'Results written to {}'.format(args.output)
+    if args.baseline is not None:
+        regressions = compare_to_baseline(benchmark_output,
+                                          json.load(open(args.baseline)),
+                                          tolerance=args.tolerance)
+        if regressions:
+            raise BenchmarkRegressionError(
+                'Performance regressions against {}:\n    {}'.format(
+                    args.baseline, '\n    '.join(regressions)))
+        print 'No regressions against {}'.format(args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+import os
+import time
+import pickle
+import traceback
+import multiprocessing
+import numpy as np
+from keras_model import *
+from additional_functions import noisy_images
+
+
+# Synchronous data-parallel training of one compile_model network. The
+# weights live in shared memory owned by the coordinating (parent) process.
+# For every batch each worker process reads them, computes the gradients of
+# its shard of the batch and writes them to its own row of a shared gradient
+# array; the parent then reduces the rows into the full batch gradient and
+# applies the Adadelta update in place, so every worker starts the next
+# batch from the same weights. Workers are forked after the data are loaded
+# and share them copy-on-write.
+
+
+def _flatten(weights):
+    return np.concatenate([np.ravel(w) for w in weights]).astype('float32')
+
+
+def _unflatten(flat_weights, shapes):
+    weights = []
+    start = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        weights.append(flat_weights[start:start + size].reshape(shape))
+        start += size
+    return weights
+
+
+def _shared_array(shape, typecode='f'):
+    '''
+    INPUT:  (1) tuple: the shape of the array
+            (2) string: the ctypes type code ('f' float32, 'i' int32)
+    OUTPUT: (1) multiprocessing RawArray: the shared buffer
+            (2) numpy array: a view of it with the given shape
+    '''
+    raw = multiprocessing.RawArray(typecode, int(np.prod(shape)))
+    dtype = 'float32' if typecode == 'f' else 'int32'
+    return raw, np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+class Adadelta(object):
+    '''
+    NumPy Adadelta with the Keras defaults, applied in place to a flat
+    float32 weight vector, so the parent can step the shared weights
+    without a Theano graph of its own.
+    '''
+    def __init__(self, n_weights, lr=1.0, rho=0.95, epsilon=1e-6):
+        self.lr = lr
+        self.rho = rho
+        self.epsilon = epsilon
+        self.accumulator = np.zeros(n_weights, dtype='float32')
+        self.delta_accumulator = np.zeros(n_weights, dtype='float32')
+
+    def update(self, weights, grads):
+        '''
+        INPUT:  (1) 1D numpy array: the weights, updated in place
+                (2) 1D numpy array: the gradient of the loss
+        OUTPUT: None
+        '''
+        self.accumulator *= self.rho
+        self.accumulator += (1 - self.rho) * grads**2
+        step = grads * (np.sqrt(self.delta_accumulator + self.epsilon) /
+                        np.sqrt(self.accumulator + self.epsilon))
+        weights -= self.lr * step
+        self.delta_accumulator *= self.rho
+        self.delta_accumulator += (1 - self.rho) * step**2
+
+
+def _shard_bounds(start, stop, n_workers):
+    bounds = np.linspace(start, stop, n_workers + 1).astype(int)
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _data_parallel_worker(conn, model_param, seed, noise, weights, grads,
+                          batch_order, X_train, y_train, X_test, y_test):
+    '''
+    INPUT:  (1) multiprocessing Connection: to the parent
+            (2) Dictionary of model parameters
+            (3) integer: seed for this worker's dropout masks
+            (4) tuple or None: (mean, stddev, seed) of the Gaussian noise
+                added to the training images (see noisy_images)
+            (5) 1D numpy array: the shared weights
+            (6) 1D numpy array: this worker's row of the shared gradients
+            (7) 1D numpy array: the shared order of the training images
+            (8-11) the training and test data, categorical y
+    OUTPUT: None, but the worker answers the parent's messages until it is
+            sent None:
+              ('grad', start, stop): writes the gradient of the images
+                  batch_order[start:stop] to grads and replies with their
+                  (loss, accuracy)
+              ('eval', start, stop): replies with the (loss, accuracy) of
+                  test images start:stop, without dropout
+    '''
+    try:
+        from keras import backend as K
+        from keras import objectives
+        np.random.seed(seed)
+        model = build_model(model_param)
+        shapes = [w.shape for w in model.get_weights()]
+        y_true = K.placeholder(ndim=2)
+        functions = {}
+        for train in [True, False]:
+            y_pred = model.get_output(train=train)
+            loss = K.mean(objectives.categorical_crossentropy(y_true, y_pred))
+            acc = K.mean(K.equal(K.argmax(y_true, axis=-1),
+                                 K.argmax(y_pred, axis=-1)))
+            outputs = [loss, acc]
+            if train:
+                outputs += K.gradients(loss, model.trainable_weights)
+            functions[train] = K.function(
+                [model.get_input(train=train), y_true], outputs)
+        conn.send(('ready',))
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            command, start, stop = message
+            if stop <= start:
+                grads[:] = 0
+                conn.send((0., 0.))
+                continue
+            model.set_weights(_unflatten(weights, shapes))
+            if command == 'grad':
+                inds = batch_order[start:stop]
+                if noise is None:
+                    X_batch = X_train[inds]
+                else:
+                    X_batch = noisy_images(X_train, inds, *noise)
+                outputs = functions[True]([X_batch, y_train[inds]])
+                grads[:] = _flatten(outputs[2:])
+            else:
+                outputs = functions[False]([X_test[start:stop],
+                                            y_test[start:stop]])
+            conn.send((float(outputs[0]), float(outputs[1])))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class _WorkerGroup(object):
+    '''
+    The forked workers and their connections; every call sends one message
+    per worker and waits for all the replies.
+    '''
+    def __init__(self, n_workers, model_param, seed, noise, weights, grads,
+                 batch_order, data):
+        self.conns, self.processes = [], []
+        for worker_ind in range(n_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_data_parallel_worker,
+                args=(child_conn, model_param, seed + worker_ind, noise,
+                      weights, grads[worker_ind], batch_order) + tuple(data))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+        self._replies()
+
+    def _replies(self):
+        replies = [conn.recv() for conn in self.conns]
+        for reply in replies:
+            if reply[0] == 'error':
+                raise RuntimeError('Data-parallel worker failed:\n{}'.format(
+                    reply[1]))
+        return replies
+
+    def run(self, command, start, stop):
+        '''
+        INPUT:  (1) string: 'grad' or 'eval'
+                (2) integer: the first image of the batch
+                (3) integer: one past the last image of the batch
+        OUTPUT: (1) 1D numpy array: the number of images in each shard
+                (2) 2D numpy array: each shard's (loss, accuracy)
+        '''
+        bounds = _shard_bounds(start, stop, len(self.conns))
+        for conn, (shard_start, shard_stop) in zip(self.conns, bounds):
+            conn.send((command, shard_start, shard_stop))
+        shard_sizes = np.array([shard_stop - shard_start
+                                for shard_start, shard_stop in bounds],
+                               dtype='float32')
+        return shard_sizes, np.array(self._replies(), dtype='float32')
+
+    def close(self):
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(None)
+                except IOError:
+                    pass
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+
+def fit_and_save_model_data_parallel(model, model_param, X_train, y_train,
+                                     X_test, y_test, n_workers=None, seed=0,
+                                     noise=None, initial_epoch=0,
+                                     callbacks=None, overwrite=False,
+                                     lineage=None):
+    '''
+    INPUT:  (1) Keras model from build_model (it need not be compiled); it
+                holds the initial weights, eg. from a checkpoint, and ends
+                up with the trained ones
+            (2) Dictionary of model parameters
+            (3) 4D numpy array: the X training data
+            (4) 2D numpy array: the categorical training labels
+            (5) 4D numpy array: the X test data
+            (6) 2D numpy array: the categorical test labels
+            (7) integer: the number of worker processes each batch is split
+                across; defaults to one per CPU
+            (8) integer: seed for the shuffling and the workers' dropout
+            (9) tuple, optional: (mean, stddev, seed) of Gaussian noise to
+                add to the training images, as noisy_batch_generator does
+            (10) integer: epochs already trained, as for fit_and_save_model
+            (11) list, optional: extra Keras callbacks, eg. EpochCheckpoint
+            (12) boolean: replace an existing model of the same name
+            (13) Dictionary, optional: the model's warm start lineage
+    OUTPUT: (1) Dictionary: the saved file names, test score and accuracy
+                and run time, as from fit_and_save_model
+
+    Every batch is split evenly across the workers and the weights are
+    updated once per batch from the size-weighted mean of their gradients,
+    so the optimisation is that of one process training with the same
+    batch size; only the dropout masks and shuffling differ. Each worker
+    should get several images, so this pays off for the large batch sizes.
+    Early stopping, EpochHistory and the extra callbacks work as they do in
+    fit_and_save_model.
+    '''
+    from keras.callbacks import CallbackList
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_train, n_test = X_train.shape[0], X_test.shape[0]
+    batch_size = model_param['batch_size']
+    initial_weights = model.get_weights()
+    shapes = [w.shape for w in initial_weights]
+    _, weights = _shared_array((sum(int(np.prod(shape))
+                                    for shape in shapes),))
+    weights[:] = _flatten(initial_weights)
+    _, grads = _shared_array((n_workers, weights.shape[0]))
+    _, batch_order = _shared_array((n_train,), typecode='i')
+    optimizer = Adadelta(weights.shape[0])
+    rng = np.random.RandomState(seed)
+
+    history = EpochHistory(n_train)
+    callbacks = [history] + (callbacks or [])
+    if telemetry_enabled():
+        # First, so the other callbacks' work is not counted in its spans
+        callbacks.insert(0, TimingCallback(model=model_param['model_build']))
+    early_stopping = None
+    if model_param['patience'] is not None:
+        early_stopping = EarlyStoppingRestoreBest(model_param['patience'],
+                                                  model_param['min_delta'])
+        callbacks.append(early_stopping)
+    callbacks = CallbackList(callbacks)
+    callbacks._set_model(model)
+    callbacks._set_params({'batch_size': batch_size,
+                           'nb_epoch': model_param['n_epoch'] - initial_epoch,
+                           'nb_sample': n_train, 'verbose': 1,
+                           'do_validation': True,
+                           'metrics': ['loss', 'acc', 'val_loss', 'val_acc']})
+    model.stop_training = False
+
+    start = time.time()
+    workers = _WorkerGroup(n_workers, model_param, seed + 1, noise, weights,
+                           grads, batch_order,
+                           (X_train, y_train, X_test, y_test))
+    try:
+        callbacks.on_train_begin()
+        for epoch in range(model_param['n_epoch'] - initial_epoch):
+            callbacks.on_epoch_begin(epoch)
+            batch_order[:] = rng.permutation(n_train)
+            train_stats = np.zeros(2)
+            for batch_ind, batch_start in enumerate(range(0, n_train,
+                                                          batch_size)):
+                batch_stop = min(batch_start + batch_size, n_train)
+                callbacks.on_batch_begin(batch_ind,
+                                         {'size': batch_stop - batch_start})
+                shard_sizes, shard_stats = workers.run('grad', batch_start,
+                                                       batch_stop)
+                shard_fracs = shard_sizes / shard_sizes.sum()
+                optimizer.update(weights, np.dot(shard_fracs, grads))
+                train_stats += np.dot(shard_sizes, shard_stats)
+                callbacks.on_batch_end(batch_ind, {
+                    'size': batch_stop - batch_start,
+                    'loss': np.dot(shard_fracs, shard_stats[:, 0])})
+            val_stats = np.zeros(2)
+            for batch_start in range(0, n_test, batch_size * n_workers):
+                shard_sizes, shard_stats = workers.run(
+                    'eval', batch_start,
+                    min(batch_start + batch_size * n_workers, n_test))
+                val_stats += np.dot(shard_sizes, shard_stats)
+            model.set_weights(_unflatten(weights.copy(), shapes))
+            train_loss, train_acc = train_stats / n_train
+            val_loss, val_acc = val_stats / n_test
+            print 'Epoch {}: loss {:.4f} - acc {:.4f} - val_loss {:.4f} - ' \
+                  'val_acc {:.4f}'.format(initial_epoch + epoch + 1,
+                                          train_loss, train_acc, val_loss,
+                                          val_acc)
+            callbacks.on_epoch_end(epoch, {'loss': train_loss,
+                                           'acc': train_acc,
+                                           'val_loss': val_loss,
+                                           'val_acc': val_acc})
+            if model.stop_training:
+                break
+        callbacks.on_train_end()
+
+        # The best epoch's weights may have been restored
+        weights[:] = _flatten(model.get_weights())
+        val_stats = np.zeros(2)
+        for batch_start in range(0, n_test, batch_size * n_workers):
+            shard_sizes, shard_stats = workers.run(
+                'eval', batch_start,
+                min(batch_start + batch_size * n_workers, n_test))
+            val_stats += np.dot(shard_sizes, shard_stats)
+    finally:
+        workers.close()
+    total_run_time = (time.time() - start) / 60.
+    score = val_stats / n_test
+    print 'Test score: {}'.format(score[0])
+    print 'Test accuracy: {}'.format(score[1])
+    print 'Total run time on {} workers: {}'.format(n_workers, total_run_time)
+
+    with timed_span('save', model=model_param['model_build']):
+        json_file_name, weights_file_name = save_model(model, model_param,
+                                                       overwrite=overwrite)
+    history_file_name = '{}.pkl'.format(os.path.splitext(weights_file_name)[0])
+    model_history = dict(history.history, initial_epoch=initial_epoch,
+                         n_workers=n_workers)
+    if early_stopping is not None:
+        model_history['best_epoch'] = early_stopping.best_epoch
+    if lineage is not None:
+        model_history['lineage'] = lineage
+    if os.path.isfile(history_file_name):
+        os.remove(history_file_name)
+    pickle.dump(model_history, open(history_file_name, 'wb'))
+    return {'json_file_name': json_file_name,
+            'weights_file_name': weights_file_name,
+            'history_file_name': history_file_name,
+            'n_epochs_run': len(history.history['loss']),
+            'test_score': score[0],
+            'test_accuracy': score[1],
+            'run_time': total_run_time}
@@ -0,0 +1,357 @@
+import os
+import glob
+import pickle
+import warnings
+from collections import OrderedDict
+import numpy as np
+from mnist_data import *
+from additional_functions import *
+from results_store import *
+from numpy_inference import NumpyModel
+
+
+### Accuracy Calculating Functions###
+def calc_all_classwise_accs(noise_stddevs, replicate=0):
+    '''
+    INPUT:  (1) 1D numpy array: The standard deviations of the Gaussian noise 
+                being added to the data
+            (2) integer: which replicate's models to evaluate
+    OUTPUT: (1) dictionary of lists: The accuracies over all standard deviations 
+                for each digit in MNIST
+
+    This function calculates the classwise accuracies as a function of the
+    standard deviation of the Gaussian noise added to the X training data. 
+    It isn't set up to handle the noisy y data, as classwise accuracies 
+    do not make much sense to calculate when looking at the effect that
+    randomizing some percentage of the labels has on the model performance. 
+    '''
+    model_param = set_basic_model_param(noise_stddevs[0])
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(model_param, 
+                                                categorical_y=False)
+    unique_classes = np.unique(y_test)
+    classwise_accs = {unique_class: [] for unique_class in unique_classes}
+    store = PredictionStore(X_test)
+    for noise_stddev in noise_stddevs:
+        print '''Calculating classwise accs for model characteristic noise value
+                of of {}'''.format(noise_stddev)
+        name_to_append = replicate_name('{}_{}'.format('X', noise_stddev),
+                                        replicate)
+        probas = store.get_probas('models/KerasBaseModel_v.0.1_{}'.format(name_to_append))
+        classwise_top_n_accs, confusion = calc_classwise_top_n_accs(probas,
+                                                                    y_test)
+        for unique_class in unique_classes:
+            classwise_accs[unique_class].append(
+                classwise_top_n_accs[unique_class, 0])
+    return classwise_accs
+
+
+def calc_raw_acc(characteristic_noise_vals, X_or_y, replicate=0):
+    ''' 
+    INPUT:  (1) 1D numpy array: if on X, should be the standard deviations of
+                the Gaussian noise being added; if on y, should be the 
+                percentages of labels to be randomly changed
+            (2) string: 'X' or 'y' corresponding to which data was made noisy
+                before training the models for which we are calculating the acc
+            (3) integer: which replicate's models to evaluate
+
+    This function calculates the raw accuracy (over all classes) a series of
+    models with different characteristic noise values.
+    '''
+    model_param = set_basic_model_param(0)    
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(model_param, 
+                                                categorical_y=False)
+    accs = []
+    store = PredictionStore(X_test)
+    for cnv in characteristic_noise_vals:
+        print '''Calculating raw accuracy for models with a characteristic 
+                 noise value of {}'''.format(cnv)
+        name_to_append = replicate_name('{}_{}'.format(X_or_y, cnv),
+                                        replicate)
+        probas = store.get_probas('models/KerasBaseModel_v.0.1_{}'.format(name_to_append))
+        y_pred = np.argmax(probas, axis=1)
+        acc_to_add = np.sum(y_pred == y_test) / float(len(y_test))
+        accs += [acc_to_add]
+    return accs 
+
+
+def calc_meshgrid_acc(percent_random_labels, batchsizes, dropout_scalars):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the scalars by which to change the 
+                built-in dropout values (0.25 and 0.5: see keras_model
+                for specifics)
+    OUTPUT: (1) 3D numpy array of accuracies corresponding to the models
+                trained on the grid of parameters specified in the input
+
+    This function will calculate all accuracies for the grid of model
+    parameters being varied. All models must have been trained and saved
+    in /models using train_model_meshgrid before this function can be
+    utilized.
+    '''
+    return calc_meshgrid_acc_replicates(percent_random_labels, batchsizes,
+                                        dropout_scalars, n_replicates=1)[0]
+
+
+def calc_meshgrid_acc_replicates(percent_random_labels, batchsizes,
+                                 dropout_scalars, n_replicates):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the dropout scalars
+            (4) integer: the number of replicates trained (see
+                train_model_meshgrid)
+    OUTPUT: (1) 4D numpy array of accuracies, of shape (#replicates,
+                #percent random labels, #batchsizes, #dropout scalars)
+
+    Every replicate is evaluated with the same PredictionStore, so the
+    prediction function is only compiled once. See replicate_statistics
+    to summarise the result.
+    '''
+    model_param = set_basic_model_param(0)    
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(model_param, 
+                                                categorical_y=False)
+    acc_grids = np.zeros((n_replicates,
+                          len(percent_random_labels), 
+                          len(batchsizes), 
+                          len(dropout_scalars)))
+    store = PredictionStore(X_test)
+    for replicate in range(n_replicates):
+        for pr_ind, percent_random in enumerate(percent_random_labels):
+            for b_ind, batchsize in enumerate(batchsizes):
+                for d_ind, dropout_scalar in enumerate(dropout_scalars):
+                    print '''Calculating raw accuracy for model with {} random labels, a batchsize of {}, and a dropout scalar of {} (replicate {})'''.format(percent_random, batchsize, dropout_scalar, replicate)
+                    name_to_append = replicate_name(
+                        'y_{}_{}_{}'.format(percent_random, batchsize,
+                                            dropout_scalar), replicate)
+                    probas = store.get_probas('models/KerasBaseModel_v.0.1_{}'.format(name_to_append))
+                    y_pred = np.argmax(probas, axis=1)
+                    acc_to_add = np.sum(y_pred == y_test) / float(len(y_test))
+                    print 'Accuracy is {}\n'.format(acc_to_add)
+                    acc_grids[replicate, pr_ind, b_ind, d_ind] = acc_to_add
+    return acc_grids
+
+
+def replicate_statistics(replicate_values, n_bootstrap=1000, ci=0.95,
+                         seed=0):
+    '''
+    INPUT:  (1) numpy array: values with replicates along the first axis,
+                eg. from calc_meshgrid_acc_replicates; nan marks a missing
+                replicate
+            (2) integer: the number of bootstrap resamples
+            (3) float: the confidence level of the interval
+            (4) integer: seed for the bootstrap resampling
+    OUTPUT: (1) dictionary of numpy arrays, each the shape of one replicate:
+                'mean', 'std' (with ddof=1), 'ci_low' and 'ci_high' (the
+                percentile bootstrap interval of the mean) and
+                'n_replicates' (how many were not nan)
+
+    The bootstrap is vectorized: all resamples of every grid point are
+    drawn as one index array and averaged in a single call, rather than
+    looping over grid points or resamples.
+    '''
+    replicate_values = np.asarray(replicate_values, dtype='float64')
+    n_replicates = replicate_values.shape[0]
+    rng = np.random.RandomState(seed)
+    resample_inds = rng.randint(0, n_replicates,
+                                size=(n_bootstrap, n_replicates))
+    with warnings.catch_warnings():
+        # Grid points with no (or one) replicate give nan, not an error.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        bootstrap_means = np.nanmean(replicate_values[resample_inds], axis=1)
+        ci_low, ci_high = np.nanpercentile(bootstrap_means,
+                                           [50 * (1 - ci), 50 * (1 + ci)],
+                                           axis=0)
+        return {'mean': np.nanmean(replicate_values, axis=0),
+                'std': np.nanstd(replicate_values, axis=0, ddof=1),
+                'ci_low': ci_low,
+                'ci_high': ci_high,
+                'n_replicates': np.sum(~np.isnan(replicate_values), axis=0)}
+
+
+def calc_meshgrid_time_to_converge(percent_random_labels, batchsizes, dropout_scalars,
+                                   replicate=0):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the scalars by which to change the 
+                built-in dropout values (0.25 and 0.5: see keras_model
+                for specifics)
+            (4) integer: which replicate's models to read
+    OUTPUT: (1) 3D numpy array of the number of epochs it took the model 
+                at that point on the grid to converge
+    '''
+    converge_grid = np.zeros((len(percent_random_labels), 
+                              len(batchsizes), 
+                              len(dropout_scalars)))
+    for pr_ind, percent_random in enumerate(percent_random_labels):
+        for b_ind, batchsize in enumerate(batchsizes):
+            for d_ind, dropout_scalar in enumerate(dropout_scalars):
+                name_to_append = replicate_name(
+                    'y_{}_{}_{}'.format(percent_random, batchsize,
+                                        dropout_scalar), replicate)
+                filename = 'models/KerasBaseModel_v.0.1_{}.pkl'.format(name_to_append)
+                model_history = pickle.load(open(filename, 'rb'))
+                n_epochs = (model_history.get('initial_epoch', 0) +
+                            len(model_history['acc']))
+                converge_grid[pr_ind, b_ind, d_ind] = n_epochs
+    return converge_grid
+
+
+### Robustness Evaluation Functions###
+ROBUSTNESS_STDDEVS = np.linspace(0, 192, 97)
+
+
+def calc_robustness_curves(model, X_test, y_test,
+                           noise_stddevs=ROBUSTNESS_STDDEVS, seed=0,
+                           chunk_size=64, batch_size=256, n_classes=10):
+    '''
+    INPUT:  (1) a trained model with predict_classes, eg. a NumpyModel or a
+                ModelEvaluator
+            (2) 4D numpy array: the clean test images, scaled to 0-1
+            (3) 1D numpy array: the test labels
+            (4) 1D numpy array: the standard deviations of the Gaussian
+                noise to add to the test images, on the 0-255 pixel scale
+            (5) integer: the seed of the noisy test sets
+            (6) integer: test images to corrupt at a time
+            (7) integer: images per predict_classes batch
+            (8) integer: the number of classes
+    OUTPUT: (1) 2D numpy array: the number of correct predictions, of shape
+                (#noise_stddevs, #classes)
+            (2) 1D numpy array: the number of test images of each class
+
+    The test images are streamed chunk_size at a time. Every noise level of
+    a chunk is built in one float32 tensor of shape (#noise_stddevs,
+    chunk_size, #chan, #rows, #cols) from a single standard normal draw per
+    image, scaled by each stddev, so the noise is generated once per image
+    rather than once per level. That tensor is predicted in one call and
+    the hits are counted per (level, class) with one bincount. Memory is
+    bounded by the chunk, whatever the size of the test set.
+
+    Each image's noise comes from the same per-image RandomState as
+    noisy_images, so level i is the test set from add_gaussian_noise(X_test,
+    0, noise_stddevs[i], seed), up to float32 rounding. Every level shares
+    the same draws, which makes the accuracy curve smoother than
+    independent draws would.
+
+        n_correct, n_imgs = calc_robustness_curves(model, X_test, y_test)
+        classwise_accs = n_correct / n_imgs
+        accs = n_correct.sum(axis=1) / float(n_imgs.sum())
+    '''
+    noise_scales = (np.asarray(noise_stddevs, dtype='float32') /
+                    255.).reshape((-1, 1, 1, 1, 1))
+    n_levels = noise_scales.shape[0]
+    n_correct = np.zeros(n_levels * n_classes, dtype='int64')
+    level_offsets = (np.arange(n_levels) * n_classes)[:, np.newaxis]
+    for start in range(0, X_test.shape[0], chunk_size):
+        inds = np.arange(start, min(start + chunk_size, X_test.shape[0]))
+        X_chunk = np.asarray(X_test[inds], dtype='float32')
+        noise = image_noise(inds, X_chunk.shape[1:], seed).astype('float32')
+        X_noisy = noise_scales * noise[np.newaxis]
+        X_noisy += X_chunk[np.newaxis]
+        np.clip(X_noisy, 0., 1., out=X_noisy)
+        y_pred = model.predict_classes(
+            X_noisy.reshape((-1,) + X_chunk.shape[1:]),
+            batch_size=batch_size).reshape((n_levels, len(inds)))
+        y_chunk = y_test[inds]
+        hits = y_pred == y_chunk[np.newaxis]
+        n_correct += np.bincount((level_offsets + y_chunk[np.newaxis])[hits],
+                                 minlength=n_levels * n_classes)
+    n_imgs = np.bincount(y_test, minlength=n_classes)
+    return n_correct.reshape((n_levels, n_classes)), n_imgs
+
+
+def saved_model_paths(model_dir='models'):
+    '''
+    INPUT:  (1) string: the directory the models were saved to
+    OUTPUT: (1) list of strings: the path of every saved model, without
+                .json or .h5 at the end, sorted
+    '''
+    return sorted(os.path.splitext(weights_file_name)[0] for weights_file_name
+                  in glob.glob(os.path.join(model_dir, 'KerasBaseModel_*.h5')))
+
+
+### Master Functions###
+def load_meshgrid_param():
+    ''' 
+    INPUT:  None
+    OUTPUT: (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the scalars by which to change the 
+                built-in dropout values (0.25 and 0.5: see keras_model
+                for specifics)
+
+    This function sets and returns the required param for the meshgrid,
+    and is utilized in save_accuracy_meshgrid and plot_accuracy_meshgrid
+    '''
+    percent_random_labels = np.linspace(0, 0.8, 17)
+    batchsizes = 2**np.arange(3, 11)
+    dropout_scalars = np.array([0, 1])
+    return percent_random_labels, batchsizes, dropout_scalars
+
+
+def save_time_to_converge_meshgrid(converge_grid_filename):
+    ''' 
+    INPUT:  (1) string: the filename (without .h5) to save the 3D numpy
+                array of number of epochs it took the model to converge to
+    OUTPUT: None, but the grid will be saved
+    
+    The grid parameters (percent random labels, batchsizes, and dropout 
+    scalars) are set in this function. Models must have already been trained. 
+    The grid is saved as 'converge_grid' with its axes (see
+    results_store.save_labeled_grid).
+    '''
+    percent_random_labels, batchsizes, dropout_scalars = load_meshgrid_param()
+    converge_grid = calc_meshgrid_time_to_converge(percent_random_labels, batchsizes, 
+                                    dropout_scalars)
+    save_labeled_grid('{}.h5'.format(converge_grid_filename),
+                      meshgrid_axes(percent_random_labels, batchsizes,
+                                    dropout_scalars),
+                      converge_grid=converge_grid)
+
+
+def save_robustness_curves(robustness_filename, model_paths=None,
+                           noise_stddevs=ROBUSTNESS_STDDEVS, seed=0,
+                           chunk_size=64):
+    '''
+    INPUT:  (1) string: the filename (without .h5) to save the curves to
+            (2) list of strings, optional: the models to evaluate, without
+                .json or .h5 at the end; defaults to every saved model
+            (3) 1D numpy array: the test time noise standard deviations
+            (4) integer: the seed of the noisy test sets
+            (5) integer: test images to corrupt at a time
+    OUTPUT: None, but the curves are saved
+
+    Every model's classwise accuracy on test images corrupted at each of
+    the noise_stddevs (see calc_robustness_curves) is saved as
+    'classwise_acc', with the raw 'n_correct' and 'n_imgs' counts, on the
+    axes model, test_noise_stddev and class (see
+    results_store.save_labeled_grid). Models are run with NumpyModel.
+    '''
+    if model_paths is None:
+        model_paths = saved_model_paths()
+    model_param = set_basic_model_param(0)
+    X_train, y_train, X_test, y_test = load_and_format_mnist_data(
+        model_param, categorical_y=False)
+    n_classes = model_param['n_classes']
+    n_correct = np.zeros((len(model_paths), len(noise_stddevs), n_classes),
+                         dtype='int64')
+    for model_ind, path_to_model in enumerate(model_paths):
+        print 'Calculating robustness curves for {}'.format(path_to_model)
+        model = NumpyModel.from_saved_model(path_to_model)
+        try:
+            n_correct[model_ind], _ = calc_robustness_curves(
+                model, X_test, y_test, noise_stddevs=noise_stddevs,
+                seed=seed, chunk_size=chunk_size, n_classes=n_classes)
+        finally:
+            model.close()
+    n_imgs = np.broadcast_to(np.bincount(y_test, minlength=n_classes),
+                             n_correct.shape)
+    grid_axes = OrderedDict(
+        [('model', np.array([os.path.basename(path_to_model)
+                             for path_to_model in model_paths], dtype='S')),
+         ('test_noise_stddev', np.asarray(noise_stddevs)),
+         ('class', np.arange(n_classes))])
+    save_labeled_grid('{}.h5'.format(robustness_filename), grid_axes,
+                      classwise_acc=n_correct / n_imgs.astype(float),
+                      n_correct=n_correct, n_imgs=n_imgs)
@@ -0,0 +1,228 @@
+import json
+import time
+import Queue
+import argparse
+import threading
+from collections import deque
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import numpy as np
+from mnist_data import set_basic_model_param
+from additional_functions import ModelEvaluator
+
+
+class LatencyStats(object):
+    '''
+    Thread-safe request counters for one model: the latencies of the most
+    recent requests (for p50/p99), the total requests served and the sizes
+    of the batches they were served in.
+    '''
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.start_time = time.time()
+
+    def record_batch(self, latencies):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.n_requests += len(latencies)
+            self.n_batches += 1
+
+    def summary(self):
+        '''
+        INPUT:  None
+        OUTPUT: (1) Dictionary: p50 and p99 latency in ms over the recent
+                    window, requests served, mean batch size and requests/sec
+                    since the server started
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            n_requests, n_batches = self.n_requests, self.n_batches
+        summary = {'n_requests': n_requests,
+                   'n_batches': n_batches,
+                   'mean_batch_size': n_requests / float(max(n_batches, 1)),
+                   'requests_per_sec': n_requests / (time.time() -
+                                                     self.start_time),
+                   'p50_ms': None,
+                   'p99_ms': None}
+        if len(latencies):
+            summary['p50_ms'] = 1000 * np.percentile(latencies, 50)
+            summary['p99_ms'] = 1000 * np.percentile(latencies, 99)
+        return summary
+
+
+class MicroBatcher(object):
+    '''
+    Serves one resident model. Concurrent requests are queued, and a single
+    worker thread gathers them into batches: a batch is run as soon as it
+    holds max_batch_size images, or max_latency_ms after its first request
+    arrived, whichever comes first. Callers block in predict until their
+    result is ready.
+    '''
+    def __init__(self, evaluator, max_batch_size=64, max_latency_ms=5.):
+        self.evaluator = evaluator
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.
+        self.requests = Queue.Queue()
+        self.stats = LatencyStats()
+        worker = threading.Thread(target=self._serve_forever)
+        worker.daemon = True
+        worker.start()
+
+    def predict(self, image):
+        '''
+        INPUT:  (1) 3D numpy array: one image, of shape (#chan, #rows, #cols)
+        OUTPUT: (1) 1D numpy array: the predicted class probabilities
+        '''
+        request = {'image': image, 'arrival': time.time(),
+                   'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['probas']
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = batch[0]['arrival'] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _serve_forever(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                probas = self.evaluator.predict_proba(
+                    np.array([request['image'] for request in batch],
+                             dtype='float32'),
+                    batch_size=len(batch))
+                for request, request_probas in zip(batch, probas):
+                    request['probas'] = request_probas
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            finished = time.time()
+            for request in batch:
+                request['done'].set()
+            self.stats.record_batch([finished - request['arrival']
+                                     for request in batch])
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _InferenceRequestHandler(BaseHTTPRequestHandler):
+    '''
+    GET  /models              -> names of the resident models
+    GET  /stats               -> LatencyStats.summary() for each model
+    POST /predict/<model>     -> body {"image": [pixel, ...]}, pixel values
+                                 scaled 0-1 in (#chan, #rows, #cols) order;
+                                 returns {"probas": [...], "class": int}
+    '''
+    def _send_json(self, status, body):
+        response = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        batchers = self.server.batchers
+        if self.path == '/models':
+            self._send_json(200, {'models': sorted(batchers)})
+        elif self.path == '/stats':
+            self._send_json(200, {name: batcher.stats.summary()
+                                  for name, batcher in batchers.items()})
+        else:
+            self._send_json(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        prefix = '/predict/'
+        model_name = self.path[len(prefix):]
+        if (not self.path.startswith(prefix) or
+                model_name not in self.server.batchers):
+            self._send_json(404, {'error': 'unknown model'})
+            return
+        try:
+            length = int(self.headers.getheader('Content-Length'))
+            body = json.loads(self.rfile.read(length))
+            image = np.asarray(body['image'], dtype='float32').reshape(
+                self.server.image_shape)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            probas = self.server.batchers[model_name].predict(image)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'probas': probas.tolist(),
+                              'class': int(np.argmax(probas))})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_server(path_to_models, host='127.0.0.1', port=8000,
+                 max_batch_size=64, max_latency_ms=5.):
+    '''
+    INPUT:  (1) Dictionary: model names to serve them as, mapped to the path
+                to each saved model (not including .json or .h5)
+            (2) string: the host to listen on
+            (3) integer: the port to listen on
+            (4) integer: the largest micro-batch
+            (5) float: the longest a request waits for its batch to fill,
+                in ms
+    OUTPUT: (1) HTTP server, ready for serve_forever()
+
+    Every model is loaded once and kept resident, each behind its own
+    MicroBatcher.
+    '''
+    model_param = set_basic_model_param(0)
+    batchers = {}
+    for model_name, path_to_model in path_to_models.items():
+        evaluator = ModelEvaluator(model_param, max_cached_weights=1)
+        evaluator.load_weights(path_to_model)
+        batchers[model_name] = MicroBatcher(evaluator, max_batch_size,
+                                            max_latency_ms)
+    server = _ThreadingHTTPServer((host, port), _InferenceRequestHandler)
+    server.batchers = batchers
+    server.image_shape = (model_param['n_chan'], model_param['n_rows'],
+                          model_param['n_cols'])
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve saved KerasBaseModel models over HTTP.')
+    parser.add_argument('models', nargs='+',
+                        help='name=path pairs, eg. '
+                             'clean=models/KerasBaseModel_v.0.1_y_0.0')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-latency-ms', type=float, default=5.)
+    args = parser.parse_args(argv)
+
+    path_to_models = dict(model.split('=', 1) for model in args.models)
+    server = build_server(path_to_models, host=args.host, port=args.port,
+                          max_batch_size=args.max_batch_size,
+                          max_latency_ms=args.max_latency_ms)
+    print 'Serving {} on {}:{}'.format(', '.join(sorted(path_to_models)),
+                                       args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
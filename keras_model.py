@@ -1,90 +1,23 @@
-import numpy as np
-np.random.seed(1234)  # for reproducibility
 import time
 import os
-from keras.models import Sequential
+import pickle
+import numpy as np
+from keras.models import Sequential, Graph
 from keras.layers.core import Dense, Dropout, Activation, Flatten
 from keras.layers.convolutional import Convolution2D, MaxPooling2D
-from keras.utils import np_utils
-from keras.datasets import mnist
+from keras.callbacks import Callback
+from mnist_data import *
+from profiling_functions import telemetry_enabled, timed_span, TimingCallback
 
 
-def set_basic_model_param(model_info, dropout_scalar=1, batchsize=32):
-    ''' 
-    INPUT:  (1) any additional information (to be converted to string)
-                that will be added to the filename when the model is saved
-    OUTPUT: (1) Dictionary of important values for formatting data and 
-                compiling model. 
-
-    For lightweight tuning of the model (ie. no change in overall structure) 
-    it's easiest to keep all model parameters in one place.
-    '''
-    model_param = {'n_rows': 28, 
-                   'n_cols': 28,
-                   'n_chan': 1,
-                   'n_classes': 10,
-                   'n_epoch': 4,
-                   'batch_size': batchsize,
-                   'pool_size': 2,
-                   'conv_size': 3,
-                   'n_conv_nodes': 32,
-                   'n_dense_nodes': 128,
-                   'primary_dropout': 0.25*dropout_scalar,
-                   'secondary_dropout': 0.5*dropout_scalar,
-                   'model_build': 'v.0.1_{}'.format(model_info)}
-    return model_param
-
-
-def load_and_format_mnist_data(model_param, categorical_y=False):
-    ''' 
-    INPUT:  (1) Dictionary: values important for formatting data appropriately
-            (2) boolean: make the y values categorical? Keras requires the
-                shape (#labels, #unique_labels), ie. (10000, 10) to train the
-                model. However, randomizing the y labels is more easily done
-                before the y labels are made categorical, when they are
-                still of shape (#labels,) ie. (10000,)
-    OUTPUT: (1) 4D numpy array: the X training data, of shape (#train_images,
-                #chan, #rows, #columns); for MNIST this is (60000, 1, 28, 28)
-            (2) 1D numpy array: the training labels, y, of shape (60000,)
-            (3) 4D numpy array: the X test data, of shape (#test_images, 
-                #chan, #rows, #columns); for MNIST this is (10000, 1, 28, 28)
-            (4) 1D numpy array: the test labels, of shape (10000,)
-
-    This function loads the data and labels, reshapes the data to be in the 
-    4D tensor shape that Keras requires (#images, #color_channels, 
-    #rows, #cols) for training, and returns it. The method load_data() 
-    returns the MNIST data, shuffled and split between train and test set.
-    '''
-    (X_train, y_train), (X_test, y_test) = mnist.load_data()
-    num_train_images, num_test_images = X_train.shape[0], X_test.shape[0]
-    X_train = X_train.reshape(num_train_images, 
-                              model_param['n_chan'], 
-                              model_param['n_rows'],
-                              model_param['n_cols'])
-    X_test = X_test.reshape(num_test_images, 
-                            model_param['n_chan'],
-                            model_param['n_rows'],
-                            model_param['n_cols'])
-    X_train = X_train.astype('float32')
-    X_test = X_test.astype('float32')
-    X_train /= 255.
-    X_test /= 255.
-
-    if categorical_y:
-        y_train = np_utils.to_categorical(y_train, model_param['n_classes'])
-        y_test = np_utils.to_categorical(y_test, model_param['n_classes'])
-    return X_train, y_train, X_test, y_test
-
-
-def compile_model(model_param):
+def model_layers(model_param):
     ''' 
     INPUT:  (1) Dictionary of model parameters
-    OUTPUT: (1) Compiled (but untrained) Keras model
+    OUTPUT: (1) list: new, unconnected Keras layers, in order
 
     Any large scale model architecture changes would happen here in 
     conjunction with adjustments to set_basic_model_param.
     '''
-    model = Sequential()
     model_param_to_add = [Convolution2D(model_param['n_conv_nodes'], 
                                         model_param['conv_size'],
                                         model_param['conv_size'],
@@ -106,14 +39,118 @@ def compile_model(model_param):
                           Dropout(model_param['secondary_dropout']),
                           Dense(model_param['n_classes']),
                           Activation('softmax')]
+    return model_param_to_add
 
-    for process in model_param_to_add:
+
+def build_model(model_param):
+    ''' 
+    INPUT:  (1) Dictionary of model parameters
+    OUTPUT: (1) Uncompiled (and untrained) Keras model
+    '''
+    model = Sequential()
+    for process in model_layers(model_param):
         model.add(process)
+    return model
+
+
+def compile_model(model_param):
+    ''' 
+    INPUT:  (1) Dictionary of model parameters
+    OUTPUT: (1) Compiled (but untrained) Keras model
+    '''
+    model = build_model(model_param)
     model.compile(loss='categorical_crossentropy', optimizer='adadelta')
     return model
 
 
-def fit_and_save_model(model, model_param, X_train, y_train, X_test, y_test):
+class EpochCheckpoint(Callback):
+    '''
+    Keras callback that overwrites a checkpoint of the weights at the end of
+    every epoch, then calls on_checkpoint(n_epochs_done) so the caller can
+    record progress (see sweep_functions.run_sweep_job).
+    '''
+    def __init__(self, checkpoint_file_name, initial_epoch=0,
+                 on_checkpoint=None):
+        super(EpochCheckpoint, self).__init__()
+        self.checkpoint_file_name = checkpoint_file_name
+        self.initial_epoch = initial_epoch
+        self.on_checkpoint = on_checkpoint
+
+    def on_epoch_end(self, epoch, logs={}):
+        self.model.save_weights(self.checkpoint_file_name, overwrite=True)
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self.initial_epoch + epoch + 1)
+
+
+class EpochHistory(Callback):
+    '''
+    Keras callback that records the loss and accuracy of every epoch along
+    with its wall time (including validation), its training time (up to
+    the end of the last batch, so without validation) and training
+    images/sec, which is based on the training time.
+    '''
+    def __init__(self, n_samples):
+        super(EpochHistory, self).__init__()
+        self.n_samples = n_samples
+        self.history = {'loss': [], 'acc': [], 'val_loss': [], 'val_acc': [],
+                        'epoch_time': [], 'train_time': [],
+                        'samples_per_sec': []}
+
+    def on_epoch_begin(self, epoch, logs={}):
+        self.epoch_start = time.time()
+        self.last_batch_end = self.epoch_start
+
+    def on_batch_end(self, batch, logs={}):
+        self.last_batch_end = time.time()
+
+    def on_epoch_end(self, epoch, logs={}):
+        epoch_time = time.time() - self.epoch_start
+        train_time = self.last_batch_end - self.epoch_start
+        for key in ['loss', 'acc', 'val_loss', 'val_acc']:
+            self.history[key].append(logs.get(key))
+        self.history['epoch_time'].append(epoch_time)
+        self.history['train_time'].append(train_time)
+        self.history['samples_per_sec'].append(self.n_samples / train_time)
+
+
+class EarlyStoppingRestoreBest(Callback):
+    '''
+    Keras callback that stops training once the validation loss has not
+    improved by more than min_delta for patience epochs, then (optionally)
+    puts back the weights from the best epoch.
+    '''
+    def __init__(self, patience, min_delta=0., restore_best_weights=True):
+        super(EarlyStoppingRestoreBest, self).__init__()
+        self.patience = patience
+        self.min_delta = min_delta
+        self.restore_best_weights = restore_best_weights
+        self.best_loss = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+        self.wait = 0
+
+    def on_epoch_end(self, epoch, logs={}):
+        val_loss = logs.get('val_loss')
+        if val_loss < self.best_loss - self.min_delta:
+            self.best_loss = val_loss
+            self.best_epoch = epoch
+            self.wait = 0
+            if self.restore_best_weights:
+                self.best_weights = self.model.get_weights()
+        else:
+            self.wait += 1
+            if self.wait >= self.patience:
+                print 'Early stopping after epoch {}'.format(epoch + 1)
+                self.model.stop_training = True
+
+    def on_train_end(self, logs={}):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+
+def fit_and_save_model(model, model_param, X_train, y_train, X_test, y_test,
+                       initial_epoch=0, callbacks=None, train_generator=None,
+                       overwrite=False, lineage=None):
     ''' 
     INPUT:  (1) Compiled (but untrained) Keras model
             (2) Dictionary of model parameters
@@ -123,28 +160,213 @@ def fit_and_save_model(model, model_param, X_train, y_train, X_test, y_test):
             (5) 4D numpy array: the X test data, of shape (#test_images, 
                 #chan, #rows, #columns); for MNIST this is (10000, 1, 28, 28)
             (6) 1D numpy array: the test labels, of shape (10000,)
-    OUTPUT: None, but the model will be saved to /models
-    '''
-    start = time.clock()
-    model.fit(X_train, y_train, batch_size=model_param['batch_size'],
-              nb_epoch=model_param['n_epoch'],
-              show_accuracy=True, verbose=1,
-              validation_data=(X_test, y_test))
-    stop = time.clock()
+            (7) integer: the number of epochs the model has already been
+                trained for, when resuming from a checkpoint; only the
+                remaining n_epoch - initial_epoch epochs are run
+            (8) list, optional: extra Keras callbacks, eg. EpochCheckpoint
+            (9) generator, optional: yields (X_batch, y_batch) training
+                batches, eg. additional_functions.noisy_batch_generator.
+                If given, the model is trained on its batches and X_train
+                is only used for the number of images per epoch.
+            (10) boolean: replace an existing model of the same name (see
+                save_model)
+            (11) Dictionary, optional: where the model's initial weights came
+                from when it was warm started (see run_warm_start_sweep)
+    OUTPUT: (1) Dictionary: the saved file names, test score and accuracy,
+                and wall clock run time in minutes. The model will be saved
+                to /models
+
+    If model_param['patience'] is set, training stops early once the
+    validation loss plateaus and the best epoch's weights are the ones
+    saved. The per-epoch history (see EpochHistory) is pickled next to the
+    weights, with the same name and a .pkl extension, along with the
+    lineage of a warm started model. With telemetry on
+    (see profiling_functions), batch, epoch, validation and save spans are
+    recorded as well.
+    '''
+    history = EpochHistory(X_train.shape[0])
+    callbacks = [history] + (callbacks or [])
+    if telemetry_enabled():
+        # First, so the other callbacks' work is not counted in its spans
+        callbacks.insert(0, TimingCallback(model=model_param['model_build']))
+    early_stopping = None
+    if model_param['patience'] is not None:
+        early_stopping = EarlyStoppingRestoreBest(model_param['patience'],
+                                                  model_param['min_delta'])
+        callbacks.append(early_stopping)
+    start = time.time()
+    if train_generator is None:
+        model.fit(X_train, y_train, batch_size=model_param['batch_size'],
+                  nb_epoch=model_param['n_epoch'] - initial_epoch,
+                  show_accuracy=True, verbose=1,
+                  validation_data=(X_test, y_test),
+                  callbacks=callbacks)
+    else:
+        model.fit_generator(train_generator,
+                            samples_per_epoch=X_train.shape[0],
+                            nb_epoch=model_param['n_epoch'] - initial_epoch,
+                            show_accuracy=True, verbose=1,
+                            validation_data=(X_test, y_test),
+                            callbacks=callbacks)
+    stop = time.time()
     total_run_time = (stop - start) / 60.
     score = model.evaluate(X_test, y_test, show_accuracy=True, verbose=0)
     print 'Test score: {}'.format(score[0])
     print 'Test accuracy: {}'.format(score[1])
     print 'Total run time: {}'.format(total_run_time)
 
-    model_name = 'KerasBaseModel_{}'.format(model_param['model_build'])
-    path_to_save_model = 'models/{}'.format(model_name)
+    with timed_span('save', model=model_param['model_build']):
+        json_file_name, weights_file_name = save_model(model, model_param,
+                                                       overwrite=overwrite)
+    history_file_name = '{}.pkl'.format(os.path.splitext(weights_file_name)[0])
+    model_history = dict(history.history, initial_epoch=initial_epoch)
+    if early_stopping is not None:
+        model_history['best_epoch'] = early_stopping.best_epoch
+    if lineage is not None:
+        model_history['lineage'] = lineage
+    if os.path.isfile(history_file_name):
+        os.remove(history_file_name)
+    pickle.dump(model_history, open(history_file_name, 'wb'))
+    return {'json_file_name': json_file_name,
+            'weights_file_name': weights_file_name,
+            'history_file_name': history_file_name,
+            'n_epochs_run': len(history.history['loss']),
+            'test_score': score[0],
+            'test_accuracy': score[1],
+            'run_time': total_run_time}
+
+
+def model_path(model_param):
+    '''
+    INPUT:  (1) Dictionary of model parameters
+    OUTPUT: (1) string: the path the model is saved to, without .json, .h5
+                or .pkl at the end
+    '''
+    return 'models/KerasBaseModel_{}'.format(model_param['model_build'])
+
+
+def save_model(model, model_param, overwrite=False):
+    '''
+    INPUT:  (1) Trained Keras model
+            (2) Dictionary of model parameters
+            (3) boolean: replace an existing model of the same name
+    OUTPUT: (1) string: the file name the architecture was saved to
+            (2) string: the file name the weights were saved to
+
+    Raises IOError if the model exists and overwrite is False. Existing
+    files are removed before the new ones are written, so a model that is
+    hard-linked into the model cache (see sweep_functions) is replaced
+    rather than written through.
+    '''
+    path_to_save_model = model_path(model_param)
     json_file_name = '{}.json'.format(path_to_save_model)
     weights_file_name = '{}.h5'.format(path_to_save_model)
-    if os.path.isfile(json_file_name) or os.path.isfile(weights_file_name):
-        json_file_name = '{}_copy.json'.format(path_to_save_model)
-        weights_file_name = '{}_copy.h5'.format(path_to_save_model)
-        print 'Please rename the model next time to avoid conflicts!'
+    for file_name in [json_file_name, weights_file_name]:
+        if os.path.isfile(file_name):
+            if not overwrite:
+                raise IOError('{} already exists; pass overwrite=True to '
+                              'replace it'.format(file_name))
+            os.remove(file_name)
     json_string = model.to_json()
     open(json_file_name, 'w').write(json_string)
-    model.save_weights(weights_file_name)
+    model.save_weights(weights_file_name, overwrite=True)
+    return json_file_name, weights_file_name
+
+
+def compile_model_swarm(model_params):
+    '''
+    INPUT:  (1) list of Dictionaries: model parameters for each copy of the
+                network; they may differ in dropout but not in architecture
+    OUTPUT: (1) Compiled (but untrained) Keras Graph with one input and one
+                output per copy, named 'output_0', 'output_1', ...
+            (2) list of lists: the layers of each copy, in order
+
+    The copies are independent (no shared weights) but are compiled into a
+    single Theano function, so every training batch is loaded and passed
+    to all of them in one call. Keras 0.3 has no grouped convolution, so
+    each copy still runs its own convolutions.
+    '''
+    model_param = model_params[0]
+    swarm = Graph()
+    swarm.add_input(name='input', input_shape=(model_param['n_chan'],
+                                               model_param['n_rows'],
+                                               model_param['n_cols']))
+    swarm_layers = []
+    losses = {}
+    for copy_ind, model_param in enumerate(model_params):
+        layers = model_layers(model_param)
+        previous_name = 'input'
+        for layer_ind, layer in enumerate(layers):
+            layer_name = 'copy_{}_layer_{}'.format(copy_ind, layer_ind)
+            swarm.add_node(layer, name=layer_name, input=previous_name)
+            previous_name = layer_name
+        output_name = 'output_{}'.format(copy_ind)
+        swarm.add_output(name=output_name, input=previous_name)
+        losses[output_name] = 'categorical_crossentropy'
+        swarm_layers.append(layers)
+    swarm.compile(optimizer='adadelta', loss=losses)
+    return swarm, swarm_layers
+
+
+def fit_and_save_model_swarm(swarm, swarm_layers, model_params, X_train,
+                             y_trains, X_test, y_test, overwrite=False):
+    '''
+    INPUT:  (1) Compiled (but untrained) Keras Graph from compile_model_swarm
+            (2) list of lists: the layers of each copy
+            (3) list of Dictionaries: model parameters for each copy; all
+                must have the same batch_size and n_epoch
+            (4) 4D numpy array: the X training data, shared by every copy
+            (5) list of 2D numpy arrays: categorical training labels for
+                each copy
+            (6) 4D numpy array: the X test data
+            (7) 2D numpy array: the categorical test labels
+            (8) boolean: replace existing models of the same names (see
+                save_model)
+    OUTPUT: (1) list of Dictionaries: the saved file names, test accuracy
+                and run time of each copy, as from fit_and_save_model
+
+    Each copy is saved as an ordinary compile_model network under its own
+    model_build name, so it can be loaded and evaluated like any other.
+    '''
+    batch_sizes = set(model_param['batch_size'] for model_param in model_params)
+    n_epochs = set(model_param['n_epoch'] for model_param in model_params)
+    if len(batch_sizes) != 1 or len(n_epochs) != 1:
+        raise ValueError('All models in a swarm need the same batch_size '
+                         'and n_epoch')
+    if any(model_param['patience'] is not None for model_param in model_params):
+        raise ValueError('Early stopping is per model and cannot be used '
+                         'in a swarm')
+    output_names = ['output_{}'.format(copy_ind)
+                    for copy_ind in range(len(model_params))]
+    train_data = {'input': X_train}
+    train_data.update(zip(output_names, y_trains))
+    test_data = {'input': X_test}
+    test_data.update((output_name, y_test) for output_name in output_names)
+
+    start = time.time()
+    swarm.fit(train_data, batch_size=batch_sizes.pop(),
+              nb_epoch=n_epochs.pop(), verbose=1,
+              validation_data=test_data)
+    total_run_time = (time.time() - start) / 60.
+    print 'Total run time for {} models: {}'.format(len(model_params),
+                                                    total_run_time)
+
+    probas = swarm.predict({'input': X_test})
+    y_test_labels = np.argmax(y_test, axis=1)
+    results = []
+    for output_name, layers, model_param in zip(output_names, swarm_layers,
+                                                model_params):
+        model = build_model(model_param)
+        model.set_weights([weights for layer in layers
+                           for weights in layer.get_weights()])
+        json_file_name, weights_file_name = save_model(model, model_param,
+                                                       overwrite=overwrite)
+        test_accuracy = np.mean(np.argmax(probas[output_name], axis=1) ==
+                                y_test_labels)
+        print 'Test accuracy of {}: {}'.format(model_param['model_build'],
+                                               test_accuracy)
+        results.append({'json_file_name': json_file_name,
+                        'weights_file_name': weights_file_name,
+                        'test_accuracy': test_accuracy,
+                        'run_time': total_run_time / len(model_params)})
+    return results
@@ -0,0 +1,185 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+# Model parameters and MNIST loading, kept free of Keras model, backend and
+# plotting imports so evaluation jobs can import them cheaply. The Keras
+# dataset helpers are imported inside the functions that download or
+# one-hot encode the data.
+
+MNIST_ORIGIN = 'https://s3.amazonaws.com/img-datasets/mnist.pkl.gz'
+MNIST_CACHE_DIR = os.path.expanduser('~/.keras/datasets/mnist_cache')
+
+
+def set_basic_model_param(model_info, dropout_scalar=1, batchsize=32,
+                          n_epoch=4, patience=None, min_delta=0.):
+    ''' 
+    INPUT:  (1) any additional information (to be converted to string)
+                that will be added to the filename when the model is saved
+            (2) float: the scalar by which to change the built-in dropout
+            (3) integer: the batch size
+            (4) integer: the number of epochs to train for (at most, if
+                early stopping is on)
+            (5) integer, optional: stop training after this many epochs
+                without the validation loss improving. None trains for the
+                full n_epoch.
+            (6) float: the smallest decrease in validation loss that counts
+                as an improvement
+    OUTPUT: (1) Dictionary of important values for formatting data and 
+                compiling model. 
+
+    For lightweight tuning of the model (ie. no change in overall structure) 
+    it's easiest to keep all model parameters in one place.
+    '''
+    model_param = {'n_rows': 28, 
+                   'n_cols': 28,
+                   'n_chan': 1,
+                   'n_classes': 10,
+                   'n_epoch': n_epoch,
+                   'patience': patience,
+                   'min_delta': min_delta,
+                   'batch_size': batchsize,
+                   'pool_size': 2,
+                   'conv_size': 3,
+                   'n_conv_nodes': 32,
+                   'n_dense_nodes': 128,
+                   'primary_dropout': 0.25*dropout_scalar,
+                   'secondary_dropout': 0.5*dropout_scalar,
+                   'model_build': 'v.0.1_{}'.format(model_info)}
+    return model_param
+
+
+def replicate_name(name_to_append, replicate):
+    '''
+    INPUT:  (1) string: the name appended to a saved model
+            (2) integer: the replicate number
+    OUTPUT: (1) string: the name for that replicate. Replicate 0 keeps the
+                plain name, so models trained before replicates existed are
+                replicate 0.
+    '''
+    if replicate == 0:
+        return name_to_append
+    return '{}_r{}'.format(name_to_append, replicate)
+
+
+def _format_mnist_data(model_param, dtype):
+    '''
+    INPUT:  (1) Dictionary: values important for formatting data appropriately
+            (2) string: 'float32' for pixel values scaled to 0-1, or 'uint8'
+                for the raw 0-255 pixel values
+    OUTPUT: (1)-(4) X_train, y_train, X_test, y_test as described in
+                load_and_format_mnist_data, with y not categorical
+    '''
+    from keras.datasets import mnist
+    (X_train, y_train), (X_test, y_test) = mnist.load_data()
+    num_train_images, num_test_images = X_train.shape[0], X_test.shape[0]
+    X_train = X_train.reshape(num_train_images, 
+                              model_param['n_chan'], 
+                              model_param['n_rows'],
+                              model_param['n_cols'])
+    X_test = X_test.reshape(num_test_images, 
+                            model_param['n_chan'],
+                            model_param['n_rows'],
+                            model_param['n_cols'])
+    if dtype == 'float32':
+        X_train = X_train.astype('float32')
+        X_test = X_test.astype('float32')
+        X_train /= 255.
+        X_test /= 255.
+    else:
+        X_train = X_train.astype(dtype)
+        X_test = X_test.astype(dtype)
+    return X_train, y_train, X_test, y_test
+
+
+def _mnist_cache_path(model_param, dtype, cache_dir):
+    '''
+    INPUT:  (1) Dictionary: values important for formatting data appropriately
+            (2) string: dtype of the cached X data
+            (3) string: the root directory of the cache
+    OUTPUT: (1) string: the directory holding this version of the cache
+
+    The directory name is a hash of everything the cached arrays depend on:
+    the source archive (path, size and modification time), the image shape
+    in model_param and the dtype. Any change to these points at a new
+    directory, so stale caches are never read.
+    '''
+    try:
+        from keras.utils.data_utils import get_file
+    except ImportError:
+        from keras.datasets.data_utils import get_file
+    archive_path = get_file('mnist.pkl.gz', origin=MNIST_ORIGIN)
+    archive_stat = os.stat(archive_path)
+    key = '{}_{}_{}_{}_{}_{}_{}'.format(os.path.abspath(archive_path),
+                                        archive_stat.st_size,
+                                        archive_stat.st_mtime,
+                                        model_param['n_chan'],
+                                        model_param['n_rows'],
+                                        model_param['n_cols'],
+                                        dtype)
+    return os.path.join(cache_dir, hashlib.sha1(key).hexdigest())
+
+
+def load_and_format_mnist_data(model_param, categorical_y=False,
+                               dtype='float32', cache_dir=MNIST_CACHE_DIR):
+    ''' 
+    INPUT:  (1) Dictionary: values important for formatting data appropriately
+            (2) boolean: make the y values categorical? Keras requires the
+                shape (#labels, #unique_labels), ie. (10000, 10) to train the
+                model. However, randomizing the y labels is more easily done
+                before the y labels are made categorical, when they are
+                still of shape (#labels,) ie. (10000,)
+            (3) string: 'float32' (the default) for pixel values scaled to
+                0-1, or 'uint8' for the raw 0-255 pixel values
+            (4) string: directory for the cache of formatted arrays; None
+                skips the cache and formats the data from scratch
+    OUTPUT: (1) 4D numpy array: the X training data, of shape (#train_images,
+                #chan, #rows, #columns); for MNIST this is (60000, 1, 28, 28)
+            (2) 1D numpy array: the training labels, y, of shape (60000,)
+            (3) 4D numpy array: the X test data, of shape (#test_images, 
+                #chan, #rows, #columns); for MNIST this is (10000, 1, 28, 28)
+            (4) 1D numpy array: the test labels, of shape (10000,)
+
+    This function loads the data and labels, reshapes the data to be in the 
+    4D tensor shape that Keras requires (#images, #color_channels, 
+    #rows, #cols) for training, and returns it. The method load_data() 
+    returns the MNIST data, shuffled and split between train and test set.
+
+    The formatted arrays are saved to cache_dir the first time and opened
+    read-only with mmap_mode='r' afterwards, so every process using the
+    cache shares one copy of the X data through the OS page cache. The X
+    arrays returned from the cache are read-only; copy them before
+    modifying them in place.
+    '''
+    if cache_dir is None:
+        X_train, y_train, X_test, y_test = _format_mnist_data(model_param,
+                                                              dtype)
+    else:
+        cache_path = _mnist_cache_path(model_param, dtype, cache_dir)
+        array_names = ['X_train', 'y_train', 'X_test', 'y_test']
+        if not os.path.isdir(cache_path):
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # Write to a temporary directory and rename it into place so
+            # concurrent workers never see a half-written cache.
+            tmp_path = tempfile.mkdtemp(dir=cache_dir)
+            arrays = _format_mnist_data(model_param, dtype)
+            for array_name, array in zip(array_names, arrays):
+                np.save(os.path.join(tmp_path, array_name), array)
+            try:
+                os.rename(tmp_path, cache_path)
+            except OSError:
+                shutil.rmtree(tmp_path)
+        X_train, y_train, X_test, y_test = [
+            np.load(os.path.join(cache_path, '{}.npy'.format(array_name)),
+                    mmap_mode='r' if array_name.startswith('X') else None)
+            for array_name in array_names]
+
+    if categorical_y:
+        from keras.utils import np_utils
+        y_train = np_utils.to_categorical(y_train, model_param['n_classes'])
+        y_test = np_utils.to_categorical(y_test, model_param['n_classes'])
+    return X_train, y_train, X_test, y_test
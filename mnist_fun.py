@@ -0,0 +1,255 @@
+import argparse
+
+
+# Each command imports what it needs when it runs, so plot-grid and render
+# never load Keras and eval-grid never loads matplotlib.
+
+
+def train_grid(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the train-grid subcommand
+    OUTPUT: None, but every model on the meshgrid is trained and saved
+    '''
+    from training_functions import (load_meshgrid_param, train_model_meshgrid,
+                                    save_adaptive_accuracy_meshgrid)
+    if args.adaptive is not None:
+        save_adaptive_accuracy_meshgrid(args.adaptive,
+                                        n_refinements=args.n_refinements,
+                                        max_epoch=args.n_epoch,
+                                        n_workers=args.n_workers)
+        return
+    fit_param = {'n_epoch': args.n_epoch, 'patience': args.patience,
+                 'min_delta': args.min_delta}
+    percent_random_labels, batchsizes, dropout_scalars = load_meshgrid_param()
+    train_model_meshgrid(percent_random_labels, batchsizes, dropout_scalars,
+                         n_workers=args.n_workers, n_threads=args.n_threads,
+                         swarm_size=args.swarm_size, fit_param=fit_param,
+                         n_replicates=args.n_replicates,
+                         warm_start=args.warm_start,
+                         trunk_weights_file=args.trunk, queue_dir=args.queue)
+
+
+def queue_worker(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the queue-worker subcommand
+    OUTPUT: None, but jobs are leased from the queue and trained until it
+            is empty
+    '''
+    from work_queue import run_queue_worker
+    run_queue_worker(args.queue_dir, worker_id=args.worker_id,
+                     n_threads=args.n_threads,
+                     lease_timeout=args.lease_timeout,
+                     exit_when_idle=not args.keep_polling)
+
+
+def train_one(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the train-one subcommand
+    OUTPUT: None, but the model is trained data-parallel and saved
+    '''
+    from training_functions import train_single_model
+    fit_param = {'n_epoch': args.n_epoch, 'patience': args.patience,
+                 'min_delta': args.min_delta}
+    train_single_model(args.X_or_y, args.noise_val, batchsize=args.batchsize,
+                       dropout_scalar=args.dropout_scalar,
+                       n_workers=args.n_workers, fit_param=fit_param)
+
+
+def eval_grid(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the eval-grid subcommand
+    OUTPUT: None, but the accuracy grid (or, with --converge, the epochs to
+            converge grid) of the trained meshgrid is saved with its axes
+    '''
+    from evaluation_functions import (load_meshgrid_param,
+                                      calc_meshgrid_acc_replicates,
+                                      save_time_to_converge_meshgrid,
+                                      meshgrid_axes, results_grid,
+                                      replicate_statistics, save_labeled_grid)
+    if args.converge:
+        save_time_to_converge_meshgrid(args.grid_filename)
+        return
+    grid_axes = meshgrid_axes(*load_meshgrid_param())
+    if args.results is None:
+        acc_grids = calc_meshgrid_acc_replicates(
+            *grid_axes.values(), n_replicates=args.n_replicates)
+    else:
+        axis_values = dict(grid_axes, replicate=range(args.n_replicates))
+        acc_grids, _ = results_grid(args.results,
+                                    axes=['replicate'] + list(grid_axes),
+                                    axis_values=axis_values, X_or_y='y')
+    acc_stats = replicate_statistics(acc_grids)
+    save_labeled_grid('{}.h5'.format(args.grid_filename), grid_axes,
+                      acc_grid=acc_stats['mean'], acc_std=acc_stats['std'],
+                      acc_ci_low=acc_stats['ci_low'],
+                      acc_ci_high=acc_stats['ci_high'],
+                      n_replicates=acc_stats['n_replicates'])
+
+
+def eval_robustness(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the eval-robustness subcommand
+    OUTPUT: None, but every model's classwise accuracy on noisy test images
+            is saved
+    '''
+    from evaluation_functions import save_robustness_curves
+    save_robustness_curves(args.robustness_filename,
+                           model_paths=args.models or None, seed=args.seed,
+                           chunk_size=args.chunk_size)
+
+
+def plot_grid(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the plot-grid subcommand
+    OUTPUT: None, but the accuracy surface is shown or saved
+    '''
+    from plotting_functions import plot_accuracy_meshgrid
+    plot_accuracy_meshgrid(args.grid_file, saveas=args.saveas)
+
+
+def render(args):
+    '''
+    INPUT:  (1) argparse Namespace: from the render subcommand
+    OUTPUT: None, but every changed figure is rendered off-screen
+    '''
+    from render_functions import default_render_jobs, render_figures
+    render_jobs = default_render_jobs(
+        args.acc_grids, plot_dir=args.plot_dir,
+        noise_stddevs=args.noise_stddevs,
+        percent_random_labels=args.percent_random_labels)
+    render_figures(render_jobs, n_workers=args.n_workers, force=args.force)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Train, evaluate and plot the label noise meshgrid.')
+    subparsers = parser.add_subparsers()
+
+    train_parser = subparsers.add_parser(
+        'train-grid', help='train every model on the meshgrid')
+    train_parser.add_argument('--n-workers', type=int, default=1)
+    train_parser.add_argument('--n-threads', type=int,
+                              help='BLAS threads per worker')
+    train_parser.add_argument('--swarm-size', type=int, default=1,
+                              help='train this many models at a time in one '
+                                   'swarm instead of using workers')
+    train_parser.add_argument('--n-epoch', type=int, default=4,
+                              help='epochs per model; with --adaptive, the '
+                                   'most any model is trained for')
+    train_parser.add_argument('--patience', type=int,
+                              help='turn on early stopping')
+    train_parser.add_argument('--min-delta', type=float, default=0.)
+    train_parser.add_argument('--adaptive', metavar='GRID_FILENAME',
+                              help='run the adaptive sweep instead, saving '
+                                   'its accuracy grid to GRID_FILENAME.h5')
+    train_parser.add_argument('--n-refinements', type=int, default=2)
+    train_parser.add_argument('--n-replicates', type=int, default=1,
+                              help='independently seeded replicates of '
+                                   'every grid point')
+    train_parser.add_argument('--warm-start', action='store_true',
+                              help='start each noise level from the model '
+                                   'trained on the next lower one and stop '
+                                   'early (default patience 2)')
+    train_parser.add_argument('--trunk', metavar='WEIGHTS',
+                              help='warm start every model from these '
+                                   'pretrained .h5 weights instead')
+    train_parser.add_argument('--queue', metavar='QUEUE_DIR',
+                              help='publish the grid to this shared work '
+                                   'queue and wait for queue-worker '
+                                   'processes to train it')
+    train_parser.set_defaults(func=train_grid)
+
+    worker_parser = subparsers.add_parser(
+        'queue-worker', help='train jobs from a shared work queue')
+    worker_parser.add_argument('queue_dir')
+    worker_parser.add_argument('--worker-id',
+                               help='default: <hostname>_<pid>')
+    worker_parser.add_argument('--n-threads', type=int,
+                               help='BLAS threads to train with')
+    worker_parser.add_argument('--lease-timeout', type=float, default=600,
+                               help='seconds without a heartbeat before a '
+                                    'job is requeued')
+    worker_parser.add_argument('--keep-polling', action='store_true',
+                               help='wait for new jobs when the queue is '
+                                    'empty')
+    worker_parser.set_defaults(func=queue_worker)
+
+    one_parser = subparsers.add_parser(
+        'train-one', help='train one model fast, splitting every batch '
+                          'across worker processes')
+    one_parser.add_argument('X_or_y', choices=['X', 'y'])
+    one_parser.add_argument('noise_val', type=float)
+    one_parser.add_argument('--batchsize', type=int, default=1024)
+    one_parser.add_argument('--dropout-scalar', type=float, default=1.)
+    one_parser.add_argument('--n-workers', type=int,
+                            help='default: one per CPU')
+    one_parser.add_argument('--n-epoch', type=int, default=4)
+    one_parser.add_argument('--patience', type=int,
+                            help='turn on early stopping')
+    one_parser.add_argument('--min-delta', type=float, default=0.)
+    one_parser.set_defaults(func=train_one)
+
+    eval_parser = subparsers.add_parser(
+        'eval-grid', help='calculate the accuracy grid of the trained models')
+    eval_parser.add_argument('grid_filename',
+                             help='saved as GRID_FILENAME.h5')
+    eval_parser.add_argument('--results', metavar='RESULTS_PATH',
+                             help='read the accuracies recorded in this '
+                                  'results store instead of predicting '
+                                  'with every model')
+    eval_parser.add_argument('--n-replicates', type=int, default=1,
+                             help='summarise this many replicates as a mean, '
+                                  'std and 95%% bootstrap interval')
+    eval_parser.add_argument('--converge', action='store_true',
+                             help='save the epochs each model took to '
+                                  'converge instead of the accuracies')
+    eval_parser.set_defaults(func=eval_grid)
+
+    robustness_parser = subparsers.add_parser(
+        'eval-robustness', help='calculate each model\'s classwise accuracy '
+                                'on test images with Gaussian noise of '
+                                'stddev 0 to 192')
+    robustness_parser.add_argument('robustness_filename',
+                                   help='saved as ROBUSTNESS_FILENAME.h5')
+    robustness_parser.add_argument('--models', nargs='*',
+                                   help='saved models, without .h5; default: '
+                                        'every model in models/')
+    robustness_parser.add_argument('--seed', type=int, default=0)
+    robustness_parser.add_argument('--chunk-size', type=int, default=64,
+                                   help='test images to corrupt at a time')
+    robustness_parser.set_defaults(func=eval_robustness)
+
+    plot_parser = subparsers.add_parser(
+        'plot-grid', help='plot a saved accuracy grid as a surface')
+    plot_parser.add_argument('grid_file', help='a .h5 from eval-grid')
+    plot_parser.add_argument('--saveas',
+                             help='save the plot to SAVEAS.png instead of '
+                                  'showing it')
+    plot_parser.set_defaults(func=plot_grid)
+
+    render_parser = subparsers.add_parser(
+        'render', help='render all figures off-screen, skipping unchanged ones')
+    render_parser.add_argument('acc_grids', nargs='*',
+                               help='.h5 accuracy grids to plot as surfaces')
+    render_parser.add_argument('--plot-dir', default='plots')
+    render_parser.add_argument('--noise-stddevs', type=float, nargs='+',
+                               help='plot classwise accuracy vs. the noise '
+                                    'of the models trained on noisy X at '
+                                    'these standard deviations')
+    render_parser.add_argument('--percent-random-labels', type=float,
+                               nargs='+',
+                               help='plot accuracy vs. the fraction of '
+                                    'random labels of the models trained on '
+                                    'noisy y at these fractions')
+    render_parser.add_argument('--n-workers', type=int,
+                               help='default: one per CPU')
+    render_parser.add_argument('--force', action='store_true',
+                               help='render unchanged figures too')
+    render_parser.set_defaults(func=render)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from weight_io import load_weight_arrays
+from packed_models import load_packed_model, unpack_weights
+
+
+# Runs the compile_model network (conv -> relu -> conv -> relu -> maxpool ->
+# dense -> relu -> dense -> softmax) with NumPy alone, so evaluation jobs
+# need neither Keras nor a Theano compile. Dropout is a no-op at inference.
+# The im2col matrix of a convolution is built for at most IM2COL_BYTES of
+# images at a time (per thread), so memory does not grow with the chunk size.
+IM2COL_BYTES = 16 * 2**20
+
+
+def _conv2d_valid(X, W, b):
+    '''
+    INPUT:  (1) 4D numpy array: images, of shape (#imgs, #chan, #rows, #cols)
+            (2) 4D numpy array: Keras (Theano ordering) convolution weights,
+                of shape (#filters, #chan, #kernel_rows, #kernel_cols)
+            (3) 1D numpy array: the biases, one per filter
+    OUTPUT: (1) 4D numpy array: the 'valid' convolution, of shape
+                (#imgs, #filters, #rows - #kernel_rows + 1,
+                 #cols - #kernel_cols + 1)
+
+    Theano's conv2d is a true convolution, so the kernels are flipped
+    before the sliding-window dot product. The windows are taken with
+    as_strided (no copy) and gathered into an im2col matrix for a BLAS
+    matrix multiply, one block of images at a time so the matrix stays
+    within IM2COL_BYTES.
+    '''
+    n_imgs, n_chan, n_rows, n_cols = X.shape
+    n_filters, _, k_rows, k_cols = W.shape
+    out_rows, out_cols = n_rows - k_rows + 1, n_cols - k_cols + 1
+    X = np.ascontiguousarray(X)
+    s_img, s_chan, s_row, s_col = X.strides
+    windows = as_strided(X,
+                         shape=(n_imgs, out_rows, out_cols,
+                                n_chan, k_rows, k_cols),
+                         strides=(s_img, s_row, s_col,
+                                  s_chan, s_row, s_col))
+    kernels = W[:, :, ::-1, ::-1].reshape((n_filters, -1))
+    img_bytes = out_rows * out_cols * n_chan * k_rows * k_cols * X.itemsize
+    block_size = max(1, IM2COL_BYTES // img_bytes)
+    out = np.empty((n_imgs, n_filters, out_rows, out_cols),
+                   dtype=np.result_type(X, W, b))
+    for start in range(0, n_imgs, block_size):
+        block = windows[start:start + block_size]
+        cols = block.reshape((block.shape[0] * out_rows * out_cols,
+                              n_chan * k_rows * k_cols))
+        out[start:start + block_size] = (np.dot(cols, kernels.T) + b) \
+            .reshape((block.shape[0], out_rows, out_cols, n_filters)) \
+            .transpose((0, 3, 1, 2))
+    return out
+
+
+def _max_pool(X, pool_size):
+    '''
+    INPUT:  (1) 4D numpy array: of shape (#imgs, #chan, #rows, #cols)
+            (2) integer: the (square) pool size
+    OUTPUT: (1) 4D numpy array: the max over non-overlapping pool_size
+                windows; leftover rows and columns are dropped, as Keras does
+    '''
+    n_imgs, n_chan, n_rows, n_cols = X.shape
+    out_rows, out_cols = n_rows // pool_size, n_cols // pool_size
+    X = X[:, :, :out_rows * pool_size, :out_cols * pool_size]
+    return X.reshape((n_imgs, n_chan, out_rows, pool_size,
+                      out_cols, pool_size)).max(axis=5).max(axis=3)
+
+
+def _relu(X):
+    return np.maximum(X, 0, out=X)
+
+
+def _softmax(X):
+    X = X - X.max(axis=1, keepdims=True)
+    np.exp(X, out=X)
+    X /= X.sum(axis=1, keepdims=True)
+    return X
+
+
+class NumpyModel(object):
+    '''
+    A NumPy forward pass for a trained compile_model network, with the same
+    predict_proba / predict_classes interface as ModelEvaluator.
+
+        model = NumpyModel.from_saved_model(
+            'models/KerasBaseModel_v.0.1_y_0.1_32_1')
+        y_pred = model.predict_classes(X_test)
+
+    Batches are split across a thread pool; NumPy releases the GIL inside
+    the matrix multiplies, so the threads run in parallel. The pool is
+    started on first use; call close(), or use the model in a with block,
+    to stop its threads once it is no longer needed.
+    '''
+    def __init__(self, weights, pool_size=2, n_threads=None):
+        (self.W_conv1, self.b_conv1, self.W_conv2, self.b_conv2,
+         self.W_dense1, self.b_dense1,
+         self.W_dense2, self.b_dense2) = [np.asarray(w, dtype='float32')
+                                          for w in weights]
+        self.pool_size = pool_size
+        if n_threads is None:
+            n_threads = multiprocessing.cpu_count()
+        self.n_threads = n_threads
+        self._pool = None
+
+    @classmethod
+    def from_saved_model(cls, path_to_model, **kwargs):
+        '''
+        INPUT:  (1) String: The path to the saved model, not including .json
+                    or .h5 at the end
+        OUTPUT: (1) NumpyModel
+        '''
+        return cls(load_weight_arrays('{}.h5'.format(path_to_model)),
+                   **kwargs)
+
+    @classmethod
+    def from_packed_model(cls, packed_file_name, **kwargs):
+        '''
+        INPUT:  (1) String: a file written by packed_models.pack_model
+        OUTPUT: (1) NumpyModel; float32 weights stay memory-mapped
+        '''
+        packed_model = load_packed_model(packed_file_name)
+        kwargs.setdefault('pool_size', packed_model['model_param']['pool_size'])
+        return cls(unpack_weights(packed_model), **kwargs)
+
+    def _forward(self, X):
+        X = np.asarray(X, dtype='float32')
+        X = _relu(_conv2d_valid(X, self.W_conv1, self.b_conv1))
+        X = _relu(_conv2d_valid(X, self.W_conv2, self.b_conv2))
+        X = _max_pool(X, self.pool_size)
+        X = X.reshape((X.shape[0], -1))
+        X = _relu(np.dot(X, self.W_dense1) + self.b_dense1)
+        return _softmax(np.dot(X, self.W_dense2) + self.b_dense2)
+
+    def predict_proba(self, X, batch_size=256, verbose=0):
+        '''
+        INPUT:  (1) 4D numpy array: images to predict
+                (2) integer: images per chunk handed to a thread
+        OUTPUT: (1) 2D numpy array: class probabilities, of shape
+                    (#imgs, #classes)
+        '''
+        chunks = [X[start:start + batch_size]
+                  for start in range(0, X.shape[0], batch_size)]
+        if self.n_threads <= 1 or len(chunks) <= 1:
+            return np.vstack([self._forward(chunk) for chunk in chunks])
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        return np.vstack(self._pool.map(self._forward, chunks))
+
+    def predict_classes(self, X, batch_size=256, verbose=0):
+        '''
+        INPUT:  (1) 4D numpy array: images to predict
+                (2) integer: images per chunk handed to a thread
+        OUTPUT: (1) 1D numpy array: the predicted class of each image
+        '''
+        return np.argmax(self.predict_proba(X, batch_size=batch_size), axis=1)
+
+    def close(self):
+        '''
+        INPUT:  None
+        OUTPUT: None, but the thread pool (if started) is stopped; the model
+                can still be used, and starts a new pool if it needs one
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
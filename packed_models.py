@@ -0,0 +1,196 @@
+import json
+import struct
+import numpy as np
+from mnist_data import set_basic_model_param
+from weight_io import load_weight_arrays
+
+
+# File layout: MAGIC, the header length as a little-endian uint64, a JSON
+# header, then each weight tensor's raw bytes starting at a multiple of
+# ALIGNMENT. The header records every tensor's dtype, shape, byte offset
+# and (for int8) scale, so the tensors can be viewed straight out of a
+# memory map. Keras is only imported by the functions that build a Keras
+# model, so numpy_inference can read packed models without it.
+MAGIC = b'MNISTFUNPACKED01'
+ALIGNMENT = 64
+
+
+def _quantize(weights, weight_dtype):
+    '''
+    INPUT:  (1) numpy array: float32 weights
+            (2) string: 'float32', 'float16' or 'int8'
+    OUTPUT: (1) numpy array: the weights stored as weight_dtype
+            (2) float: the scale to multiply int8 weights by (1. otherwise)
+
+    int8 uses one symmetric scale per tensor: the largest absolute weight
+    maps to 127.
+    '''
+    if weight_dtype == 'int8':
+        max_abs = np.abs(weights).max()
+        scale = max_abs / 127. if max_abs > 0 else 1.
+        return np.round(weights / scale).astype('int8'), float(scale)
+    return weights.astype(weight_dtype), 1.
+
+
+def _padding(offset):
+    return (-offset) % ALIGNMENT
+
+
+def _json_default(obj):
+    # model_param may hold NumPy scalars, eg. a batch size from a meshgrid
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('{} is not JSON serializable'.format(repr(obj)))
+
+
+def pack_model(path_to_model, packed_file_name, model_param=None,
+               weight_dtype='float32'):
+    '''
+    INPUT:  (1) string: the path to the saved model, not including .json or
+                .h5 at the end
+            (2) string: the file to write the packed model to
+            (3) Dictionary, optional: the model parameters the model was
+                built with; defaults to set_basic_model_param(0)
+            (4) string: 'float32', 'float16' or 'int8' weights
+    OUTPUT: (1) integer: the size of the packed file in bytes
+
+    Packs the architecture JSON, model_param and all the weights into a
+    single file that load_packed_model can memory-map.
+    '''
+    if model_param is None:
+        model_param = set_basic_model_param(0)
+    architecture = open('{}.json'.format(path_to_model)).read()
+    weights = load_weight_arrays('{}.h5'.format(path_to_model))
+
+    tensors = []
+    tensor_table = []
+    offset = 0
+    for tensor in weights:
+        stored, scale = _quantize(np.asarray(tensor, dtype='float32'),
+                                  weight_dtype)
+        offset += _padding(offset)
+        tensor_table.append({'dtype': stored.dtype.str,
+                             'shape': list(stored.shape),
+                             'offset': offset,
+                             'scale': scale})
+        tensors.append(stored)
+        offset += stored.nbytes
+    header = json.dumps({'model_param': model_param,
+                         'architecture': architecture,
+                         'weight_dtype': weight_dtype,
+                         'tensors': tensor_table},
+                        default=_json_default).encode('utf-8')
+
+    data_start = len(MAGIC) + 8 + len(header)
+    data_start += _padding(data_start)
+    with open(packed_file_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write(b'\0' * (data_start - f.tell()))
+        for tensor, entry in zip(tensors, tensor_table):
+            f.write(b'\0' * (data_start + entry['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(tensor).tobytes())
+        return f.tell()
+
+
+def load_packed_model(packed_file_name):
+    '''
+    INPUT:  (1) string: a file written by pack_model
+    OUTPUT: (1) Dictionary: 'model_param', 'architecture' (the Keras JSON),
+                'weight_dtype', 'tensors' (the stored weights, as read-only
+                views into the memory-mapped file) and 'scales'
+
+    Nothing is copied here: the tensors are paged in by the OS as they are
+    used and shared between processes that load the same file. Use
+    unpack_weights to get float32 weights.
+    '''
+    with open(packed_file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a packed model'.format(
+                packed_file_name))
+        header_length = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = len(MAGIC) + 8 + header_length
+    data_start += _padding(data_start)
+
+    mapped = np.memmap(packed_file_name, dtype='uint8', mode='r')
+    tensors = []
+    for entry in header['tensors']:
+        dtype = np.dtype(str(entry['dtype']))
+        count = int(np.prod(entry['shape']))
+        tensors.append(np.frombuffer(mapped, dtype=dtype, count=count,
+                                     offset=data_start + entry['offset'])
+                       .reshape(entry['shape']))
+    return {'model_param': header['model_param'],
+            'architecture': header['architecture'],
+            'weight_dtype': header['weight_dtype'],
+            'tensors': tensors,
+            'scales': [entry['scale'] for entry in header['tensors']]}
+
+
+def unpack_weights(packed_model):
+    '''
+    INPUT:  (1) Dictionary: from load_packed_model
+    OUTPUT: (1) list of numpy arrays: float32 weights in model.get_weights()
+                order. float32 tensors are returned as the memory-mapped
+                views; float16 and int8 tensors are converted.
+
+    The views stay zero-copy only for a consumer that keeps them as they
+    are, like NumpyModel.from_packed_model; load_packed_evaluator copies
+    them into the Keras model's Theano variables.
+    '''
+    weights = []
+    for tensor, scale in zip(packed_model['tensors'], packed_model['scales']):
+        if tensor.dtype == np.float32:
+            weights.append(tensor)
+        elif tensor.dtype == np.int8:
+            weights.append(tensor.astype('float32') * np.float32(scale))
+        else:
+            weights.append(tensor.astype('float32'))
+    return weights
+
+
+def load_packed_evaluator(packed_file_name):
+    '''
+    INPUT:  (1) string: a file written by pack_model
+    OUTPUT: (1) ModelEvaluator with the packed weights swapped in; it can be
+                used anywhere a model from load_model is used for inference
+
+    The weights are copied into the model, so this saves the load time of
+    load_model but not its memory; numpy_inference.NumpyModel's
+    from_packed_model is the zero-copy way to serve a packed model.
+    '''
+    from additional_functions import ModelEvaluator
+    packed_model = load_packed_model(packed_file_name)
+    evaluator = ModelEvaluator(packed_model['model_param'])
+    evaluator.model.set_weights(unpack_weights(packed_model))
+    return evaluator
+
+
+def quantization_accuracy_delta(path_to_model, packed_file_name, X_test,
+                                y_test, n=1):
+    '''
+    INPUT:  (1) string: the path to the original saved model, not including
+                .json or .h5 at the end
+            (2) string: the packed (possibly quantized) version of it
+            (3) 4D numpy array: the X test data
+            (4) 1D numpy array: the test labels
+            (5) integer: n for the top-n accuracy
+    OUTPUT: (1) Dictionary: the classes as keys, with the packed model's
+                top-n accuracy minus the original's as values
+
+    Both models are evaluated with predict_classwise_top_n_acc.
+    '''
+    from additional_functions import (ModelEvaluator,
+                                      predict_classwise_top_n_acc)
+    packed_evaluator = load_packed_evaluator(packed_file_name)
+    original_evaluator = ModelEvaluator(
+        load_packed_model(packed_file_name)['model_param'])
+    original_evaluator.load_weights(path_to_model)
+    original_accs = predict_classwise_top_n_acc(original_evaluator, X_test,
+                                                y_test, n=n)
+    packed_accs = predict_classwise_top_n_acc(packed_evaluator, X_test,
+                                              y_test, n=n)
+    return {unique_class: packed_accs[unique_class] - original_accs[unique_class]
+            for unique_class in original_accs}
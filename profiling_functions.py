@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import signal
+import cProfile
+import resource
+from contextlib import contextmanager
+from collections import Counter
+from keras.callbacks import Callback
+
+
+# Telemetry is off unless MNIST_FUN_TELEMETRY names a JSON-lines file to
+# append spans to. MNIST_FUN_PROFILE=cprofile or =sample turns on profiling
+# of whole jobs (see profiled), with output written to MNIST_FUN_PROFILE_DIR.
+TELEMETRY_ENV_VAR = 'MNIST_FUN_TELEMETRY'
+PROFILE_ENV_VAR = 'MNIST_FUN_PROFILE'
+PROFILE_DIR_ENV_VAR = 'MNIST_FUN_PROFILE_DIR'
+
+_telemetry_file = None
+_telemetry_path = None
+
+
+### Telemetry Functions###
+def telemetry_enabled():
+    '''
+    INPUT:  None
+    OUTPUT: (1) boolean: True if spans are being recorded
+    '''
+    return bool(os.environ.get(TELEMETRY_ENV_VAR))
+
+
+def peak_rss_mb():
+    '''
+    INPUT:  None
+    OUTPUT: (1) float: the peak resident set size of this process so far,
+                in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+    '''
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss / 2.**20
+    return peak_rss / 2.**10
+
+
+def emit_span(name, start, duration, **fields):
+    '''
+    INPUT:  (1) string: what was timed, eg. 'batch' or 'save'
+            (2) float: the wall clock start time, from time.time()
+            (3) float: the duration in seconds
+            (4) any additional fields to record, eg. epoch, batch, model
+    OUTPUT: None, but one JSON line is appended to the telemetry file if
+            telemetry is enabled
+
+    Every span records the process id and the peak RSS at the time it
+    ended, so spans from several sweep workers can share one file.
+    '''
+    global _telemetry_file, _telemetry_path
+    path = os.environ.get(TELEMETRY_ENV_VAR)
+    if not path:
+        return
+    if _telemetry_file is None or _telemetry_path != path:
+        _telemetry_file = open(path, 'a')
+        _telemetry_path = path
+    span = {'name': name,
+            'start': start,
+            'duration': duration,
+            'pid': os.getpid(),
+            'peak_rss_mb': peak_rss_mb()}
+    span.update(fields)
+    _telemetry_file.write(json.dumps(span) + '\n')
+    _telemetry_file.flush()
+
+
+@contextmanager
+def timed_span(name, **fields):
+    '''
+    INPUT:  (1) string: what is being timed
+            (2) any additional fields to record with the span
+    OUTPUT: None, but the span is emitted when the block exits, including
+            when it raises
+
+        with timed_span('save', model='y_0.1_32_1'):
+            save_model(model, model_param)
+    '''
+    start = time.time()
+    try:
+        yield
+    finally:
+        emit_span(name, start, time.time() - start, **fields)
+
+
+class TimingCallback(Callback):
+    '''
+    Keras callback that emits a span for every batch and epoch of model.fit.
+
+    Each 'batch' span records the step time (forward and backward pass)
+    and the data wait, the gap since the previous batch ended, which is
+    where batch slicing or a data generator spends its time. Keras
+    validates after the last batch and before on_epoch_end, so the gap
+    between the two is emitted as a 'validation' span.
+    '''
+    def __init__(self, **fields):
+        super(TimingCallback, self).__init__()
+        self.fields = fields
+        self.last_batch_end = None
+
+    def on_epoch_begin(self, epoch, logs={}):
+        self.epoch = epoch
+        self.epoch_start = time.time()
+        self.last_batch_end = self.epoch_start
+
+    def on_batch_begin(self, batch, logs={}):
+        self.batch_start = time.time()
+        self.data_wait = self.batch_start - self.last_batch_end
+
+    def on_batch_end(self, batch, logs={}):
+        self.last_batch_end = time.time()
+        emit_span('batch', self.batch_start,
+                  self.last_batch_end - self.batch_start,
+                  data_wait=self.data_wait, epoch=self.epoch, batch=batch,
+                  batch_size=logs.get('size'), **self.fields)
+
+    def on_epoch_end(self, epoch, logs={}):
+        epoch_end = time.time()
+        emit_span('validation', self.last_batch_end,
+                  epoch_end - self.last_batch_end, epoch=epoch,
+                  **self.fields)
+        emit_span('epoch', self.epoch_start, epoch_end - self.epoch_start,
+                  epoch=epoch, loss=logs.get('loss'),
+                  val_loss=logs.get('val_loss'), **self.fields)
+
+
+### Profiling Functions###
+class _StackSampler(object):
+    '''
+    Samples the Python stack on a CPU-time timer and counts each stack in
+    the collapsed 'outer;...;inner count' format that py-spy and
+    flamegraph.pl read.
+    '''
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stack_counts = Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name,
+                                             os.path.basename(code.co_filename),
+                                             frame.f_lineno))
+            frame = frame.f_back
+        self.stack_counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def write(self, file_name):
+        with open(file_name, 'w') as f:
+            for stack, count in self.stack_counts.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+@contextmanager
+def profiled(name):
+    '''
+    INPUT:  (1) string: names the profile output file
+    OUTPUT: None
+
+    Profiles the block according to MNIST_FUN_PROFILE: 'cprofile' writes
+    <name>.<pid>.prof (for pstats or snakeviz) and 'sample' writes
+    <name>.<pid>.folded collapsed stacks (for flamegraph tools). Anything
+    else runs the block unprofiled. The sampler relies on signals, so it
+    only works in the main thread.
+    '''
+    profile_mode = os.environ.get(PROFILE_ENV_VAR)
+    if profile_mode not in ('cprofile', 'sample'):
+        yield
+        return
+    profile_dir = os.environ.get(PROFILE_DIR_ENV_VAR, 'profiles')
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    file_name = os.path.join(profile_dir, '{}.{}'.format(name, os.getpid()))
+    if profile_mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats('{}.prof'.format(file_name))
+    else:
+        sampler = _StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write('{}.folded'.format(file_name))
@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import tempfile
+import multiprocessing
+import numpy as np
+from additional_functions import file_sha1
+
+
+# A render job is a dictionary naming a function in plotting_functions, the
+# keyword arguments to call it with (other than saveas), where to save the
+# plot (without .png) and, optionally, the input files it reads:
+#
+#     {'function': 'plot_accuracy_meshgrid',
+#      'kwargs': {'acc_grid_filename': 'acc_grid.h5', 'view': (30, 30)},
+#      'saveas': 'plots/acc_grid_view2',
+#      'input_files': ['acc_grid.h5']}
+#
+# Each job is hashed (function, arguments, input file contents and the
+# source of the modules the plots are drawn with, RENDER_SOURCES) and the
+# hash of every rendered plot is kept in RENDER_HASH_FILE, so re-running
+# only renders plots whose inputs changed.
+PLOT_DIR = 'plots'
+RENDER_HASH_FILE = os.path.join(PLOT_DIR, 'render_hashes.json')
+SURFACE_VIEWS = [('view1', None), ('view2', (30, 30))]
+RENDER_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               module_file_name)
+                  for module_file_name in ['plotting_functions.py',
+                                           'evaluation_functions.py',
+                                           'mnist_data.py',
+                                           'additional_functions.py',
+                                           'results_store.py']]
+
+
+def _update_hash(sha1, obj):
+    '''
+    INPUT:  (1) hashlib sha1 object
+            (2) the object to add: numpy arrays are hashed by dtype, shape
+                and contents, dictionaries in sorted key order, and anything
+                else by its repr
+    OUTPUT: None
+    '''
+    if isinstance(obj, np.ndarray):
+        sha1.update('array {} {}'.format(obj.dtype.str, obj.shape))
+        sha1.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        sha1.update('dict {}'.format(len(obj)))
+        for key in sorted(obj):
+            _update_hash(sha1, key)
+            _update_hash(sha1, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        sha1.update('list {}'.format(len(obj)))
+        for item in obj:
+            _update_hash(sha1, item)
+    else:
+        sha1.update(repr(obj))
+
+
+def render_job_hash(render_job):
+    '''
+    INPUT:  (1) Dictionary: a render job
+    OUTPUT: (1) string: the sha1 hex digest of everything the plot depends
+                on; it changes if the arguments, an input file or any of
+                RENDER_SOURCES change
+    '''
+    sha1 = hashlib.sha1()
+    for source_file_name in RENDER_SOURCES:
+        sha1.update(file_sha1(source_file_name))
+    _update_hash(sha1, str(render_job['function']))
+    _update_hash(sha1, render_job.get('kwargs', {}))
+    for input_file in render_job.get('input_files', []):
+        sha1.update(file_sha1(input_file))
+    return sha1.hexdigest()
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_figure(render_job):
+    '''
+    INPUT:  (1) Dictionary: a render job
+    OUTPUT: (1) string: the file name of the saved plot
+    '''
+    import plotting_functions
+    plot_function = getattr(plotting_functions, render_job['function'])
+    plot_function(saveas=render_job['saveas'], **render_job.get('kwargs', {}))
+    return '{}.png'.format(render_job['saveas'])
+
+
+def render_figures(render_jobs, n_workers=None, hash_file=RENDER_HASH_FILE,
+                   force=False):
+    '''
+    INPUT:  (1) list of Dictionaries: render jobs
+            (2) integer: the number of worker processes to render in; None
+                uses one per CPU (at most one per plot)
+            (3) string: the JSON file recording the hash each plot was
+                rendered from
+            (4) boolean: render every plot, even if it is unchanged
+    OUTPUT: (1) list of strings: the file names of the plots rendered
+
+    All plots are drawn off-screen with the Agg backend, so this runs on a
+    server without a display. Plots whose file exists and whose job hash
+    matches the one recorded in hash_file are skipped.
+    '''
+    hashes = {}
+    if os.path.isfile(hash_file):
+        hashes = json.load(open(hash_file))
+    jobs_to_render = []
+    job_hashes = []
+    for render_job in render_jobs:
+        file_name = '{}.png'.format(render_job['saveas'])
+        job_hash = render_job_hash(render_job)
+        if (not force and hashes.get(file_name) == job_hash and
+                os.path.isfile(file_name)):
+            print 'Skipping {}: unchanged'.format(file_name)
+            continue
+        jobs_to_render.append(render_job)
+        job_hashes.append(job_hash)
+    if not jobs_to_render:
+        return []
+
+    if n_workers is None:
+        n_workers = min(multiprocessing.cpu_count(), len(jobs_to_render))
+    _use_agg()
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers, initializer=_use_agg)
+        try:
+            rendered = pool.map(render_figure, jobs_to_render)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rendered = [render_figure(render_job) for render_job in jobs_to_render]
+
+    for file_name, job_hash in zip(rendered, job_hashes):
+        print 'Rendered {}'.format(file_name)
+        hashes[file_name] = job_hash
+    hash_dir = os.path.dirname(hash_file) or '.'
+    if not os.path.isdir(hash_dir):
+        os.makedirs(hash_dir)
+    tmp_fd, tmp_file_name = tempfile.mkstemp(dir=hash_dir)
+    with os.fdopen(tmp_fd, 'w') as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    os.rename(tmp_file_name, hash_file)
+    return rendered
+
+
+def default_render_jobs(acc_grid_filenames=None, plot_dir=PLOT_DIR,
+                        noise_stddevs=None, percent_random_labels=None):
+    '''
+    INPUT:  (1) list of strings: accuracy grids (from save_accuracy_meshgrid
+                or eval-grid) to plot as surfaces
+            (2) string: the directory to save the plots to
+            (3) 1D numpy array, optional: the noise standard deviations of
+                the models trained on noisy X (see
+                train_models_on_noisy_data), to plot their classwise
+                accuracies
+            (4) 1D numpy array, optional: the fractions of random labels of
+                the models trained on noisy y, to plot their accuracies
+    OUTPUT: (1) list of Dictionaries: render jobs for the noisy X example
+                grid, for every accuracy grid in each of SURFACE_VIEWS and
+                for the accuracy vs. noise plots asked for
+
+    The accuracies for the noise plots are calculated here (with the stored
+    predictions, see PredictionStore) and passed to the plots as arguments,
+    so the plots are only rendered again when an accuracy changes.
+    '''
+    render_jobs = [{'function': 'load_data_and_show_noisy_X',
+                    'kwargs': {},
+                    'saveas': os.path.join(plot_dir,
+                                           'Noisy_X_all_digits_0-192')}]
+    for acc_grid_filename in acc_grid_filenames or []:
+        grid_name = os.path.splitext(os.path.basename(acc_grid_filename))[0]
+        for view_name, view in SURFACE_VIEWS:
+            render_jobs.append(
+                {'function': 'plot_accuracy_meshgrid',
+                 'kwargs': {'acc_grid_filename': acc_grid_filename,
+                            'view': view},
+                 'saveas': os.path.join(plot_dir, '{}_{}'.format(grid_name,
+                                                                 view_name)),
+                 'input_files': [acc_grid_filename]})
+    if noise_stddevs is not None:
+        from evaluation_functions import calc_all_classwise_accs
+        render_jobs.append(
+            {'function': 'plot_acc_vs_noisy_X',
+             'kwargs': {'noise_stddevs': np.asarray(noise_stddevs),
+                        'classwise_accs': calc_all_classwise_accs(
+                            noise_stddevs)},
+             'saveas': os.path.join(plot_dir,
+                                    'classwise_accuracy_vs_noisy_X')})
+    if percent_random_labels is not None:
+        from evaluation_functions import calc_raw_acc
+        render_jobs.append(
+            {'function': 'plot_acc_vs_noisy_y',
+             'kwargs': {'percent_random_labels':
+                            np.asarray(percent_random_labels),
+                        'accs': calc_raw_acc(percent_random_labels, 'y')},
+             'saveas': os.path.join(plot_dir, 'accuracy_vs_noisy_y')})
+    return render_jobs
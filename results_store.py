@@ -0,0 +1,323 @@
+import os
+import time
+import fcntl
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import h5py
+
+
+# The results store is an HDF5 file with one resizable dataset per column
+# and one row per trained model. Writers append under an exclusive lock on
+# '<results_path>.lock' and readers take a shared lock, so sweep workers on
+# one machine can share a store. Stores from several machines are merged
+# with merge_results. Integer columns use -1, float columns nan and string
+# columns '' for values a row does not have.
+RESULT_COLUMNS = OrderedDict([('name_to_append', 'S64'),
+                              ('X_or_y', 'S1'),
+                              ('noise_val', 'float64'),
+                              ('batchsize', 'int64'),
+                              ('dropout_scalar', 'float64'),
+                              ('replicate', 'int64'),
+                              ('seed', 'int64'),
+                              ('noise_seed', 'int64'),
+                              ('warm_start_from', 'S64'),
+                              ('n_epoch', 'int64'),
+                              ('test_accuracy', 'float64'),
+                              ('test_score', 'float64'),
+                              ('run_time', 'float64'),
+                              ('time', 'float64')])
+GRID_AXES = ['noise_val', 'batchsize', 'dropout_scalar']
+
+
+def results_path_for_manifest(manifest_path):
+    '''
+    INPUT:  (1) string: path to a sweep manifest
+    OUTPUT: (1) string: the results store kept next to it
+    '''
+    return os.path.join(os.path.dirname(manifest_path), 'results.h5')
+
+
+@contextmanager
+def _locked(results_path, lock_type):
+    lock_dir = os.path.dirname(results_path)
+    if lock_dir and not os.path.isdir(lock_dir):
+        os.makedirs(lock_dir)
+    with open('{}.lock'.format(results_path), 'a') as lock_file:
+        fcntl.flock(lock_file, lock_type)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _missing_value(dtype):
+    kind = np.dtype(dtype).kind
+    if kind == 'f':
+        return np.nan
+    if kind in 'iu':
+        return -1
+    return ''
+
+
+def result_row(job, results, n_epoch):
+    '''
+    INPUT:  (1) dictionary: the sweep job that was run
+            (2) dictionary: the results returned by fit_and_save_model
+            (3) integer: the total epochs the model has been trained for
+    OUTPUT: (1) dictionary: a row for append_results
+    '''
+    row = {column: job[column] for column in RESULT_COLUMNS if column in job}
+    row.update({column: results[column] for column in RESULT_COLUMNS
+                if column in results})
+    row['n_epoch'] = n_epoch
+    row['time'] = time.time()
+    return row
+
+
+def append_results(results_path, rows):
+    '''
+    INPUT:  (1) string: path to the results store; created if missing
+            (2) list of dictionaries: one per run, keyed by the names in
+                RESULT_COLUMNS; other keys are ignored
+    OUTPUT: None
+    '''
+    if not rows:
+        return
+    with _locked(results_path, fcntl.LOCK_EX):
+        with h5py.File(results_path, 'a') as f:
+            n_existing_rows = 0
+            if 'name_to_append' in f:
+                n_existing_rows = f['name_to_append'].shape[0]
+            for column, dtype in RESULT_COLUMNS.items():
+                values = np.array([row.get(column, _missing_value(dtype))
+                                   for row in rows], dtype=dtype)
+                if column not in f:
+                    # Columns added since the store was created start out
+                    # missing for the rows already in it.
+                    f.create_dataset(column, shape=(n_existing_rows,),
+                                     maxshape=(None,), dtype=dtype,
+                                     chunks=(1024,),
+                                     fillvalue=_missing_value(dtype))
+                dataset = f[column]
+                n_rows = dataset.shape[0]
+                dataset.resize((n_rows + len(rows),))
+                dataset[n_rows:] = values
+
+
+def _matches(column, values):
+    '''
+    INPUT:  (1) 1D numpy array: a column of the store
+            (2) a value or list of values to keep
+    OUTPUT: (1) 1D boolean numpy array: True where the column holds one of
+                the values; floats are compared with np.isclose
+    '''
+    values = np.atleast_1d(np.asarray(values, dtype=column.dtype))
+    if column.dtype.kind == 'f':
+        return np.isclose(column[:, np.newaxis],
+                          values[np.newaxis, :]).any(axis=1)
+    return np.in1d(column, values)
+
+
+def load_results(results_path, **filters):
+    '''
+    INPUT:  (1) string: path to the results store
+            (2) column names mapped to a value or list of values to keep,
+                eg. X_or_y='y', batchsize=[32, 64]
+    OUTPUT: (1) OrderedDict: each column as a 1D numpy array, with only the
+                rows matching every filter. Empty columns if there is no
+                store yet.
+
+        results = load_results('models/results.h5', X_or_y='y',
+                               dropout_scalar=1)
+    '''
+    if not os.path.isfile(results_path):
+        return OrderedDict((column, np.zeros(0, dtype=dtype))
+                           for column, dtype in RESULT_COLUMNS.items())
+    with _locked(results_path, fcntl.LOCK_SH):
+        with h5py.File(results_path, 'r') as f:
+            results = OrderedDict((column, f[column][:])
+                                  for column in RESULT_COLUMNS
+                                  if column in f)
+    keep = np.ones(len(results['name_to_append']), dtype=bool)
+    for column, values in filters.items():
+        keep &= _matches(results[column], values)
+    return OrderedDict((column, values[keep])
+                       for column, values in results.items())
+
+
+def merge_results(results_path, other_results_paths):
+    '''
+    INPUT:  (1) string: the results store to merge into
+            (2) list of strings: other stores, eg. copied from other machines
+    OUTPUT: (1) integer: the number of rows appended
+
+    Rows already in results_path (same model name, seed and recording time)
+    are not appended again, so merging the same store twice is harmless.
+    '''
+    existing = load_results(results_path)
+    seen = set(zip(existing['name_to_append'], existing['seed'],
+                   existing['time']))
+    rows = []
+    for other_results_path in other_results_paths:
+        other = load_results(other_results_path)
+        for i in range(len(other['name_to_append'])):
+            key = (other['name_to_append'][i], other['seed'][i],
+                   other['time'][i])
+            if key not in seen:
+                seen.add(key)
+                rows.append({column: values[i]
+                             for column, values in other.items()})
+    append_results(results_path, rows)
+    return len(rows)
+
+
+def latest_results(results):
+    '''
+    INPUT:  (1) OrderedDict: columns, as from load_results
+    OUTPUT: (1) OrderedDict: the same columns with only the most recent row
+                (by 'time') of each model, ie. of each name_to_append and
+                seed; rows keep their order in the store
+    '''
+    order = np.lexsort((results['time'], results['seed'],
+                        results['name_to_append']))
+    names = results['name_to_append'][order]
+    seeds = results['seed'][order]
+    is_latest = np.ones(len(order), dtype=bool)
+    is_latest[:-1] = (names[1:] != names[:-1]) | (seeds[1:] != seeds[:-1])
+    keep = np.sort(order[is_latest])
+    return OrderedDict((column, values[keep])
+                       for column, values in results.items())
+
+
+def results_grid(results_path, metric='test_accuracy', axes=GRID_AXES,
+                 axis_values=None, aggregate='mean', latest_only=True,
+                 **filters):
+    '''
+    INPUT:  (1) string: path to the results store
+            (2) string: the column to put on the grid
+            (3) list of strings: the columns to use as the grid axes
+            (4) dictionary, optional: axis names mapped to the values to
+                put along that axis, eg. from load_meshgrid_param. By
+                default every value present in the store is used.
+            (5) string: how to combine runs that land on the same grid
+                point (eg. several seeds): 'mean', 'std', 'min', 'max' or
+                'count'
+            (6) boolean: if True, only the most recent row of each model
+                is used (see latest_results), so a model retrained with more
+                epochs or resumed is counted once
+            (7) column filters, as for load_results; they are applied before
+                the most recent rows are picked, eg. n_epoch=16
+    OUTPUT: (1) numpy array: the aggregated metric, of shape
+                (len(axis 0 values), len(axis 1 values), ...); nan where
+                there are no runs (0 for 'count')
+            (2) OrderedDict: the axis names mapped to their values
+
+    With the default axes this returns an acc_grid shaped like the one from
+    calc_meshgrid_acc, averaged over seeds:
+
+        acc_grid, grid_axes = results_grid('models/results.h5', X_or_y='y')
+    '''
+    results = load_results(results_path, **filters)
+    if latest_only:
+        results = latest_results(results)
+    if axis_values is None:
+        axis_values = {}
+    grid_axes = OrderedDict()
+    keep = np.ones(len(results[metric]), dtype=bool)
+    axis_inds = []
+    for axis in axes:
+        column = results[axis]
+        values = np.asarray(axis_values.get(axis, np.unique(column)),
+                            dtype=column.dtype)
+        grid_axes[axis] = values
+        if column.dtype.kind == 'f':
+            matches = np.isclose(column[:, np.newaxis], values[np.newaxis, :])
+        else:
+            matches = column[:, np.newaxis] == values[np.newaxis, :]
+        keep &= matches.any(axis=1)
+        axis_inds.append(np.argmax(matches, axis=1))
+    shape = tuple(len(values) for values in grid_axes.values())
+    flat_inds = np.ravel_multi_index([inds[keep] for inds in axis_inds],
+                                     shape)
+    metric_values = results[metric][keep].astype('float64')
+    n_cells = int(np.prod(shape))
+
+    counts = np.bincount(flat_inds, minlength=n_cells)
+    if aggregate == 'count':
+        return counts.reshape(shape), grid_axes
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(flat_inds, weights=metric_values,
+                            minlength=n_cells) / counts
+        if aggregate == 'mean':
+            grid = means
+        elif aggregate == 'std':
+            grid = np.sqrt(np.bincount(
+                flat_inds, weights=(metric_values - means[flat_inds])**2,
+                minlength=n_cells) / counts)
+        elif aggregate in ('min', 'max'):
+            grid = np.full(n_cells, np.inf if aggregate == 'min' else -np.inf)
+            ufunc = np.minimum if aggregate == 'min' else np.maximum
+            ufunc.at(grid, flat_inds, metric_values)
+            grid[counts == 0] = np.nan
+        else:
+            raise ValueError('Unknown aggregate {}'.format(aggregate))
+    return grid.reshape(shape), grid_axes
+
+
+### Labeled Grid Files###
+def meshgrid_axes(percent_random_labels, batchsizes, dropout_scalars):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the dropout scalars
+    OUTPUT: (1) OrderedDict: the meshgrid axes, named as in GRID_AXES
+    '''
+    return OrderedDict(zip(GRID_AXES, [percent_random_labels, batchsizes,
+                                       dropout_scalars]))
+
+
+def save_labeled_grid(grid_filename, grid_axes, **grids):
+    '''
+    INPUT:  (1) string: the HDF5 file to write
+            (2) OrderedDict: the axis names mapped to their values
+            (3) the grids to save, by name, eg. acc_grid=acc_grid; each must
+                have one dimension per axis, of the axis' length
+    OUTPUT: None
+
+    The file is written to a temporary name and renamed into place, so a
+    reader never sees a half-written grid.
+    '''
+    shape = tuple(len(values) for values in grid_axes.values())
+    for name, grid in grids.items():
+        if np.shape(grid) != shape:
+            raise ValueError('{} has shape {}, but the axes have shape '
+                             '{}'.format(name, np.shape(grid), shape))
+    grid_dir = os.path.dirname(grid_filename) or '.'
+    tmp_fd, tmp_file_name = tempfile.mkstemp(dir=grid_dir, suffix='.h5')
+    os.close(tmp_fd)
+    with h5py.File(tmp_file_name, 'w') as f:
+        axes_group = f.create_group('axes')
+        axes_group.attrs['axis_names'] = np.array(list(grid_axes), dtype='S')
+        for axis, values in grid_axes.items():
+            axes_group.create_dataset(axis, data=np.asarray(values))
+        for name, grid in grids.items():
+            f.create_dataset(name, data=np.asarray(grid))
+    os.rename(tmp_file_name, grid_filename)
+
+
+def load_labeled_grid(grid_filename):
+    '''
+    INPUT:  (1) string: a file written by save_labeled_grid
+    OUTPUT: (1) OrderedDict: the axis names mapped to their values
+            (2) dictionary: the grids, by name
+    '''
+    with h5py.File(grid_filename, 'r') as f:
+        axes_group = f['axes']
+        axis_names = [axis.decode('utf-8')
+                      for axis in axes_group.attrs['axis_names']]
+        grid_axes = OrderedDict((axis, axes_group[axis][:])
+                                for axis in axis_names)
+        grids = {name: f[name][...] for name in f if name != 'axes'}
+    return grid_axes, grids
@@ -0,0 +1,1296 @@
+import os
+import re
+import json
+import time
+import fcntl
+import ctypes
+import shutil
+import hashlib
+import warnings
+import multiprocessing
+import numpy as np
+from keras_model import *
+from additional_functions import *
+from profiling_functions import *
+from results_store import *
+from data_parallel import *
+from numpy_inference import NumpyModel
+from keras.utils import np_utils
+
+
+# Each pool worker keeps its own copy of the formatted MNIST data here so
+# that it is only loaded once per process rather than once per job.
+_worker_data = None
+
+MANIFEST_PATH = 'models/sweep_manifest.jsonl'
+CHECKPOINT_DIR = 'models/checkpoints'
+MODEL_CACHE_DIR = 'models/cache'
+MODEL_FILE_EXTENSIONS = ['.json', '.h5', '.pkl']
+# Every job with a validation split holds out the same training images, so
+# their validation accuracies can be compared
+VALIDATION_SEED = 0
+# The (setter, getter) of the thread count of each BLAS/OpenMP runtime that
+# pin_threads knows how to resize after it has been loaded
+THREAD_CONTROLS = [('openblas_set_num_threads', 'openblas_get_num_threads'),
+                   ('scipy_openblas_set_num_threads64_',
+                    'scipy_openblas_get_num_threads64_'),
+                   ('MKL_Set_Num_Threads', 'MKL_Get_Max_Threads'),
+                   ('omp_set_num_threads', 'omp_get_max_threads')]
+
+
+### Job Building Functions###
+def noise_spec(X_or_y, noise_val):
+    '''
+    INPUT:  (1) string: 'X' or 'y', which data the noise is added to
+            (2) float: the noise level
+    OUTPUT: (1) list: a canonical description of the noise; all noise-free
+                jobs share ['clean'], whether they are 'X' or 'y' jobs
+    '''
+    if noise_val == 0:
+        return ['clean']
+    return [str(X_or_y), float(noise_val)]
+
+
+def replicate_seed(seed, replicate, *config):
+    '''
+    INPUT:  (1) integer: the base seed of the sweep
+            (2) integer: the replicate number
+            (3) what the seed is for, eg. 'noise' and the noise spec
+    OUTPUT: (1) integer: the seed for that configuration in that replicate
+
+    Seeds are derived from the configuration rather than its position in a
+    sweep, so the same configuration gets the same seed in every sweep that
+    trains it (which lets the model cache recognise it, see training_key)
+    and adding a grid point does not change the seeds of the others.
+    '''
+    key = json.dumps([seed, replicate] + list(config), default=_json_default)
+    return int(hashlib.sha1(key).hexdigest()[:8], 16) & 0x7fffffff
+
+
+def job_seeds(seed, replicate, X_or_y, noise_val, batchsize, dropout_scalar):
+    '''
+    INPUT:  (1) integer: the base seed of the sweep
+            (2) integer: the replicate number
+            (3-6) the job's noise type, noise level, batch size and dropout
+    OUTPUT: (1) dictionary: the job's 'seed' and 'noise_seed'
+    '''
+    spec = noise_spec(X_or_y, noise_val)
+    return {'seed': replicate_seed(seed, replicate, 'model', int(batchsize),
+                                   float(dropout_scalar), *spec),
+            'noise_seed': replicate_seed(seed, replicate, 'noise', *spec)}
+
+
+def build_meshgrid_jobs(percent_random_labels, batchsizes, dropout_scalars,
+                        seed=1234, fit_param=None, n_replicates=1):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the scalars by which to change the
+                built-in dropout values (0.25 and 0.5: see keras_model
+                for specifics)
+            (4) integer: base seed; each job's seed is derived from it, its
+                configuration and its replicate (see replicate_seed)
+            (5) Dictionary, optional: extra set_basic_model_param arguments
+                (n_epoch, patience, min_delta) shared by every job
+            (6) integer: the number of independently seeded replicates of
+                every grid point
+    OUTPUT: (1) list of dictionaries: one independent training job per
+                point on the grid per replicate
+
+    Every job carries its own seed, so a job trains the same model no matter
+    which process runs it or in what order the jobs are run. The label noise
+    seed depends only on the noise level and replicate, so every batch size
+    and dropout at one noise level in one replicate sees the same noisy
+    labels. The jobs are ordered replicate by replicate, so a sweep
+    finishes a whole grid before it starts on the next replicate.
+    '''
+    jobs = []
+    for replicate in range(n_replicates):
+        for percent_random in percent_random_labels:
+            for batchsize in batchsizes:
+                for dropout_scalar in dropout_scalars:
+                    name_to_append = 'y_{}_{}_{}'.format(percent_random,
+                                                         batchsize,
+                                                         dropout_scalar)
+                    job = {'name_to_append': replicate_name(name_to_append,
+                                                            replicate),
+                           'X_or_y': 'y',
+                           'noise_val': percent_random,
+                           'batchsize': batchsize,
+                           'dropout_scalar': dropout_scalar,
+                           'replicate': replicate,
+                           'fit_param': fit_param or {}}
+                    job.update(job_seeds(seed, replicate, 'y', percent_random,
+                                          batchsize, dropout_scalar))
+                    jobs.append(job)
+    return jobs
+
+
+def build_noisy_data_jobs(characteristic_noise_vals, X_or_y, seed=1234,
+                          fit_param=None, n_replicates=1):
+    '''
+    INPUT:  (1) 1D numpy array: if on X, should be the standard deviations of
+                the Gaussian noise being added; if on y, should be the
+                percentages of labels to be randomly changed
+            (2) string: 'X' or 'y' corresponding to which data to make noisy
+            (3) integer: base seed; each job's seed is derived from it, its
+                configuration and its replicate (see replicate_seed)
+            (4) Dictionary, optional: extra set_basic_model_param arguments
+                (n_epoch, patience, min_delta) shared by every job
+            (5) integer: the number of independently seeded replicates of
+                every noise value
+    OUTPUT: (1) list of dictionaries: one independent training job per
+                characteristic noise value per replicate, ordered replicate
+                by replicate
+
+    Jobs use the default batch size and dropout from set_basic_model_param.
+    '''
+    jobs = []
+    for replicate in range(n_replicates):
+        for cnv in characteristic_noise_vals:
+            job = {'name_to_append': replicate_name(
+                       '{}_{}'.format(X_or_y, cnv), replicate),
+                   'X_or_y': X_or_y,
+                   'noise_val': cnv,
+                   'batchsize': 32,
+                   'dropout_scalar': 1,
+                   'replicate': replicate,
+                   'fit_param': fit_param or {}}
+            job.update(job_seeds(seed, replicate, X_or_y, cnv, 32, 1))
+            jobs.append(job)
+    return jobs
+
+
+### Sweep Manifest Functions###
+def _json_default(obj):
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('{} is not JSON serializable'.format(repr(obj)))
+
+
+def record_job_status(manifest_path, job, status, **fields):
+    '''
+    INPUT:  (1) string: path to the JSON-lines sweep manifest
+            (2) dictionary: the job being recorded
+            (3) string: 'running', 'finished' or 'failed'
+            (4) any additional fields to record, eg. epochs_done,
+                weights_file_name, test_accuracy
+    OUTPUT: None, but one line is appended to the manifest
+
+    The manifest is an append-only ledger; later lines for a job override
+    earlier ones (see load_manifest). A record with 'started_at' begins a
+    new attempt at the job and replaces everything recorded before it, so
+    every attempt, including linking a model from the cache, records one.
+    Appends are serialised with an exclusive lock so several workers can
+    share one manifest.
+    '''
+    record = {'name_to_append': job['name_to_append'],
+              'seed': job['seed'],
+              'status': status,
+              'time': time.time()}
+    record.update(fields)
+    line = json.dumps(record, default=_json_default) + '\n'
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir and not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+    with open(manifest_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_manifest(manifest_path):
+    '''
+    INPUT:  (1) string: path to the JSON-lines sweep manifest
+    OUTPUT: (1) dictionary: the latest state of each job, keyed by the name
+                appended to the model. Empty if there is no manifest yet.
+
+    A job's state is merged from the records of its latest attempt only
+    (see record_job_status), so fields of earlier attempts, eg. a warm
+    start or a cached model, do not linger.
+    '''
+    job_states = {}
+    if not os.path.isfile(manifest_path):
+        return job_states
+    with open(manifest_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'started_at' in record:
+                job_states[record['name_to_append']] = {}
+            state = job_states.setdefault(record['name_to_append'], {})
+            state.update(record)
+    return job_states
+
+
+def is_job_finished(job_state, job):
+    '''
+    INPUT:  (1) dictionary: a job's state from load_manifest (or None)
+            (2) dictionary: the job
+    OUTPUT: (1) boolean: True if the job finished with at least the number
+                of epochs it now asks for, from the same warm start (if
+                any), with a validation accuracy if it asks for a
+                validation split, and its weights still exist
+    '''
+    n_epoch = set_basic_model_param(0, **job['fit_param'])['n_epoch']
+    return (job_state is not None and
+            job_state['status'] == 'finished' and
+            job_state.get('n_epoch', 4) >= n_epoch and
+            job_state.get('warm_start_key') == job.get('warm_start_key') and
+            (not job.get('validation_split') or
+             'val_accuracy' in job_state) and
+            os.path.isfile(job_state['weights_file_name']))
+
+
+def unfinished_jobs(jobs, manifest_path):
+    '''
+    INPUT:  (1) list of dictionaries: jobs
+            (2) string: path to the sweep manifest
+    OUTPUT: (1) list of dictionaries: the jobs that still need to be run
+    '''
+    job_states = load_manifest(manifest_path)
+    jobs_to_run = [job for job in jobs
+                   if not is_job_finished(job_states.get(job['name_to_append']),
+                                          job)]
+    if len(jobs_to_run) < len(jobs):
+        print 'Skipping {} finished jobs'.format(len(jobs) - len(jobs_to_run))
+    return jobs_to_run
+
+
+### Model Cache Functions###
+def training_key(job):
+    '''
+    INPUT:  (1) dictionary: a job
+    OUTPUT: (1) string: the sha1 hex digest of everything that determines
+                the trained model: the model parameters (other than its
+                name), the noise spec, the seeds, any warm start and any
+                validation split
+
+    Jobs that train the same model under different names, eg. 'X' at
+    stddev 0 and 'y' at 0% noise, or the 0% row of the meshgrid and the
+    default batch size and dropout of build_noisy_data_jobs, share a key.
+    '''
+    model_param = set_basic_model_param(0,
+                                        dropout_scalar=job['dropout_scalar'],
+                                        batchsize=job['batchsize'],
+                                        **job['fit_param'])
+    del model_param['model_build']
+    spec = noise_spec(job['X_or_y'], job['noise_val'])
+    key = {'model_param': model_param, 'noise': spec, 'seed': job['seed']}
+    if spec != ['clean']:
+        key['noise_seed'] = job['noise_seed']
+    if 'warm_start_key' in job:
+        key['warm_start'] = job['warm_start_key']
+    if job.get('data_parallel', 1) > 1:
+        key['data_parallel'] = job['data_parallel']
+    if job.get('validation_split'):
+        key['validation_split'] = job['validation_split']
+    return hashlib.sha1(json.dumps(key, sort_keys=True,
+                                   default=_json_default)).hexdigest()
+
+
+def _link(src, dst):
+    '''
+    INPUT:  (1) string: an existing file
+            (2) string: the name to give it; replaced if it exists
+    OUTPUT: None
+
+    The file is hard-linked (copied if the file system cannot link) to a
+    temporary name and renamed into place, so dst is never half-written.
+    '''
+    tmp_file_name = '{}.tmp{}'.format(dst, os.getpid())
+    try:
+        os.link(src, tmp_file_name)
+    except OSError:
+        shutil.copy2(src, tmp_file_name)
+    os.rename(tmp_file_name, dst)
+
+
+def cache_model(key, results, cache_dir=MODEL_CACHE_DIR):
+    '''
+    INPUT:  (1) string: the job's training_key
+            (2) dictionary: the results of training it, with the saved file
+                names (see fit_and_save_model)
+            (3) string: the model cache directory
+    OUTPUT: None, but the model's files are linked into the cache as
+            <key>.json, <key>.h5 and <key>.pkl, with its results in
+            <key>.results.json
+
+    The results file is written last, so only complete entries are found.
+    '''
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cache_path = os.path.join(cache_dir, key)
+    for result_key in ['json_file_name', 'weights_file_name',
+                       'history_file_name']:
+        file_name = results.get(result_key)
+        if file_name is not None and os.path.isfile(file_name):
+            _link(file_name, '{}{}'.format(cache_path,
+                                           os.path.splitext(file_name)[1]))
+    cached_results = {result_key: value for result_key, value in
+                      results.items() if not result_key.endswith('file_name')}
+    tmp_file_name = '{}.results.json.tmp{}'.format(cache_path, os.getpid())
+    with open(tmp_file_name, 'w') as f:
+        json.dump(cached_results, f, default=_json_default)
+    os.rename(tmp_file_name, '{}.results.json'.format(cache_path))
+
+
+def link_cached_model(key, model_param, cache_dir=MODEL_CACHE_DIR):
+    '''
+    INPUT:  (1) string: the job's training_key
+            (2) Dictionary of model parameters, naming the model to link to
+            (3) string: the model cache directory
+    OUTPUT: (1) dictionary: the cached results, with the file names the
+                model was linked to; None if the key is not cached
+    '''
+    cache_path = os.path.join(cache_dir, key)
+    results_file_name = '{}.results.json'.format(cache_path)
+    if not os.path.isfile(results_file_name):
+        return None
+    results = json.load(open(results_file_name))
+    path_to_model = model_path(model_param)
+    for extension, result_key in zip(MODEL_FILE_EXTENSIONS,
+                                     ['json_file_name', 'weights_file_name',
+                                      'history_file_name']):
+        cached_file_name = '{}{}'.format(cache_path, extension)
+        if os.path.isfile(cached_file_name):
+            file_name = '{}{}'.format(path_to_model, extension)
+            _link(cached_file_name, file_name)
+            results[result_key] = file_name
+    return results
+
+
+def split_duplicate_jobs(jobs):
+    '''
+    INPUT:  (1) list of dictionaries: jobs
+    OUTPUT: (1) list of dictionaries: the first job with each training_key
+            (2) list of dictionaries: the rest, which only need linking to
+                the model the first one trains
+    '''
+    seen_keys = set()
+    unique_jobs, duplicate_jobs = [], []
+    for job in jobs:
+        key = training_key(job)
+        if key in seen_keys:
+            duplicate_jobs.append(job)
+        else:
+            seen_keys.add(key)
+            unique_jobs.append(job)
+    if duplicate_jobs:
+        print '{} jobs duplicate another job\'s model'.format(
+            len(duplicate_jobs))
+    return unique_jobs, duplicate_jobs
+
+
+def reuse_cached_model(job, model_param, manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) dictionary: a job
+            (2) Dictionary of model parameters for the job
+            (3) string: path to the sweep manifest
+    OUTPUT: (1) boolean: True if the model was in the cache and is now
+                linked to the job's name and recorded as finished
+    '''
+    key = training_key(job)
+    results = link_cached_model(key, model_param)
+    if results is None:
+        return False
+    print 'Reusing cached model {} for {}'.format(key, job['name_to_append'])
+    epochs_done = results.pop('epochs_done', model_param['n_epoch'])
+    results.update(job_lineage(job))
+    record_job_status(manifest_path, job, 'finished',
+                      n_epoch=model_param['n_epoch'],
+                      epochs_done=epochs_done, cached=key,
+                      started_at=time.time(), **results)
+    append_results(results_path_for_manifest(manifest_path),
+                   [result_row(job, results, epochs_done)])
+    return True
+
+
+### Job Running Functions###
+def split_validation(X_train, y_train, validation_split,
+                     seed=VALIDATION_SEED):
+    '''
+    INPUT:  (1) 4D numpy array: the X training data
+            (2) 1D numpy array: the training labels
+            (3) float: the fraction of the training images to hold out
+            (4) integer: seed for which images are held out
+    OUTPUT: (1) 4D numpy array: the X training data left to train on
+            (2) 1D numpy array: their labels
+            (3) 4D numpy array: the held out X validation data
+            (4) 1D numpy array: their labels
+    '''
+    n_held_out = int(round(validation_split * X_train.shape[0]))
+    held_out = np.random.RandomState(seed).permutation(
+        X_train.shape[0])[:n_held_out]
+    kept = np.ones(X_train.shape[0], dtype=bool)
+    kept[held_out] = False
+    return X_train[kept], y_train[kept], X_train[held_out], y_train[held_out]
+
+
+def score_held_out_model(results, model_param, X_test, y_test):
+    '''
+    INPUT:  (1) dictionary: the results of fit_and_save_model, run with a
+                validation split in place of the test data
+            (2) Dictionary of model parameters
+            (3) 4D numpy array: the X test data
+            (4) 1D numpy array: the test labels
+    OUTPUT: (1) dictionary: the results, with the validation split's score
+                and accuracy as val_score and val_accuracy, and test_score
+                and test_accuracy measured on the test data
+
+    The saved model is run with NumpyModel, so this works whether or not
+    the Keras model was compiled (see fit_and_save_model_data_parallel).
+    '''
+    with NumpyModel.from_saved_model(
+            os.path.splitext(results['weights_file_name'])[0],
+            pool_size=model_param['pool_size']) as model:
+        probas = model.predict_proba(X_test)
+    label_probas = np.clip(probas[np.arange(len(y_test)), y_test],
+                           1e-7, 1 - 1e-7)
+    test_score = -np.mean(np.log(label_probas))
+    test_accuracy = np.mean(np.argmax(probas, axis=1) == y_test)
+    print 'Test score: {}'.format(test_score)
+    print 'Test accuracy: {}'.format(test_accuracy)
+    return dict(results, val_score=results['test_score'],
+                val_accuracy=results['test_accuracy'],
+                test_score=float(test_score),
+                test_accuracy=float(test_accuracy))
+
+
+def run_sweep_job(job, X_train, y_train, X_test, y_test,
+                  manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) dictionary: a job from build_meshgrid_jobs or
+                build_noisy_data_jobs
+            (2) 4D numpy array: the clean X training data
+            (3) 1D numpy array: the clean training labels
+            (4) 4D numpy array: the X test data
+            (5) 1D numpy array: the test labels
+            (6) string: path to the sweep manifest
+    OUTPUT: (1) string: the name appended to the saved model
+
+    The global NumPy RNG is reseeded from the job before any noise is drawn
+    or the model is compiled (Keras draws its initial weights and dropout
+    seeds from it), which makes the result independent of the process the
+    job runs in. The clean data passed in are never modified: noisy images
+    for 'X' jobs are generated batch by batch from the job's seed.
+
+    Weights are checkpointed after every epoch. If the manifest shows that
+    an earlier attempt at this job got part of the way through, training
+    resumes from the last checkpoint and only the remaining epochs are run.
+    The same happens when a finished job is rerun with a larger n_epoch and
+    its checkpoint was kept (job['keep_checkpoint'], see
+    run_successive_halving); the saved model is then replaced.
+    A resumed model is not bitwise identical to an uninterrupted one: the
+    optimizer state and RNG position are not restored.
+
+    If a model with the same training_key is in the model cache, it is
+    linked to this job's name instead of being trained again; a model
+    trained from scratch is added to the cache. A resumed model is not,
+    since it differs from what an uninterrupted run with that key trains.
+    The finished run's metrics are also appended to the results store kept
+    next to the manifest (see results_store).
+
+    A job with a warm start (see build_warm_start_waves) starts from the
+    weights of the model it names rather than a random initialisation,
+    unless it resumes from its own checkpoint; its lineage is saved in the
+    manifest, the results store and the model's history. A job with
+    'data_parallel' set to more than 1 splits every batch across that many
+    worker processes (see fit_and_save_model_data_parallel).
+
+    A job with 'validation_split' set holds that fraction of the clean
+    training data out (see split_validation). It is used in place of the
+    test data for the per-epoch validation and early stopping, and its
+    accuracy is recorded as val_accuracy. The test data are only scored
+    once training is done.
+    '''
+    model_param = set_basic_model_param(job['name_to_append'],
+                                        dropout_scalar=job['dropout_scalar'],
+                                        batchsize=job['batchsize'],
+                                        **job['fit_param'])
+    if reuse_cached_model(job, model_param, manifest_path=manifest_path):
+        return job['name_to_append']
+    print 'Training model {}'.format(job['name_to_append'])
+    np.random.seed(job['seed'])
+    with timed_span('data_prep', model=model_param['model_build']):
+        if job.get('validation_split'):
+            X_train, y_train, X_val, y_val = split_validation(
+                X_train, y_train, job['validation_split'])
+        else:
+            X_val, y_val = X_test, y_test
+        if job['X_or_y'] == 'y':
+            y_train = add_label_noise(y_train, job['noise_val'],
+                                      seed=job['noise_seed'])
+        y_train = np_utils.to_categorical(y_train, model_param['n_classes'])
+        y_val = np_utils.to_categorical(y_val, model_param['n_classes'])
+    data_parallel = job.get('data_parallel', 1)
+    with timed_span('compile', model=model_param['model_build']):
+        if data_parallel > 1:
+            model = build_model(model_param)
+        else:
+            model = compile_model(model_param)
+
+    if not os.path.isdir(CHECKPOINT_DIR):
+        os.makedirs(CHECKPOINT_DIR)
+    checkpoint_file_name = '{}/KerasBaseModel_{}.h5'.format(
+        CHECKPOINT_DIR, model_param['model_build'])
+    job_states = load_manifest(manifest_path)
+    job_state = job_states.get(job['name_to_append'], {})
+    initial_epoch = job_state.get('epochs_done', 0)
+    lineage = job_lineage(job, job_states)
+    if initial_epoch > 0 and os.path.isfile(checkpoint_file_name):
+        print 'Resuming from epoch {}'.format(initial_epoch)
+        model.load_weights(checkpoint_file_name)
+    else:
+        initial_epoch = 0
+        if 'warm_start_weights' in lineage:
+            print 'Warm starting from {}'.format(lineage['warm_start_from'])
+            model.load_weights(lineage['warm_start_weights'])
+
+    start = time.time()
+    record_job_status(manifest_path, job, 'running',
+                      epochs_done=initial_epoch,
+                      checkpoint_file_name=checkpoint_file_name,
+                      started_at=start)
+    on_checkpoint = lambda epochs_done: record_job_status(
+        manifest_path, job, 'running', epochs_done=epochs_done)
+    checkpoint = EpochCheckpoint(checkpoint_file_name,
+                                 initial_epoch=initial_epoch,
+                                 on_checkpoint=on_checkpoint)
+    train_generator = None
+    if (job['X_or_y'] == 'X' and job['noise_val'] != 0 and
+            data_parallel <= 1):
+        train_generator = noisy_batch_generator(X_train, y_train,
+                                                job['batchsize'], mean=0,
+                                                stddev=job['noise_val'],
+                                                seed=job['noise_seed'],
+                                                initial_epoch=initial_epoch)
+    try:
+        with profiled(model_param['model_build']), \
+                timed_span('fit_and_save', model=model_param['model_build']):
+            if data_parallel > 1:
+                noise = None
+                if job['X_or_y'] == 'X' and job['noise_val'] != 0:
+                    noise = (0, job['noise_val'], job['noise_seed'])
+                results = fit_and_save_model_data_parallel(
+                    model, model_param, X_train, y_train, X_val, y_val,
+                    n_workers=data_parallel, seed=job['seed'], noise=noise,
+                    initial_epoch=initial_epoch, callbacks=[checkpoint],
+                    overwrite=True, lineage=lineage or None)
+            else:
+                results = fit_and_save_model(model, model_param, X_train,
+                                             y_train, X_val, y_val,
+                                             initial_epoch=initial_epoch,
+                                             callbacks=[checkpoint],
+                                             train_generator=train_generator,
+                                             overwrite=True,
+                                             lineage=lineage or None)
+        if job.get('validation_split'):
+            results = score_held_out_model(results, model_param, X_test,
+                                           y_test)
+    except Exception as e:
+        record_job_status(manifest_path, job, 'failed', error=repr(e))
+        raise
+    epochs_done = initial_epoch + results['n_epochs_run']
+    record_job_status(manifest_path, job, 'finished',
+                      n_epoch=model_param['n_epoch'],
+                      epochs_done=epochs_done,
+                      wall_time=time.time() - start,
+                      **dict(results, **lineage))
+    append_results(results_path_for_manifest(manifest_path),
+                   [result_row(job, results, epochs_done)])
+    if initial_epoch == 0:
+        cache_model(training_key(job), dict(results, epochs_done=epochs_done))
+    if not job.get('keep_checkpoint', False):
+        os.remove(checkpoint_file_name)
+    return job['name_to_append']
+
+
+def _thread_libraries():
+    '''
+    INPUT:  None
+    OUTPUT: (1) list of tuples: the file name and ctypes handle of every
+                BLAS or OpenMP library loaded in this process (read from
+                /proc/self/maps; empty where that does not exist)
+    '''
+    if not os.path.isfile('/proc/self/maps'):
+        return []
+    paths = set()
+    with open('/proc/self/maps') as f:
+        for line in f:
+            path = line.split()[-1]
+            if (path.startswith('/') and '.so' in path and
+                    re.search('blas|mkl|omp', os.path.basename(path))):
+                paths.add(path)
+    libraries = []
+    for path in sorted(paths):
+        try:
+            libraries.append((os.path.basename(path), ctypes.CDLL(path)))
+        except OSError:
+            continue
+    return libraries
+
+
+def pin_threads(n_threads):
+    '''
+    INPUT:  (1) integer: the number of BLAS/OpenMP threads a process may use
+    OUTPUT: None
+
+    NumPy's BLAS (and Theano's OpenMP) are loaded, and have sized their
+    thread pools, long before a sweep starts, so setting OMP_NUM_THREADS
+    and friends only reaches libraries loaded later and child processes.
+    The pools of the runtimes already loaded (see THREAD_CONTROLS) are
+    resized directly as well. OpenMP's count applies to the calling thread,
+    which is the one that trains.
+    '''
+    for env_var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'OPENBLAS_NUM_THREADS']:
+        os.environ[env_var] = str(n_threads)
+    for _, library in _thread_libraries():
+        for setter, _ in THREAD_CONTROLS:
+            if hasattr(library, setter):
+                getattr(library, setter)(ctypes.c_int(n_threads))
+
+
+def thread_counts():
+    '''
+    INPUT:  None
+    OUTPUT: (1) dictionary: the number of threads each loaded BLAS/OpenMP
+                runtime will use, keyed by '<library file>:<getter>'
+    '''
+    counts = {}
+    for library_name, library in _thread_libraries():
+        for _, getter in THREAD_CONTROLS:
+            if hasattr(library, getter):
+                counts['{}:{}'.format(library_name, getter)] = \
+                    getattr(library, getter)()
+    return counts
+
+
+def check_thread_count(n_threads):
+    '''
+    INPUT:  (1) integer: the number of threads the process was pinned to
+    OUTPUT: (1) boolean: True if every loaded runtime reports n_threads;
+                otherwise a warning names the ones that do not
+    '''
+    wrong_counts = {runtime: count
+                    for runtime, count in thread_counts().items()
+                    if count != n_threads}
+    if wrong_counts:
+        warnings.warn('Pinned to {} threads, but {}'.format(
+            n_threads, ', '.join('{} uses {}'.format(runtime, count)
+                                 for runtime, count
+                                 in sorted(wrong_counts.items()))))
+    return not wrong_counts
+
+
+def _init_sweep_worker(n_threads):
+    global _worker_data
+    pin_threads(n_threads)
+    check_thread_count(n_threads)
+    model_param = set_basic_model_param(0)
+    _worker_data = load_and_format_mnist_data(model_param, categorical_y=False)
+
+
+def _run_job_in_worker(job_and_manifest_path):
+    job, manifest_path = job_and_manifest_path
+    return run_sweep_job(job, *_worker_data, manifest_path=manifest_path)
+
+
+def run_sweep(jobs, n_workers=1, n_threads=None,
+              manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: jobs from build_meshgrid_jobs or
+                build_noisy_data_jobs
+            (2) integer: the number of worker processes; 1 runs the jobs
+                serially in this process
+            (3) integer: threads per worker (or for this process, if the
+                jobs run serially). Defaults to an even split of the
+                available cores between the workers.
+            (4) string: path to the sweep manifest
+    OUTPUT: (1) list of strings: the names of the models that were trained,
+                in the order they finished
+
+    Jobs the manifest records as finished (with their weights still on disk)
+    are skipped, so a crashed sweep can simply be rerun. Jobs that would
+    train the same model as another (see training_key) are run after all
+    the others, when they only need linking to its cached model.
+    '''
+    unique_jobs, duplicate_jobs = split_duplicate_jobs(
+        unfinished_jobs(jobs, manifest_path))
+    if n_workers <= 1:
+        if n_threads is not None:
+            pin_threads(n_threads)
+            check_thread_count(n_threads)
+        model_param = set_basic_model_param(0)
+        data = load_and_format_mnist_data(model_param, categorical_y=False)
+        return [run_sweep_job(job, *data, manifest_path=manifest_path)
+                for job in unique_jobs + duplicate_jobs]
+
+    if n_threads is None:
+        n_threads = max(1, multiprocessing.cpu_count() // n_workers)
+    pin_threads(n_threads)
+    pool = multiprocessing.Pool(processes=n_workers,
+                                initializer=_init_sweep_worker,
+                                initargs=(n_threads,))
+    n_jobs = len(unique_jobs) + len(duplicate_jobs)
+    finished = []
+    try:
+        for job_batch in [unique_jobs, duplicate_jobs]:
+            for name in pool.imap_unordered(_run_job_in_worker,
+                                            [(job, manifest_path)
+                                             for job in job_batch]):
+                finished.append(name)
+                print 'Finished {} ({} of {})'.format(name, len(finished),
+                                                      n_jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return finished
+
+
+def run_swarm_job(jobs, X_train, y_train, X_test, y_test,
+                  manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: label noise jobs with the same batch
+                size, to be trained together (see compile_model_swarm)
+            (2) 4D numpy array: the clean X training data
+            (3) 1D numpy array: the clean training labels
+            (4) 4D numpy array: the X test data
+            (5) 1D numpy array: the test labels
+            (6) string: path to the sweep manifest
+    OUTPUT: (1) list of strings: the names appended to the saved models
+
+    The swarm is seeded from its first job. Its models are therefore not
+    identical to the same jobs trained one at a time by run_sweep_job, and a
+    swarm interrupted part way through restarts from scratch. Jobs whose
+    model is in the model cache are linked to it rather than trained. The
+    swarm's models are not added to the cache, since they are not the
+    models their training_keys describe.
+    '''
+    jobs_to_train, model_params = [], []
+    for job in jobs:
+        model_param = set_basic_model_param(
+            job['name_to_append'], dropout_scalar=job['dropout_scalar'],
+            batchsize=job['batchsize'], **job['fit_param'])
+        if not reuse_cached_model(job, model_param,
+                                  manifest_path=manifest_path):
+            jobs_to_train.append(job)
+            model_params.append(model_param)
+    names = [job['name_to_append'] for job in jobs]
+    jobs = jobs_to_train
+    if not jobs:
+        return names
+    print 'Training a swarm of {} models'.format(len(jobs))
+    np.random.seed(jobs[0]['seed'])
+    n_classes = model_params[0]['n_classes']
+    y_trains = [np_utils.to_categorical(add_label_noise(y_train,
+                                                        job['noise_val'],
+                                                        seed=job['noise_seed']),
+                                        n_classes)
+                for job in jobs]
+    y_test = np_utils.to_categorical(y_test, n_classes)
+    swarm, swarm_layers = compile_model_swarm(model_params)
+
+    start = time.time()
+    for job in jobs:
+        record_job_status(manifest_path, job, 'running', epochs_done=0,
+                          started_at=start)
+    try:
+        with profiled('swarm_{}'.format(jobs[0]['name_to_append'])), \
+                timed_span('fit_and_save_swarm', swarm_size=len(jobs)):
+            all_results = fit_and_save_model_swarm(swarm, swarm_layers,
+                                                   model_params, X_train,
+                                                   y_trains, X_test, y_test,
+                                                   overwrite=True)
+    except Exception as e:
+        for job in jobs:
+            record_job_status(manifest_path, job, 'failed', error=repr(e))
+        raise
+    for job, model_param, results in zip(jobs, model_params, all_results):
+        record_job_status(manifest_path, job, 'finished',
+                          n_epoch=model_param['n_epoch'],
+                          epochs_done=model_param['n_epoch'],
+                          wall_time=time.time() - start, swarm_size=len(jobs),
+                          **results)
+    append_results(results_path_for_manifest(manifest_path),
+                   [result_row(job, results, model_param['n_epoch'])
+                    for job, model_param, results
+                    in zip(jobs, model_params, all_results)])
+    return names
+
+
+def link_finished_model(job, source_job, manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) dictionary: a job
+            (2) dictionary: a finished job that trained the same model
+            (3) string: path to the sweep manifest
+    OUTPUT: (1) string: the name appended to the job's model
+
+    The source job's saved files are linked to the job's name and its
+    results recorded for the job, as reuse_cached_model does with the model
+    cache.
+    '''
+    source_state = load_manifest(manifest_path)[source_job['name_to_append']]
+    model_param = set_basic_model_param(job['name_to_append'],
+                                        dropout_scalar=job['dropout_scalar'],
+                                        batchsize=job['batchsize'],
+                                        **job['fit_param'])
+    path_to_model = model_path(model_param)
+    results = {result_key: source_state[result_key]
+               for result_key in ['n_epochs_run', 'test_score',
+                                  'test_accuracy', 'val_score',
+                                  'val_accuracy', 'run_time', 'swarm_size']
+               if result_key in source_state}
+    for extension, result_key in zip(MODEL_FILE_EXTENSIONS,
+                                     ['json_file_name', 'weights_file_name',
+                                      'history_file_name']):
+        file_name = source_state.get(result_key)
+        if file_name is not None and os.path.isfile(file_name):
+            results[result_key] = '{}{}'.format(path_to_model, extension)
+            _link(file_name, results[result_key])
+    print 'Linking {} to {}'.format(job['name_to_append'],
+                                    source_job['name_to_append'])
+    epochs_done = source_state['epochs_done']
+    record_job_status(manifest_path, job, 'finished',
+                      n_epoch=model_param['n_epoch'], epochs_done=epochs_done,
+                      linked_from=source_job['name_to_append'],
+                      started_at=time.time(), **results)
+    append_results(results_path_for_manifest(manifest_path),
+                   [result_row(job, results, epochs_done)])
+    return job['name_to_append']
+
+
+def run_swarm(jobs, swarm_size=8, manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: label noise jobs, eg. from
+                build_meshgrid_jobs
+            (2) integer: the most models to train together in one swarm
+            (3) string: path to the sweep manifest
+    OUTPUT: (1) list of strings: the names of the models that were trained
+
+    Jobs are grouped by batch size (a swarm steps all its models together)
+    and each group is trained swarm_size models at a time, so the data for
+    one epoch are streamed once per swarm rather than once per model.
+    Only label noise jobs can share data this way. Jobs that duplicate
+    another job's model (see training_key) are linked to that job's model
+    at the end (see link_finished_model).
+    '''
+    jobs_to_run, duplicate_jobs = split_duplicate_jobs(
+        unfinished_jobs(jobs, manifest_path))
+    if any(job['X_or_y'] != 'y' for job in jobs_to_run):
+        raise ValueError('Only label noise (y) jobs can be trained in a swarm')
+    if any(job.get('validation_split') for job in jobs_to_run):
+        raise ValueError('Jobs with a validation split cannot be trained in '
+                         'a swarm')
+    jobs_by_batchsize = {}
+    for job in jobs_to_run:
+        jobs_by_batchsize.setdefault(job['batchsize'], []).append(job)
+
+    model_param = set_basic_model_param(0)
+    data = load_and_format_mnist_data(model_param, categorical_y=False)
+    finished = []
+    for batchsize in sorted(jobs_by_batchsize):
+        batch_jobs = jobs_by_batchsize[batchsize]
+        for start in range(0, len(batch_jobs), swarm_size):
+            finished += run_swarm_job(batch_jobs[start:start + swarm_size],
+                                      *data, manifest_path=manifest_path)
+    source_jobs = {training_key(job): job for job in jobs_to_run}
+    for job in duplicate_jobs:
+        finished.append(link_finished_model(
+            job, source_jobs[training_key(job)], manifest_path=manifest_path))
+    return finished
+
+
+### Adaptive Sweep Functions###
+def run_successive_halving(jobs, min_epoch=1, max_epoch=16, eta=2,
+                           validation_split=0.1, n_workers=1, n_threads=None,
+                           manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: jobs, eg. from build_meshgrid_jobs
+            (2) integer: the epochs every job is trained for in the first rung
+            (3) integer: the epochs the surviving jobs are trained up to
+            (4) integer: after each rung only the best 1/eta of the jobs
+                (by validation accuracy) continue, for eta times as many
+                epochs
+            (5) float: the fraction of the training data every job holds out
+                to be ranked on (see run_sweep_job)
+            (6) integer: the number of worker processes (see run_sweep)
+            (7) integer: BLAS threads per worker (see run_sweep)
+            (8) string: path to the sweep manifest
+    OUTPUT: (1) dictionary: the number of epochs each job was trained for,
+                keyed by the name appended to the model
+
+    Each rung resumes the surviving jobs from their checkpoints rather than
+    retraining them, so a job trained to max_epoch costs no more than it
+    would in a full sweep, while the jobs dropped early cost a fraction of
+    it. Jobs are ranked on the training data they held out, never on the
+    test data, so the test accuracies recorded for the survivors are not
+    biased by the selection. Jobs are ranked against the others at the same
+    noise level only, so
+    every noise level keeps at least one fully trained point instead of the
+    cleanest levels crowding out the noisy ones. The checkpoints of dropped
+    jobs are deleted. Every job still ends with a saved model; the epochs it
+    got should be kept alongside its accuracy (see acc_grid_from_manifest).
+    '''
+    surviving_jobs = jobs
+    n_epoch = min(min_epoch, max_epoch)
+    epochs_trained = {}
+    while True:
+        rung_jobs = [dict(job,
+                          fit_param=dict(job['fit_param'], n_epoch=n_epoch),
+                          validation_split=validation_split,
+                          keep_checkpoint=n_epoch < max_epoch)
+                     for job in surviving_jobs]
+        print 'Training {} jobs to {} epochs'.format(len(rung_jobs), n_epoch)
+        run_sweep(rung_jobs, n_workers=n_workers, n_threads=n_threads,
+                  manifest_path=manifest_path)
+        for job in rung_jobs:
+            epochs_trained[job['name_to_append']] = n_epoch
+        if n_epoch >= max_epoch:
+            break
+        job_states = load_manifest(manifest_path)
+        noise_levels = {}
+        for job in surviving_jobs:
+            noise_levels.setdefault(job['noise_val'], []).append(job)
+        next_jobs = []
+        for noise_val in sorted(noise_levels):
+            ranked_jobs = sorted(
+                noise_levels[noise_val],
+                key=lambda job:
+                    job_states[job['name_to_append']]['val_accuracy'],
+                reverse=True)
+            n_keep = max(1, len(ranked_jobs) // eta)
+            next_jobs.extend(ranked_jobs[:n_keep])
+            for job in ranked_jobs[n_keep:]:
+                checkpoint_file_name = job_states[job['name_to_append']].get(
+                    'checkpoint_file_name')
+                if checkpoint_file_name and \
+                        os.path.isfile(checkpoint_file_name):
+                    os.remove(checkpoint_file_name)
+        surviving_jobs = next_jobs
+        n_epoch = min(n_epoch * eta, max_epoch)
+    return epochs_trained
+
+
+def acc_grid_from_manifest(percent_random_labels, batchsizes, dropout_scalars,
+                           manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the dropout scalars
+            (4) string: path to the sweep manifest
+    OUTPUT: (1) 3D numpy array: test accuracies recorded in the manifest,
+                in the same layout as calc_meshgrid_acc; nan where a grid
+                point has not finished
+            (2) 3D numpy array: the number of epochs each point was trained
+                for (0 where it has not finished)
+
+    Reading the accuracies recorded at training time avoids running any
+    models, which is what lets an adaptive sweep decide where to go next.
+    '''
+    job_states = load_manifest(manifest_path)
+    grid_shape = (len(percent_random_labels), len(batchsizes),
+                  len(dropout_scalars))
+    acc_grid = np.nan * np.ones(grid_shape)
+    epochs_grid = np.zeros(grid_shape, dtype=int)
+    for pr_ind, percent_random in enumerate(percent_random_labels):
+        for b_ind, batchsize in enumerate(batchsizes):
+            for d_ind, dropout_scalar in enumerate(dropout_scalars):
+                name_to_append = 'y_{}_{}_{}'.format(percent_random, batchsize,
+                                                     dropout_scalar)
+                job_state = job_states.get(name_to_append)
+                if job_state is None or job_state['status'] != 'finished':
+                    continue
+                acc_grid[pr_ind, b_ind, d_ind] = job_state['test_accuracy']
+                epochs_grid[pr_ind, b_ind, d_ind] = job_state['n_epoch']
+    return acc_grid, epochs_grid
+
+
+def fill_missing_grid_points(percent_random_labels, acc_grid):
+    '''
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 3D numpy array: accuracies, with nan at missing points
+    OUTPUT: (1) 3D numpy array: the accuracies with the missing points
+                linearly interpolated along the label noise axis
+            (2) 3D numpy array of booleans: True where a point was
+                interpolated
+
+    A (batch size, dropout) line with fewer than two measured points is
+    left as nan, since there is nothing to interpolate between.
+    '''
+    missing = np.isnan(acc_grid)
+    filled_grid = acc_grid.copy()
+    for b_ind in range(acc_grid.shape[1]):
+        for d_ind in range(acc_grid.shape[2]):
+            line_missing = missing[:, b_ind, d_ind]
+            if line_missing.any() and (~line_missing).sum() >= 2:
+                filled_grid[line_missing, b_ind, d_ind] = np.interp(
+                    percent_random_labels[line_missing],
+                    percent_random_labels[~line_missing],
+                    acc_grid[~line_missing, b_ind, d_ind])
+    return filled_grid, missing
+
+
+def refine_noise_levels(percent_random_labels, acc_grid, min_acc_step=0.05,
+                        max_new_levels=4):
+    '''
+    INPUT:  (1) 1D numpy array: the label noise levels trained so far, sorted
+            (2) 3D numpy array: their accuracies (nan allowed)
+            (3) float: add a level between two neighbours whose accuracies
+                differ by more than this (averaged over batch size and
+                dropout)
+            (4) integer: the most new levels to add
+    OUTPUT: (1) 1D numpy array: the new noise levels, steepest gaps first
+    '''
+    acc_steps = np.abs(np.diff(acc_grid, axis=0))
+    mean_steps = np.array([np.mean(step[~np.isnan(step)])
+                           if (~np.isnan(step)).any() else 0.
+                           for step in acc_steps])
+    steep_gaps = [gap_ind for gap_ind in np.argsort(-mean_steps)
+                  if mean_steps[gap_ind] > min_acc_step][:max_new_levels]
+    return np.array([(percent_random_labels[gap_ind] +
+                      percent_random_labels[gap_ind + 1]) / 2.
+                     for gap_ind in steep_gaps])
+
+
+def run_adaptive_meshgrid(percent_random_labels, batchsizes, dropout_scalars,
+                          n_refinements=2, min_acc_step=0.05,
+                          max_new_levels=4, min_epoch=1, max_epoch=16,
+                          eta=2, n_workers=1, n_threads=None,
+                          manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) 1D numpy array: the initial fractions of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the dropout scalars
+            (4) integer: rounds of adding noise levels where the accuracy
+                surface is steep (see refine_noise_levels)
+            (5) float: see refine_noise_levels
+            (6) integer: see refine_noise_levels
+            (7)-(9) integers: see run_successive_halving
+            (10) integer: the number of worker processes
+            (11) integer: BLAS threads per worker
+            (12) string: path to the sweep manifest
+    OUTPUT: (1) 1D numpy array: every label noise level trained, sorted
+            (2) 3D numpy array: accuracies in the calc_meshgrid_acc layout,
+                ready for plot_acc_vs_noisy_y_surface
+            (3) 3D numpy array of booleans: True where a point's accuracy
+                was interpolated from fully trained neighbours rather than
+                measured
+            (4) 3D numpy array: the number of epochs each point was trained
+                for; points stopped early by successive halving have fewer
+
+    Each round trains the new grid points with successive halving, then
+    adds noise levels between neighbours whose accuracies differ sharply.
+    Points stopped before max_epoch are not comparable with fully trained
+    ones, so their accuracies are replaced by interpolation along the noise
+    axis where there are fully trained neighbours to interpolate between;
+    elsewhere the under-trained accuracy is kept and epochs_grid shows it.
+    '''
+    all_levels = np.array([])
+    new_levels = np.asarray(percent_random_labels, dtype=float)
+    for refinement in range(n_refinements + 1):
+        jobs = build_meshgrid_jobs(new_levels, batchsizes, dropout_scalars,
+                                   seed=1234 + 10000 * refinement)
+        run_successive_halving(jobs, min_epoch=min_epoch,
+                               max_epoch=max_epoch, eta=eta,
+                               n_workers=n_workers, n_threads=n_threads,
+                               manifest_path=manifest_path)
+        all_levels = np.union1d(all_levels, new_levels)
+        acc_grid, epochs_grid = acc_grid_from_manifest(
+            all_levels, batchsizes, dropout_scalars, manifest_path)
+        if refinement == n_refinements:
+            break
+        new_levels = np.setdiff1d(refine_noise_levels(all_levels, acc_grid,
+                                                      min_acc_step,
+                                                      max_new_levels),
+                                  all_levels)
+        if len(new_levels) == 0:
+            break
+    under_trained = epochs_grid < max_epoch
+    filled_grid, _ = fill_missing_grid_points(
+        all_levels, np.where(under_trained, np.nan, acc_grid))
+    interpolated = under_trained & ~np.isnan(filled_grid)
+    kept = under_trained & np.isnan(filled_grid)
+    filled_grid[kept] = acc_grid[kept]
+    return all_levels, filled_grid, interpolated, epochs_grid
+
+
+### Warm Start Functions###
+def build_warm_start_waves(jobs, trunk_weights_file=None, patience=2):
+    '''
+    INPUT:  (1) list of dictionaries: jobs, eg. from build_meshgrid_jobs or
+                build_noisy_data_jobs
+            (2) string, optional: weights (.h5) of a pretrained
+                compile_model network that every job starts from. By
+                default each job starts from the next lower noise level
+                with the same batch size, dropout and replicate.
+            (3) integer: early stopping patience for jobs that do not set
+                their own, so warm started jobs stop once they converge
+    OUTPUT: (1) list of lists of dictionaries: the jobs with their warm
+                starts, in waves; every job's warm start is trained in an
+                earlier wave
+
+    Each warm started job names what it starts from in 'warm_start_from'
+    and carries 'warm_start_key' (the training_key of the model it starts
+    from, or the sha1 of the trunk's weights), so its own training_key
+    covers its whole lineage. The lowest noise level of each chain is
+    trained from a random initialisation.
+    '''
+    trunk_key = None
+    if trunk_weights_file is not None:
+        trunk_key = file_sha1(trunk_weights_file)
+    chains = {}
+    for job in jobs:
+        chain_key = (job['X_or_y'], job['batchsize'], job['dropout_scalar'],
+                     job.get('replicate', 0))
+        chains.setdefault(chain_key, []).append(job)
+    waves = []
+    for chain_key in sorted(chains):
+        parent = None
+        chain = sorted(chains[chain_key], key=lambda job: job['noise_val'])
+        for depth, job in enumerate(chain):
+            job = dict(job)
+            if job['fit_param'].get('patience') is None:
+                job['fit_param'] = dict(job['fit_param'], patience=patience)
+            if trunk_key is not None:
+                depth = 0
+                job.update(warm_start_from=trunk_weights_file,
+                           warm_start_weights=trunk_weights_file,
+                           warm_start_key=trunk_key)
+            elif parent is not None:
+                job.update(warm_start_from=parent['name_to_append'],
+                           warm_start_key=training_key(parent))
+            while len(waves) <= depth:
+                waves.append([])
+            waves[depth].append(job)
+            parent = job
+    return waves
+
+
+def job_lineage(job, job_states=None):
+    '''
+    INPUT:  (1) dictionary: a job
+            (2) dictionary, optional: job states from load_manifest, to look
+                up the weights of the model the job warm starts from
+    OUTPUT: (1) dictionary: warm_start_from, warm_start_key and (given
+                job_states) warm_start_weights; empty for a cold start
+    '''
+    if 'warm_start_from' not in job:
+        return {}
+    lineage = {'warm_start_from': job['warm_start_from'],
+               'warm_start_key': job['warm_start_key']}
+    if job_states is None:
+        return lineage
+    if 'warm_start_weights' in job:
+        lineage['warm_start_weights'] = job['warm_start_weights']
+    else:
+        parent_state = job_states.get(job['warm_start_from'])
+        if parent_state is None or parent_state['status'] != 'finished':
+            raise ValueError('{} warm starts from {}, which has not '
+                             'finished'.format(job['name_to_append'],
+                                               job['warm_start_from']))
+        lineage['warm_start_weights'] = parent_state['weights_file_name']
+    return lineage
+
+
+def warm_start_savings(jobs, n_threads=1, manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: jobs from build_warm_start_waves
+            (2) integer: BLAS threads each job was trained with
+            (3) string: path to the sweep manifest
+    OUTPUT: (1) dictionary: 'cold_epochs', the epochs a cold start took to
+                converge; 'warm_epochs', the mean epochs a warm started job
+                took; 'cpu_hours' spent on the warm started jobs,
+                'cpu_hours_saved' compared with starting them cold, and
+                'cold_baseline', where cold_epochs came from: 'lowest
+                noise level' or 'n_epoch'
+
+    The cold start cost is estimated from the cold started jobs in the
+    sweep (the lowest noise level of each chain), or from the full n_epoch
+    when there are none (eg. with a trunk), at each warm started job's own
+    time per epoch. Models linked from the model cache are not counted.
+    This is an estimate, not a measurement: no job is trained cold at the
+    warm started jobs' noise levels, and how long a cold start takes to
+    converge changes with the noise, so the savings are biased by however
+    much the lowest noise level differs from the others. The n_epoch
+    baseline is an upper bound on a cold start with early stopping, so it
+    overstates the savings.
+    '''
+    job_states = load_manifest(manifest_path)
+    cold_epochs, warm_epochs = [], []
+    warm_minutes, saved_minutes = 0., 0.
+    trained_states = []
+    for job in jobs:
+        job_state = job_states.get(job['name_to_append'])
+        if (job_state is None or job_state['status'] != 'finished' or
+                'cached' in job_state or not job_state.get('n_epochs_run')):
+            continue
+        if 'warm_start_from' in job:
+            trained_states.append(job_state)
+        else:
+            cold_epochs.append(job_state['n_epochs_run'])
+    if cold_epochs:
+        cold_epoch_estimate = np.mean(cold_epochs)
+        cold_baseline = 'lowest noise level'
+    else:
+        cold_baseline = 'n_epoch'
+        cold_epoch_estimate = max(
+            set_basic_model_param(0, **job['fit_param'])['n_epoch']
+            for job in jobs) if jobs else 0
+    for job_state in trained_states:
+        minutes_per_epoch = job_state['run_time'] / job_state['n_epochs_run']
+        warm_epochs.append(job_state['n_epochs_run'])
+        warm_minutes += job_state['run_time']
+        saved_minutes += ((cold_epoch_estimate - job_state['n_epochs_run']) *
+                          minutes_per_epoch)
+    return {'cold_epochs': float(cold_epoch_estimate),
+            'warm_epochs': float(np.mean(warm_epochs)) if warm_epochs else 0.,
+            'cpu_hours': warm_minutes * n_threads / 60.,
+            'cpu_hours_saved': saved_minutes * n_threads / 60.,
+            'cold_baseline': cold_baseline}
+
+
+def run_warm_start_sweep(jobs, n_workers=1, n_threads=None,
+                         trunk_weights_file=None, patience=2,
+                         manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: jobs, eg. from build_meshgrid_jobs
+            (2) integer: the number of worker processes (see run_sweep)
+            (3) integer: BLAS threads per worker (see run_sweep)
+            (4) string, optional: pretrained weights every job starts from
+                (see build_warm_start_waves)
+            (5) integer: early stopping patience for jobs without their own
+            (6) string: path to the sweep manifest
+    OUTPUT: (1) dictionary: the CPU time used and saved (see
+                warm_start_savings)
+
+    Each wave of warm started jobs is run as a sweep of its own, so the
+    chains of noise levels are trained side by side on the workers.
+    '''
+    waves = build_warm_start_waves(jobs, trunk_weights_file=trunk_weights_file,
+                                   patience=patience)
+    for wave_ind, wave in enumerate(waves):
+        print 'Warm start wave {} of {}: {} jobs'.format(wave_ind + 1,
+                                                         len(waves), len(wave))
+        run_sweep(wave, n_workers=n_workers, n_threads=n_threads,
+                  manifest_path=manifest_path)
+    if n_threads is None:
+        n_threads = max(1, multiprocessing.cpu_count() // max(1, n_workers))
+    savings = warm_start_savings([job for wave in waves for job in wave],
+                                 n_threads=n_threads,
+                                 manifest_path=manifest_path)
+    print ('Warm starts took {:.1f} epochs on average (cold: {:.1f}) and '
+           '{:.2f} CPU-hours, saving about {:.2f} CPU-hours').format(
+        savings['warm_epochs'], savings['cold_epochs'], savings['cpu_hours'],
+        savings['cpu_hours_saved'])
+    print ('The cold start cost is estimated from {}, not measured at the '
+           'warm started noise levels; treat the savings as a rough '
+           'estimate').format(
+        'the cold starts at the lowest noise level'
+        if savings['cold_baseline'] == 'lowest noise level'
+        else 'the full n_epoch, an upper bound')
+    return savings
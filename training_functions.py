@@ -0,0 +1,196 @@
+import multiprocessing
+import numpy as np
+from sweep_functions import *
+from evaluation_functions import *
+from work_queue import run_queue_coordinator
+
+
+### Model Training Functions###
+def train_models_on_noisy_data(characteristic_noise_vals, X_or_y,
+                               n_workers=1, n_threads=None, fit_param=None,
+                               n_replicates=1, warm_start=False,
+                               trunk_weights_file=None):
+    ''' 
+    INPUT:  (1) 1D numpy array: if on X, should be the standard deviations of
+                the Gaussian noise being added; if on y, should be the 
+                percentages of labels to be randomly changed
+            (2) string: 'X' or 'y' corresponding to which data to make noisy
+            (3) integer: the number of worker processes to train on
+            (4) integer: BLAS threads per worker (see run_sweep)
+            (5) Dictionary, optional: n_epoch, patience and min_delta to
+                pass to set_basic_model_param, eg. to turn on early stopping
+            (6) integer: train this many independently seeded replicates
+                of every model (see build_noisy_data_jobs)
+            (7) boolean: start each noise level from the model trained on
+                the next lower one (see run_warm_start_sweep)
+            (8) string, optional: start every model from these pretrained
+                weights instead
+    OUTPUT: None, directly at least. All models will be saved to /models    
+    This function loads the basic data, then loops through the characteristic
+    noise values and trains models on those noisy data. Classwise accuracies 
+    can then be calculated from these models. 
+    '''
+    jobs = build_noisy_data_jobs(characteristic_noise_vals, X_or_y,
+                                 fit_param=fit_param,
+                                 n_replicates=n_replicates)
+    if warm_start or trunk_weights_file is not None:
+        run_warm_start_sweep(jobs, n_workers=n_workers, n_threads=n_threads,
+                             trunk_weights_file=trunk_weights_file)
+    else:
+        run_sweep(jobs, n_workers=n_workers, n_threads=n_threads)
+
+
+def train_model_meshgrid(percent_random_labels, batchsizes, dropout_scalars,
+                         n_workers=1, n_threads=None, swarm_size=1,
+                         fit_param=None, n_replicates=1, warm_start=False,
+                         trunk_weights_file=None, queue_dir=None):
+    ''' 
+    INPUT:  (1) 1D numpy array: fraction of y labels to randomize
+            (2) 1D numpy array: size of batches to train models on
+            (3) 1D numpy array: the scalars by which to change the 
+                built-in dropout values (0.25 and 0.5: see keras_model
+                for specifics)
+            (4) integer: the number of worker processes to train on
+            (5) integer: BLAS threads per worker (see run_sweep)
+            (6) integer: if more than 1, train this many models at a time
+                in one swarm (see run_swarm) instead of using workers
+            (7) Dictionary, optional: n_epoch, patience and min_delta to
+                pass to set_basic_model_param, eg. to turn on early stopping
+            (8) integer: train this many independently seeded replicates
+                of every grid point
+            (9) boolean: start each noise level from the model trained on
+                the next lower one (see run_warm_start_sweep)
+            (10) string, optional: start every model from these pretrained
+                weights instead
+            (11) string, optional: publish the jobs to this shared work
+                queue and wait for queue workers on any host to train them
+                (see work_queue.run_queue_coordinator); cannot be combined
+                with (6), (9) or (10)
+    OUTPUT: None, but all models will be saved to /models
+
+    This function trains models on a mesh of parameters (percent random labels,
+    batch sizes, and dropout levels). Model accuracies can then be calculated
+    from these models to be plotted in 3 dimensions: see calc_meshgrid_acc.
+    Each grid point is an independent, seeded job, so running the grid on
+    several workers gives the same models as running it serially.
+    Replicates are trained one whole grid after another, so the first
+    complete grid (and a first estimate of the spread) is available long
+    before the sweep finishes; see calc_meshgrid_acc_replicates.
+    '''
+    jobs = build_meshgrid_jobs(percent_random_labels, batchsizes,
+                               dropout_scalars, fit_param=fit_param,
+                               n_replicates=n_replicates)
+    if queue_dir is not None:
+        if warm_start or trunk_weights_file is not None or swarm_size > 1:
+            raise ValueError('Queued jobs are trained one at a time from '
+                             'scratch; they cannot be warm started or '
+                             'trained in a swarm')
+        failed = run_queue_coordinator(jobs, queue_dir=queue_dir)
+        if failed:
+            raise RuntimeError('{} grid points failed: {}'.format(
+                len(failed), ', '.join(failed)))
+    elif warm_start or trunk_weights_file is not None:
+        if swarm_size > 1:
+            raise ValueError('Warm started models use early stopping and '
+                             'cannot be trained in a swarm')
+        run_warm_start_sweep(jobs, n_workers=n_workers, n_threads=n_threads,
+                             trunk_weights_file=trunk_weights_file)
+    elif swarm_size > 1:
+        run_swarm(jobs, swarm_size=swarm_size)
+    else:
+        run_sweep(jobs, n_workers=n_workers, n_threads=n_threads)
+
+
+def train_single_model(X_or_y, noise_val, batchsize=32, dropout_scalar=1,
+                       n_workers=None, fit_param=None, seed=1234):
+    '''
+    INPUT:  (1) string: 'X' or 'y' corresponding to which data to make noisy
+            (2) float: the noise stddev (X) or fraction of random labels (y)
+            (3) integer: the batch size
+            (4) float: the dropout scalar
+            (5) integer: worker processes to split every batch across;
+                defaults to one per CPU
+            (6) Dictionary, optional: n_epoch, patience and min_delta to
+                pass to set_basic_model_param
+            (7) integer: base seed, as for build_meshgrid_jobs
+    OUTPUT: (1) string: the name appended to the saved model
+
+    Trains one model as fast as the machine allows, with synchronous
+    data-parallel training (see fit_and_save_model_data_parallel). It goes
+    through the sweep manifest and model cache like any other job; the
+    name ends in '_dp<n_workers>' so it never collides with the model of
+    the same grid point trained by a sweep.
+    '''
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    job = {'name_to_append': '{}_{}_{}_{}_dp{}'.format(X_or_y, noise_val,
+                                                       batchsize,
+                                                       dropout_scalar,
+                                                       n_workers),
+           'X_or_y': X_or_y,
+           'noise_val': noise_val,
+           'batchsize': batchsize,
+           'dropout_scalar': dropout_scalar,
+           'replicate': 0,
+           'fit_param': fit_param or {},
+           'data_parallel': n_workers}
+    job.update(job_seeds(seed, 0, X_or_y, noise_val, batchsize,
+                          dropout_scalar))
+    run_sweep([job])
+    return job['name_to_append']
+
+
+### Master Functions###
+def save_accuracy_meshgrid(acc_grid_filename, n_workers=1, queue_dir=None):
+    ''' 
+    INPUT:  (1) string: the filename (without .h5) to save the 3D numpy
+                array of accuracies to
+            (2) integer: the number of worker processes to train on
+            (3) string, optional: publish the grid to this shared work
+                queue and wait for queue workers on any host to train it
+                (see work_queue), instead of training it here
+    OUTPUT: None, but the accuracy grid will be saved
+    
+    The grid parameters (percent random labels, batchsizes, and dropout 
+    scalars) are set in this function. The full model swarm is trained,
+    then the full accuracy grid is calculated. The accuracy grid is saved
+    as 'acc_grid' with its axes (see results_store.save_labeled_grid).
+    '''
+    percent_random_labels, batchsizes, dropout_scalars = load_meshgrid_param()
+    train_model_meshgrid(percent_random_labels, batchsizes, dropout_scalars,
+                         n_workers=n_workers, queue_dir=queue_dir)
+    acc_grid = calc_meshgrid_acc(percent_random_labels, batchsizes, 
+                                    dropout_scalars)
+    save_labeled_grid('{}.h5'.format(acc_grid_filename),
+                      meshgrid_axes(percent_random_labels, batchsizes,
+                                    dropout_scalars),
+                      acc_grid=acc_grid)
+
+
+def save_adaptive_accuracy_meshgrid(acc_grid_filename, n_refinements=2,
+                                    max_epoch=16, n_workers=1):
+    ''' 
+    INPUT:  (1) string: the filename (without .h5) to save the 3D numpy
+                array of accuracies to
+            (2) integer: rounds of adding label noise levels where the
+                accuracy surface is steep
+            (3) integer: the most epochs any model is trained for
+            (4) integer: the number of worker processes to train on
+    OUTPUT: None, but the accuracy grid will be saved
+    
+    The adaptive version of save_accuracy_meshgrid: models are trained with
+    successive halving, starting from the grid in load_meshgrid_param, and
+    label noise levels are added where the accuracy changes sharply (see
+    sweep_functions.run_adaptive_meshgrid). The accuracy grid is saved as
+    before, along with which points were interpolated ('interpolated') and
+    how many epochs each point was trained for ('epochs_grid'). Its noise
+    axis holds every level the sweep covered.
+    '''
+    percent_random_labels, batchsizes, dropout_scalars = load_meshgrid_param()
+    all_levels, acc_grid, interpolated, epochs_grid = run_adaptive_meshgrid(
+        percent_random_labels, batchsizes, dropout_scalars,
+        n_refinements=n_refinements, max_epoch=max_epoch, n_workers=n_workers)
+    save_labeled_grid('{}.h5'.format(acc_grid_filename),
+                      meshgrid_axes(all_levels, batchsizes, dropout_scalars),
+                      acc_grid=acc_grid, interpolated=interpolated,
+                      epochs_grid=epochs_grid)
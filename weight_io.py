@@ -0,0 +1,22 @@
+# Reading saved weights needs only h5py, so this lives apart from the Keras
+# modules: numpy_inference can load models without importing Keras.
+import h5py
+
+
+def load_weight_arrays(weights_file_name):
+    '''
+    INPUT:  (1) String: the path to a weights file saved by Keras, including
+                the .h5 at the end
+    OUTPUT: (1) list of numpy arrays: the weights, in the same order as
+                model.get_weights()
+
+    Reads the HDF5 file directly (one group per layer, one dataset per
+    parameter), without needing a model to load them into.
+    '''
+    weights = []
+    with h5py.File(weights_file_name, 'r') as f:
+        for layer_ind in range(f.attrs['nb_layers']):
+            g = f['layer_{}'.format(layer_ind)]
+            weights += [g['param_{}'.format(param_ind)][()]
+                        for param_ind in range(g.attrs['nb_params'])]
+    return weights
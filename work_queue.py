@@ -0,0 +1,437 @@
+import os
+import json
+import time
+import socket
+import thread
+import threading
+from sweep_functions import *
+from sweep_functions import _json_default
+
+
+# A work queue on a shared file system, for sweeps spread over several
+# hosts that all see the same working directory (and so the same models/).
+# Every job is a JSON file, named by its training_key, that moves between
+# the queue's directories:
+#
+#     pending/<key>.json             waiting to be run
+#     leased/<key>.json.<worker_id>  being run; its mtime is the heartbeat
+#     done/<key>.json                finished, with the worker's results
+#     failed/<key>.json              raised an error, with the error
+#
+# Naming the files by key means two jobs that train the same model are
+# only run once (the coordinator links the others to it), while two
+# different trainings that happen to share a name are both run.
+#
+# Moves are single renames, which are atomic, so when two workers try to
+# lease the same job only one rename succeeds. A lease whose heartbeat is
+# older than the lease timeout is renamed back to pending/, so a job on a
+# lost host is picked up by another one, and the worker that lost it
+# abandons the job. Each worker keeps its own manifest
+# and results store under workers/<worker_id>/ (file locks are not reliable
+# on network file systems) and the coordinator merges them.
+QUEUE_DIR = 'models/queue'
+QUEUE_SUBDIRS = ['pending', 'leased', 'done', 'failed', 'workers']
+LEASE_TIMEOUT = 600
+LEASE_GRACE_PERIOD = 60
+HEARTBEAT_INTERVAL = 30
+
+# When this process first saw each lease look expired; a lease is only
+# requeued once it has looked expired for LEASE_GRACE_PERIOD, so a stale
+# mtime from NFS attribute caching does not requeue a live lease.
+_expired_since = {}
+
+
+def _queue_path(queue_dir, subdir, file_name=''):
+    return os.path.join(queue_dir, subdir, file_name)
+
+
+def _job_file_name(job):
+    return '{}.json'.format(training_key(job))
+
+
+def _write_json(file_name, obj):
+    '''
+    INPUT:  (1) string: the file to write
+            (2) the object to write as JSON
+    OUTPUT: None; the file is written to a temporary name and renamed into
+            place, so readers never see it half-written
+    '''
+    tmp_file_name = '{}.tmp{}_{}'.format(file_name, socket.gethostname(),
+                                         os.getpid())
+    with open(tmp_file_name, 'w') as f:
+        json.dump(obj, f, default=_json_default)
+    os.rename(tmp_file_name, file_name)
+
+
+def make_queue(queue_dir=QUEUE_DIR):
+    '''
+    INPUT:  (1) string: the queue directory
+    OUTPUT: None, but the queue's directories are created if missing
+    '''
+    for subdir in QUEUE_SUBDIRS:
+        if not os.path.isdir(_queue_path(queue_dir, subdir)):
+            try:
+                os.makedirs(_queue_path(queue_dir, subdir))
+            except OSError:
+                if not os.path.isdir(_queue_path(queue_dir, subdir)):
+                    raise
+
+
+def queue_job_keys(queue_dir=QUEUE_DIR):
+    '''
+    INPUT:  (1) string: the queue directory
+    OUTPUT: (1) dictionary: 'pending', 'leased', 'done' and 'failed' mapped
+                to the set of training_keys of the jobs in that state
+    '''
+    job_keys = {}
+    for subdir in ['pending', 'leased', 'done', 'failed']:
+        file_names = [file_name for file_name in
+                      os.listdir(_queue_path(queue_dir, subdir))
+                      if '.tmp' not in file_name]
+        job_keys[subdir] = set(file_name.rsplit('.json', 1)[0]
+                               for file_name in file_names)
+    return job_keys
+
+
+def publish_jobs(jobs, queue_dir=QUEUE_DIR):
+    '''
+    INPUT:  (1) list of dictionaries: jobs, eg. from build_meshgrid_jobs
+            (2) string: the queue directory
+    OUTPUT: (1) integer: the number of jobs added to pending/
+
+    Jobs whose training_key is already in the queue, in any state, are not
+    added again, so a coordinator can be restarted with the same grid;
+    delete a job's file from failed/ to have it run again. Jobs are leased
+    in the order they are published.
+    '''
+    make_queue(queue_dir)
+    queued = set.union(*queue_job_keys(queue_dir).values())
+    n_published = 0
+    for job in jobs:
+        key = training_key(job)
+        if key in queued:
+            continue
+        _write_json(_queue_path(queue_dir, 'pending', _job_file_name(job)),
+                    job)
+        queued.add(key)
+        n_published += 1
+    return n_published
+
+
+def lease_job(worker_id, queue_dir=QUEUE_DIR):
+    '''
+    INPUT:  (1) string: the worker taking the lease
+            (2) string: the queue directory
+    OUTPUT: (1) dictionary: the leased job, or None if none are pending
+            (2) string: the lease file to heartbeat (see heartbeat), or None
+    '''
+    pending_dir = _queue_path(queue_dir, 'pending')
+    file_names = []
+    for file_name in os.listdir(pending_dir):
+        if '.tmp' in file_name:
+            continue
+        try:
+            mtime = os.path.getmtime(os.path.join(pending_dir, file_name))
+        except OSError:
+            continue
+        file_names.append((mtime, file_name))
+    for _, file_name in sorted(file_names):
+        pending_file_name = os.path.join(pending_dir, file_name)
+        lease_file_name = _queue_path(queue_dir, 'leased', '{}.{}'.format(
+            file_name, worker_id))
+        try:
+            # A rename keeps the mtime, which would make the new lease look
+            # as old as the job and let another host requeue it at once
+            os.utime(pending_file_name, None)
+            os.rename(pending_file_name, lease_file_name)
+        except OSError:
+            # Another worker leased it first
+            continue
+        try:
+            if os.path.isfile(_queue_path(queue_dir, 'done', file_name)):
+                # Requeued after an expired lease, but finished after all
+                os.remove(lease_file_name)
+                continue
+            os.utime(lease_file_name, None)
+            job = json.load(open(lease_file_name))
+        except (OSError, IOError, ValueError):
+            # Requeued by another host in the meantime; try the next job
+            continue
+        return job, lease_file_name
+    return None, None
+
+
+def heartbeat(lease_file_name):
+    '''
+    INPUT:  (1) string: a lease file from lease_job
+    OUTPUT: (1) boolean: False if the lease has expired and been requeued
+    '''
+    try:
+        os.utime(lease_file_name, None)
+        return True
+    except OSError:
+        return False
+
+
+def requeue_expired_leases(lease_timeout=LEASE_TIMEOUT, queue_dir=QUEUE_DIR,
+                           grace_period=LEASE_GRACE_PERIOD):
+    '''
+    INPUT:  (1) float: seconds without a heartbeat after which a lease has
+                expired
+            (2) string: the queue directory
+            (3) float: seconds a lease must have looked expired to this
+                process before it is requeued
+    OUTPUT: (1) list of strings: the training_keys of the jobs put back in
+                pending/
+    '''
+    leased_dir = _queue_path(queue_dir, 'leased')
+    requeued = []
+    now = time.time()
+    for lease_file_name in os.listdir(leased_dir):
+        if '.json.' not in lease_file_name:
+            continue
+        lease_path = os.path.join(leased_dir, lease_file_name)
+        try:
+            if now - os.path.getmtime(lease_path) < lease_timeout:
+                _expired_since.pop(lease_path, None)
+                continue
+            if now - _expired_since.setdefault(lease_path, now) < \
+                    grace_period:
+                continue
+            del _expired_since[lease_path]
+            job_file_name = '{}.json'.format(
+                lease_file_name.split('.json.', 1)[0])
+            os.rename(lease_path, _queue_path(queue_dir, 'pending',
+                                              job_file_name))
+        except OSError:
+            # Finished, heartbeated or requeued by someone else meanwhile
+            continue
+        print 'Requeued {} (lease expired)'.format(lease_file_name)
+        requeued.append(job_file_name.rsplit('.json', 1)[0])
+    return requeued
+
+
+def finish_job(job, lease_file_name, status, queue_dir=QUEUE_DIR,
+               **fields):
+    '''
+    INPUT:  (1) dictionary: the leased job
+            (2) string: its lease file
+            (3) string: 'done' or 'failed'
+            (4) string: the queue directory
+            (5) fields to record with the job, eg. state=..., error=...
+    OUTPUT: None, but the job is written to done/ or failed/ and its lease
+            is released
+    '''
+    record = dict(fields, job=job, time=time.time())
+    _write_json(_queue_path(queue_dir, status, _job_file_name(job)), record)
+    if os.path.isfile(lease_file_name):
+        os.remove(lease_file_name)
+
+
+class _Heartbeat(threading.Thread):
+    '''
+    Touches a lease file every interval seconds until stopped, so the lease
+    stays live while the job trains in the main thread. If the lease has
+    expired and been requeued, the job now belongs to another worker: lost
+    is set and a KeyboardInterrupt is raised in the main thread so it stops
+    training (and does not save over the other worker's model).
+    '''
+    def __init__(self, lease_file_name, interval=HEARTBEAT_INTERVAL):
+        super(_Heartbeat, self).__init__()
+        self.daemon = True
+        self.lease_file_name = lease_file_name
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not heartbeat(self.lease_file_name):
+                print 'Lost the lease on {}'.format(self.lease_file_name)
+                self.lost = True
+                thread.interrupt_main()
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def default_worker_id():
+    return '{}_{}'.format(socket.gethostname(), os.getpid())
+
+
+def run_queue_worker(queue_dir=QUEUE_DIR, worker_id=None, n_threads=None,
+                     lease_timeout=LEASE_TIMEOUT,
+                     heartbeat_interval=HEARTBEAT_INTERVAL,
+                     poll_interval=30, exit_when_idle=True):
+    '''
+    INPUT:  (1) string: the queue directory
+            (2) string: a name for this worker, unique across hosts;
+                defaults to <hostname>_<pid>
+            (3) integer: BLAS threads to train with (see pin_threads)
+            (4) float: seconds after which other workers' leases expire
+            (5) float: seconds between heartbeats
+            (6) float: seconds to wait when no job is pending but some are
+                still leased (and may be requeued)
+            (7) boolean: stop once nothing is pending or leased; otherwise
+                keep polling for new jobs
+    OUTPUT: (1) list of strings: the names of the jobs this worker ran
+
+    Jobs are leased one at a time and run with run_sweep_job, so the model
+    cache, warm starts and early stopping work as in a local sweep. The
+    models are written to the shared models/ directory; the metrics go to
+    the worker's own manifest and results store under workers/. A job whose
+    lease is lost part way through is abandoned without being reported.
+    '''
+    if worker_id is None:
+        worker_id = default_worker_id()
+    if n_threads is not None:
+        pin_threads(n_threads)
+        check_thread_count(n_threads)
+    make_queue(queue_dir)
+    manifest_path = _queue_path(queue_dir, 'workers',
+                                os.path.join(worker_id, 'manifest.jsonl'))
+    model_param = set_basic_model_param(0)
+    data = load_and_format_mnist_data(model_param, categorical_y=False)
+    finished = []
+    while True:
+        requeue_expired_leases(lease_timeout, queue_dir)
+        job, lease_file_name = lease_job(worker_id, queue_dir)
+        if job is None:
+            if exit_when_idle and not queue_job_keys(queue_dir)['leased']:
+                break
+            time.sleep(poll_interval)
+            continue
+        print 'Worker {} leased {}'.format(worker_id, job['name_to_append'])
+        beat = _Heartbeat(lease_file_name, heartbeat_interval)
+        beat.start()
+        try:
+            try:
+                run_sweep_job(job, *data, manifest_path=manifest_path)
+            finally:
+                beat.stop()
+        except KeyboardInterrupt:
+            if not beat.lost:
+                raise
+            print 'Abandoned {}'.format(job['name_to_append'])
+            continue
+        except Exception as e:
+            print 'Job {} failed: {}'.format(job['name_to_append'], repr(e))
+            status, fields = 'failed', {'error': repr(e)}
+        else:
+            status, fields = 'done', {'state': load_manifest(
+                manifest_path)[job['name_to_append']]}
+            finished.append(job['name_to_append'])
+        finish_job(job, lease_file_name, status, queue_dir,
+                   worker_id=worker_id, **fields)
+    return finished
+
+
+def collect_queue_results(queue_dir=QUEUE_DIR, manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) string: the queue directory
+            (2) string: the sweep manifest to record the finished jobs in
+    OUTPUT: (1) integer: the number of result rows merged
+
+    Every job in done/ is recorded as finished in the manifest, as if it had
+    been trained locally, and the workers' results stores are merged into
+    the one next to the manifest.
+    '''
+    job_states = load_manifest(manifest_path)
+    done_dir = _queue_path(queue_dir, 'done')
+    for file_name in sorted(os.listdir(done_dir)):
+        if '.tmp' in file_name:
+            continue
+        record = json.load(open(os.path.join(done_dir, file_name)))
+        state = dict(record['state'])
+        job_state = job_states.get(record['job']['name_to_append'])
+        if job_state is not None and job_state.get('time') >= state['time']:
+            continue
+        for key in ['name_to_append', 'seed', 'status', 'time']:
+            state.pop(key, None)
+        state.setdefault('started_at', record['time'])
+        record_job_status(manifest_path, record['job'], 'finished',
+                          worker_id=record['worker_id'], **state)
+    workers_dir = _queue_path(queue_dir, 'workers')
+    worker_results = [os.path.join(workers_dir, worker_id, 'results.h5')
+                      for worker_id in sorted(os.listdir(workers_dir))]
+    return merge_results(results_path_for_manifest(manifest_path),
+                         [results_path for results_path in worker_results
+                          if os.path.isfile(results_path)])
+
+
+def _cache_done_job(key, queue_dir=QUEUE_DIR):
+    '''
+    INPUT:  (1) string: the training_key of a job in done/
+            (2) string: the queue directory
+    OUTPUT: None, but the model the job's record points to is added to the
+            model cache (a resumed job's model is not cached when trained)
+    '''
+    record = json.load(open(_queue_path(queue_dir, 'done',
+                                        '{}.json'.format(key))))
+    cache_model(key, {result_key: record['state'][result_key]
+                      for result_key in ['json_file_name',
+                                         'weights_file_name',
+                                         'history_file_name', 'n_epochs_run',
+                                         'test_score', 'test_accuracy',
+                                         'val_score', 'val_accuracy',
+                                         'run_time', 'epochs_done']
+                      if result_key in record['state']})
+
+
+def run_queue_coordinator(jobs, queue_dir=QUEUE_DIR,
+                          lease_timeout=LEASE_TIMEOUT, poll_interval=30,
+                          manifest_path=MANIFEST_PATH):
+    '''
+    INPUT:  (1) list of dictionaries: jobs, eg. from build_meshgrid_jobs
+            (2) string: the queue directory, on a file system shared with
+                the workers
+            (3) float: seconds without a heartbeat after which a lease
+                expires and its job is requeued
+            (4) float: seconds between checks of the queue
+            (5) string: the sweep manifest to record the finished jobs in
+    OUTPUT: (1) list of strings: the names of the jobs that failed
+
+    Publishes the jobs not yet finished in the manifest, then waits for the
+    workers (see run_queue_worker, started on any number of hosts) to work
+    through them, requeueing expired leases as it goes. The results are
+    collected into the manifest and results store once every job is done
+    or has failed. Jobs that train the same model as another (see
+    training_key) are published once; the others are then linked to its
+    cached model.
+    '''
+    jobs = unfinished_jobs(jobs, manifest_path)
+    print 'Published {} jobs to {}'.format(publish_jobs(jobs, queue_dir),
+                                           queue_dir)
+    job_keys = {}
+    for job in jobs:
+        job_keys.setdefault(training_key(job), []).append(job)
+    keys = set(job_keys)
+    while True:
+        requeue_expired_leases(lease_timeout, queue_dir)
+        queued_keys = queue_job_keys(queue_dir)
+        n_done = len(keys & queued_keys['done'])
+        failed = keys & queued_keys['failed'] - queued_keys['done']
+        print '{} of {} jobs done, {} leased, {} failed'.format(
+            n_done, len(keys), len(keys & queued_keys['leased']), len(failed))
+        if n_done + len(failed) >= len(keys):
+            break
+        time.sleep(poll_interval)
+    collect_queue_results(queue_dir, manifest_path)
+
+    job_states = load_manifest(manifest_path)
+    for key in keys & queued_keys['done']:
+        for job in job_keys[key]:
+            if is_job_finished(job_states.get(job['name_to_append']), job):
+                continue
+            model_param = set_basic_model_param(
+                job['name_to_append'], dropout_scalar=job['dropout_scalar'],
+                batchsize=job['batchsize'], **job['fit_param'])
+            if not reuse_cached_model(job, model_param,
+                                      manifest_path=manifest_path):
+                _cache_done_job(key, queue_dir)
+                reuse_cached_model(job, model_param,
+                                   manifest_path=manifest_path)
+    return sorted(job['name_to_append'] for key in failed
+                  for job in job_keys[key])